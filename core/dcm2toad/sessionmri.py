@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
-import glob
 import sequencemri
 
+from core.dicom.scanner import Scanner
+
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
@@ -108,37 +109,51 @@ class SessionMRI(object):
         return False
 
     #@TODO test for uncombine images
-    def isUnfSession(self):
-        filesOrDirectorys = os.listdir(self.__directory)
+    def isUnfSession(self, scanner=None):
+        """Determine if the directory is a session reshuffled by unf: sequences directories that contain dicoms
+
+        Args:
+            scanner: a Scanner whose tree contain this session, the session directory is scanned if None
+
+        """
+        if scanner is None:
+            scanner = Scanner(self.__directory)
+        if scanner.listFiles(self.__directory):
+            return False
         nbDicoms = 0
-        for filesOrDirectory in filesOrDirectorys:
-            fullFileName = os.path.join(self.__directory, filesOrDirectory)
-            if os.path.isfile(fullFileName):
-                return False
-            if filesOrDirectory.startswith("echo_"):
+        for directory in scanner.listDirectories(self.__directory):
+            if directory.startswith("echo_"):
                 return False
-            nbDicoms +=len(glob.glob("{}/*.dcm".format(fullFileName)))
+            nbDicoms += len(scanner.listFiles(os.path.join(self.__directory, directory), "*.dcm"))
         return nbDicoms > 0
 
-    def initializeMRISequences(self):
-        directories = os.listdir(self.__directory)
-        for directory in directories:
+    def initializeMRISequences(self, scanner=None):
+        """Create a sequence for every directory of the session that contain dicoms
+
+        Args:
+            scanner: a Scanner whose tree contain this session, the session directory is scanned if None
+
+        """
+        if scanner is None:
+            scanner = Scanner(self.__directory)
+        for directory in scanner.listDirectories(self.__directory):
             fullPath = os.path.join(self.__directory, directory)
-            if len(glob.glob("{}/*.dcm".format(fullPath))) > 0:
+            nbImages = len(scanner.listFiles(fullPath, "*.dcm"))
+            if nbImages > 0:
                 self.__sequences[directory]= sequencemri.SequenceMRI(name = directory,
                                                                 directory = fullPath,
-                                                                nbImages = len(glob.glob("{}/*.dcm".format(fullPath))))
-
-            elif len(glob.glob("{}/echo_*/*.dcm".format(fullPath))) > 0:
+                                                                nbImages = nbImages)
+            elif any(scanner.listFiles(os.path.join(fullPath, echoesDirectory), "*.dcm")
+                     for echoesDirectory in scanner.listDirectories(fullPath) if echoesDirectory.startswith("echo_")):
                 #this is a multi echoes sequence"
-                echoesDirectories = os.listdir(fullPath)
-                for echoesDirectory in echoesDirectories:
+                for echoesDirectory in scanner.listDirectories(fullPath):
                     fullEchoesPath = os.path.join(fullPath, echoesDirectory)
-                    if len(glob.glob("{}/*.dcm".format(fullEchoesPath))) > 0:
+                    nbImages = len(scanner.listFiles(fullEchoesPath, "*.dcm"))
+                    if nbImages > 0:
                         name = os.path.join(directory, echoesDirectory)
-                        self.__sequences[name] = sequencemri.SequenceMRI(name = os.path.join(directory, echoesDirectory),
+                        self.__sequences[name] = sequencemri.SequenceMRI(name = name,
                                                                         directory = fullEchoesPath,
-                                                                        nbImages = len(glob.glob("{}/*.dcm".format(fullEchoesPath))))
+                                                                        nbImages = nbImages)
 
         self.__comparable = "".join([sequence.getComparable() for name , sequence in self.__sequences.iteritems()])
 
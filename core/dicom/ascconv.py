@@ -1,22 +1,41 @@
 # -*- coding: utf-8 -*-
+import collections
+import mmap
 import math
 
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
 
+ASCCONV_BEGIN = b"### ASCCONV BEGIN ###"
+ASCCONV_END = b"### ASCCONV END ###"
+
 class Ascconv(object):
 
-    def __init__(self, filename):
+    #parameters of the series already parsed, the ASCCONV block is identical for every slices of a series
+    __series = {}
+
+    def __init__(self, filename, ascconv=None, series=None):
+        """Protocol parameters of a Siemens acquisition read from the ASCCONV block of a dicom file
+
+        Args:
+            filename: a dicom file name
+            ascconv: the text of the ASCCONV block if it was already extracted from the header, see leanheader,
+                     the file is searched otherwise
+            series: an identifier of the series of the file, like the series instance uid. The block is only
+                    extracted and parsed for the first file of a series
+
+        """
         self.__fileName = filename
         self.__ascconvFound = False
+        self.__parameters = collections.OrderedDict()
         self.__phaseEncodingDirection = 1
         self.__patFactor = 1
         self.__epiFactor = 1
         self.__phaseResolution = 1
         self.__phaseOversampling = 1
         self.__numberArrayCoil = 0
-        self.__initialize()
+        self.__initialize(ascconv, series)
 
     def __repr__(self):
         return "filename={}, phaseEncodingDirection={}, patFactor={}, epiFactor={}, phaseResolution={}, phaseOversampling ={}" \
@@ -51,55 +70,59 @@ class Ascconv(object):
     def getNumberArrayCoil(self):
         return self.__numberArrayCoil
 
+    def getParameters(self):
+        """Return every parameters of the ASCCONV block
+
+        Returns:
+            an ordered dictionary whose keys are the names of the parameters and values an int, a float or a string
+        """
+        return self.__parameters
+
+
+    def __initialize(self, ascconv, series):
+        if series is not None and series in Ascconv.__series:
+            parameters = Ascconv.__series[series]
+        else:
+            if ascconv is None:
+                ascconv = extract(self.__fileName)
+            parameters = parse(ascconv) if ascconv is not None else None
+            if series is not None:
+                Ascconv.__series[series] = parameters
+
+        if parameters is None:
+            return
+        self.__ascconvFound = True
+        self.__parameters = parameters
+
+        for key, value in parameters.iteritems():
+            key = key.lower()
+
+            if "coil" in key and "meas" in key and "lrxchannelconnected" in key:
+                self.__numberArrayCoil += 1
 
-    def __initialize(self):
-        with open(self.__fileName, 'r') as f:
-            ascconv = []
-            for line in f.readlines():
-                if "### ASCCONV BEGIN ###" in line:
-                    self.__ascconvFound = True
-                if "### ASCCONV END ###" in line:
-                    break
-                if self.__ascconvFound:
-                    ascconv.append(line)
-
-            for line in ascconv:
-                line = line.lower()
-
-                if "coil" in line and "meas" in line and "lrxchannelconnected" in line:
-                    self.__numberArrayCoil += 1
-
-                elif "sslicearray.asslice" in line and ".dinplanerot" in line:
-                    self.__phaseEncodingDirection = int(self.__returnPhaseEncodingDirection(line))
-
-                elif "spat.laccelfactpe" in line:
-                    try:
-                        self.__patFactor = float(line.split("=")[-1].strip())
-                    except ValueError:
-                        pass
-                elif "skspace.lphaseencodinglines" in line:
-                    try:
-                        self.__epiFactor = int(line.split("=")[-1].strip())
-                    except ValueError:
-                        pass
-                elif "skspace.dphaseresolution" in line:
-                    try:
-                        self.__phaseResolution= int(line.split("=")[-1].strip())
-                    except ValueError:
-                        pass
-
-                elif "skspace.dphaseoversamplingfordialog" in line:
-                    try:
-                        self.__phaseOversampling = int(line.split("=")[-1].strip())
-                    except ValueError:
-                        pass
-
-    def __returnPhaseEncodingDirection(self, line):
+            elif "sslicearray.asslice" in key and ".dinplanerot" in key:
+                self.__phaseEncodingDirection = int(self.__returnPhaseEncodingDirection(value))
+
+            elif "spat.laccelfactpe" in key:
+                if isinstance(value, (int, long, float)):
+                    self.__patFactor = float(value)
+
+            elif "skspace.lphaseencodinglines" in key:
+                if isinstance(value, (int, long)):
+                    self.__epiFactor = value
+
+            elif "skspace.dphaseresolution" in key:
+                if isinstance(value, (int, long)):
+                    self.__phaseResolution = value
+
+            elif "skspace.dphaseoversamplingfordialog" in key:
+                if isinstance(value, (int, long)):
+                    self.__phaseOversampling = value
+
+    def __returnPhaseEncodingDirection(self, value):
 
         tolerance = 0.2
-        try:
-            value = float(line.split("=")[-1].strip())
-        except ValueError:
+        if not isinstance(value, (int, long, float)):
             return 1
 
         if value < tolerance and value > -tolerance:
@@ -114,4 +137,74 @@ class Ascconv(object):
         if (value < math.copysign((math.pi/2)-tolerance,-0.0)) and (value > math.copysign((math.pi/2)+tolerance, -0.0)):
              return 3  #L>>R
 
-        return 1
\ No newline at end of file
+        return 1
+
+
+def extract(filename):
+    """Extract the ASCCONV block of a dicom file
+
+    The file is mapped into memory and searched for the markers of the block, so only the pages
+    up to the end of the block are actually read
+
+    Args:
+        filename: a dicom file name
+
+    Returns:
+        the text of the block, from the begin marker up to the end marker, None if there is no block
+    """
+    try:
+        with open(filename, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError, mmap.error):
+        #an empty file cannot be mapped
+        return None
+    try:
+        return search(buffer)
+    finally:
+        buffer.close()
+
+
+def search(buffer):
+    """Return the ASCCONV block found into a string or a buffer, None if there is no block
+    """
+    begin = buffer.find(ASCCONV_BEGIN)
+    if begin == -1:
+        return None
+    end = buffer.find(ASCCONV_END, begin)
+    return buffer[begin:end] if end != -1 else buffer[begin:]
+
+
+def parse(ascconv):
+    """Parse the lines of an ASCCONV block
+
+    Args:
+        ascconv: the text of the block
+
+    Returns:
+        an ordered dictionary whose keys are the names of the parameters and values an int,
+        a float or a string without its quotes
+    """
+    parameters = collections.OrderedDict()
+    for line in ascconv.split("\n"):
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        key = key.strip()
+        value = value.strip()
+        if not key or key.startswith("#"):
+            continue
+        if value.startswith('"'):
+            parameters[key] = value.strip('"')
+            continue
+        value = value.split("#", 1)[0].strip()
+        try:
+            if value.lower().startswith("0x"):
+                parameters[key] = int(value, 16)
+            else:
+                parameters[key] = int(value)
+        except ValueError:
+            try:
+                parameters[key] = float(value)
+            except ValueError:
+                parameters[key] = value
+    return parameters
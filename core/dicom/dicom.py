@@ -1,13 +1,7 @@
-import os
-import sys
 import struct
 
-sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
-from pydicom.filereader import read_file
-from pydicom.tag import Tag
-from pydicom.errors import InvalidDicomError
-
 from ascconv import Ascconv
+import leanheader
 from lib import util
 
 
@@ -35,46 +29,37 @@ class Dicom(Ascconv):
 
     def __initialized(self):
 
-        try:
-            header =  read_file(self.__filename, defer_size=None, stop_before_pixels=True)
-
-        except InvalidDicomError:
+        header = leanheader.read(self.__filename)
+        if header is None:
             self.__isDicom = False
             return
-        try:
 
-            #find the manufacturer
-            self.__manufacturer = 'UNKNOWN'
-            if 'Manufacturer' in header:
-                for manufacturer in manufacturers:
-                    if manufacturer in header.Manufacturer:
-                        self.__manufacturer = manufacturer
-
-            self.__patientName = util.slugify(header.PatientName)
-            self.__seriesDescription = util.slugify(header.SeriesDescription)
-            self.__seriesNumber = header.SeriesNumber
-            self.__instanceNumber = header.InstanceNumber
-            self.__echoTime = header.EchoTime
+        #find the manufacturer
+        self.__manufacturer = 'UNKNOWN'
+        if 'Manufacturer' in header:
+            for manufacturer in manufacturers:
+                if manufacturer in str(header['Manufacturer']):
+                    self.__manufacturer = manufacturer
+
+        try:
+            self.__patientName = util.slugify(str(header['PatientName']))
+            self.__seriesDescription = util.slugify(str(header['SeriesDescription']))
+            self.__seriesNumber = int(header['SeriesNumber'])
+            self.__instanceNumber = int(header['InstanceNumber'])
+            #Philips store the echo time into a private tag
+            self.__echoTime = str(header['EchoTime'] if 'EchoTime' in header else header['PhilipsEchoTime'])
             self.__isDicom = True
 
-        except AttributeError as a:
-            if "EchoTime" in a.message:
-                try:
-                    self.__echoTime = header[Tag((0x2001, 0x1025))].value
-                    self.__isDicom = True
-                except KeyError as k:
-                    self.__isDicom = False
-            else:
-                 self.__isDicom = False
+        except (KeyError, TypeError, ValueError):
+            self.__isDicom = False
 
         if self.isSiemens():
-            #inherith Siemens ascconv properties
-            Ascconv.__init__(self, self.__filename)
-            bandwidthPerPixelPhaseEncodeTag = Tag((0x0019, 0x1028))
+            #inherith Siemens ascconv properties, the file is only read again if the block was not found into the header
+            Ascconv.__init__(self, self.__filename, header['Ascconv'], header.get('SeriesInstanceUID'))
 
             try:
-                if header.has_key(bandwidthPerPixelPhaseEncodeTag):
-                    val = header[bandwidthPerPixelPhaseEncodeTag].value
+                if 'BandwidthPerPixelPhaseEncode' in header:
+                    val = header['BandwidthPerPixelPhaseEncode']
                     try:
                         self.__bandwidthPerPixelPhaseEncode = float(val)
                     except ValueError:
@@ -85,7 +70,7 @@ class Dicom(Ascconv):
                               self.getPatFactor() * self.getPhaseResolution() * \
                               self.getPhaseOversampling()
 
-            except (KeyError, IndexError, TypeError, ValueError):
+            except (KeyError, IndexError, TypeError, ValueError, struct.error):
                 self.__echoSpacing = None
 
 
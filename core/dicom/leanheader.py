@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+from struct import Struct
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from pydicom.util import leanread
+from pydicom.filereader import read_file
+from pydicom.tag import Tag
+from pydicom.errors import InvalidDicomError
+
+import ascconv
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Read the few attributes of a dicom header required by toad
+
+The data elements are walked in a single pass from the beginning of the file. Values are only read for
+the elements of interest, the others are skipped, and the walk stop once the last element of interest
+have been passed or the pixel data is reached. Nested sequences are skipped as a whole.
+
+Headers that this walker cannot handle, like deflated transfer syntaxes, are read with pydicom instead.
+"""
+
+#elements of interest, the key is the name of the value into the header returned by read()
+TAGS = {'Manufacturer': (0x0008, 0x0070),
+        'SeriesDescription': (0x0008, 0x103e),
+        'PatientName': (0x0010, 0x0010),
+        'EchoTime': (0x0018, 0x0081),
+        'BandwidthPerPixelPhaseEncode': (0x0019, 0x1028),
+        'SeriesInstanceUID': (0x0020, 0x000e),
+        'SeriesNumber': (0x0020, 0x0011),
+        'InstanceNumber': (0x0020, 0x0013),
+        'PhilipsEchoTime': (0x2001, 0x1025)}
+
+#Siemens store the protocol, including the ASCCONV block, into the private CSA headers of group 0x0029
+ASCCONV_GROUP = 0x0029
+
+#elements whose value may be binary when the value representation is implicit or unknown
+BINARY_TAGS = [(0x0019, 0x1028)]
+
+PIXEL_DATA = (0x7fe0, 0x0010)
+LAST_TAG = max(TAGS.values())
+UNDEFINED_LENGTH = 0xFFFFFFFF
+
+
+class LeanReadError(Exception):
+    """The header use a structure that the walker does not handle"""
+    pass
+
+
+def read(filename):
+    """Read the attributes of a dicom file required by toad
+
+    Args:
+        filename: a file name
+
+    Returns:
+        a dictionary with a key for each element of TAGS found into the header plus an Ascconv key, the
+        text of the ASCCONV block or None. None if the file is not a dicom. Decimal strings, like EchoTime,
+        are kept as stored, reshuffle name the echo directories after them.
+    """
+    try:
+        return leanRead(filename)
+    except LeanReadError:
+        return pydicomRead(filename)
+
+
+def leanRead(filename):
+    """Walk the data elements of a dicom file and read the values of the elements of interest
+
+    Args:
+        filename: a file name
+
+    Returns:
+        see read()
+
+    Raises:
+        LeanReadError: the header could not be walked
+    """
+    try:
+        with leanread.dicomfile(filename) as dicom:
+            if dicom.preamble is None:
+                return None
+            transferSyntax = None
+            fileMetaElements = leanread.data_element_generator(dicom.fobj, False, True,
+                                                               stop_when=lambda group, element: group != 2)
+            for tag, vr, length, value, position in fileMetaElements:
+                if tag == (0x0002, 0x0010):
+                    transferSyntax = value.rstrip(b' \0')
+            if transferSyntax is None:
+                raise LeanReadError("No transfer syntax into {}".format(filename))
+            try:
+                isImplicitVR, isLittleEndian = leanread.transfer_syntax(transferSyntax)
+            except NotImplementedError, error:
+                raise LeanReadError(str(error))
+            return __walk(dicom.fobj, isImplicitVR, isLittleEndian)
+    except (IOError, OSError):
+        return None
+    except (ValueError, TypeError, IndexError), error:
+        raise LeanReadError(str(error))
+
+
+def pydicomRead(filename):
+    """Read the attributes of a dicom file required by toad with pydicom
+
+    The ASCCONV block is searched into the whole file, see ascconv.extract()
+
+    Args:
+        filename: a file name
+
+    Returns:
+        see read()
+    """
+    try:
+        dataset = read_file(filename, defer_size=None, stop_before_pixels=True)
+    except (InvalidDicomError, IOError, OSError):
+        return None
+    header = {'Ascconv': ascconv.extract(filename)}
+    for name, tag in TAGS.iteritems():
+        if Tag(tag) in dataset:
+            header[name] = dataset[Tag(tag)].value
+    return header
+
+
+def __walk(fileobj, isImplicitVR, isLittleEndian):
+    """Walk the data elements of the dataset
+
+    Args:
+        fileobj: a file object positioned at the beginning of the dataset
+        isImplicitVR: the value representations are implicit
+        isLittleEndian: the values are encoded in little endian
+
+    Returns:
+        see read()
+    """
+    endian = "<" if isLittleEndian else ">"
+    elementStruct = Struct(endian + "HHL") if isImplicitVR else Struct(endian + "HH2sH")
+    itemStruct = Struct(endian + "HHL")
+    lengthStruct = Struct(endian + "L")
+    doubleStruct = Struct(endian + "d")
+    tags = dict((tag, name) for name, tag in TAGS.iteritems())
+
+    header = {'Ascconv': None}
+    depth = 0
+    while True:
+        bytes = fileobj.read(8)
+        if len(bytes) < 8:
+            break
+        group, element, length = itemStruct.unpack(bytes)
+
+        #items and delimiters never have a value representation
+        if group == 0xFFFE:
+            if element == 0xE000 and length != UNDEFINED_LENGTH:
+                fileobj.seek(length, 1)
+            elif element == 0xE000:
+                depth += 1
+            elif element == 0xE0DD:
+                depth -= 1
+            elif element == 0xE00D:
+                depth -= 1
+            continue
+
+        vr = None
+        if not isImplicitVR:
+            group, element, vr, length = elementStruct.unpack(bytes)
+            if vr in leanread.extra_length_VRs_b:
+                length = lengthStruct.unpack(fileobj.read(4))[0]
+
+        tag = (group, element)
+        if depth == 0 and (tag >= PIXEL_DATA or tag > LAST_TAG):
+            break
+
+        if length == UNDEFINED_LENGTH:
+            #only sequences and encapsulated pixel data, like an icon image, are walked as nested items.
+            #An explicit UN sequence is encoded with an implicit value representation
+            if vr not in [None, b'SQ'] and tag != PIXEL_DATA:
+                raise LeanReadError("Undefined length for element {} with VR {}".format(tag, vr))
+            depth += 1
+            continue
+
+        if depth > 0 or (tag not in tags and group != ASCCONV_GROUP):
+            fileobj.seek(length, 1)
+            continue
+
+        value = fileobj.read(length)
+        if len(value) < length:
+            break
+        if tag in tags:
+            if vr == b'FD' and length == 8:
+                value = doubleStruct.unpack(value)[0]
+            elif tag not in BINARY_TAGS or vr not in [None, b'OB', b'UN']:
+                value = value.strip(b' \0')
+            header[tags[tag]] = value
+        if group == ASCCONV_GROUP and header['Ascconv'] is None:
+            header['Ascconv'] = ascconv.search(value)
+    return header
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+import fnmatch
+import os
+
+from core.dicom import leanheader
+from lib import util
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Scanner(object):
+
+    def __init__(self, source, nbThreads=16, nbProcesses=None):
+        """Index a tree of dicom files in a single pass
+
+        Directories are listed concurrently by a pool of threads since listing a directory on a network
+        filesystem is mostly waiting. Dicom headers are parsed by a pool of processes. The tree and the
+        headers are only scanned the first time they are requested.
+
+        Args:
+            source: the root directory of the tree
+            nbThreads: the number of threads that list directories
+            nbProcesses: the number of processes that parse dicom headers, the number of cpus if None
+
+        """
+        self.__source = os.path.abspath(source)
+        self.__nbThreads = nbThreads
+        self.__nbProcesses = nbProcesses if nbProcesses is not None else multiprocessing.cpu_count()
+        self.__tree = None
+        self.__headers = None
+
+
+    def getSource(self):
+        return self.__source
+
+
+    def getTree(self):
+        """Return the content of every directory of the tree
+
+        Returns:
+            a dictionary whose keys are absolute directories names and values a tuple of 2 sorted lists:
+            the names of the subdirectories and the names of the files
+        """
+        if self.__tree is None:
+            self.__tree = {}
+            if os.path.isdir(self.__source):
+                pool = ThreadPool(self.__nbThreads)
+                try:
+                    directories = [self.__source]
+                    while directories:
+                        subdirectories = []
+                        for directory, names, files in pool.map(listDirectory, directories):
+                            self.__tree[directory] = (names, files)
+                            subdirectories.extend([os.path.join(directory, name) for name in names])
+                        directories = subdirectories
+                finally:
+                    pool.close()
+                    pool.join()
+        return self.__tree
+
+
+    def getDirectories(self):
+        """Return every directory of the tree, a directory always come before its subdirectories
+        """
+        return sorted(self.getTree().keys())
+
+
+    def listDirectories(self, directory):
+        """Return the names of the subdirectories of a directory of the tree
+
+        Args:
+            directory: a directory of the tree
+
+        Returns:
+            a sorted list of names, an empty list if the directory is not part of the tree
+        """
+        return self.getTree().get(os.path.abspath(directory), ([], []))[0]
+
+
+    def listFiles(self, directory, pattern=None):
+        """Return the names of the files of a directory of the tree
+
+        Args:
+            directory: a directory of the tree
+            pattern: a glob like pattern the names must match, hidden files never match a pattern
+
+        Returns:
+            a sorted list of names, an empty list if the directory is not part of the tree
+        """
+        files = self.getTree().get(os.path.abspath(directory), ([], []))[1]
+        if pattern is None:
+            return files
+        return [name for name in files if not name.startswith('.') and fnmatch.fnmatch(name, pattern)]
+
+
+    def getHeaders(self):
+        """Parse the header of every file of the tree, files that are not dicoms are ignored
+
+        Returns:
+            a list of Header
+        """
+        if self.__headers is None:
+            filenames = []
+            for directory, (names, files) in sorted(self.getTree().iteritems()):
+                filenames.extend([os.path.join(directory, name) for name in files])
+
+            if self.__nbProcesses > 1 and len(filenames) > 1:
+                pool = multiprocessing.Pool(self.__nbProcesses)
+                try:
+                    results = pool.map(readHeader, filenames, chunksize=max(1, min(64, len(filenames) / self.__nbProcesses)))
+                    pool.close()
+                except:
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+            else:
+                results = map(readHeader, filenames)
+            self.__headers = [Header(*result) for result in results if result is not None]
+        return self.__headers
+
+
+    def getSessions(self):
+        """Group the dicom files of the tree by session and by sequence
+
+        Returns:
+            a dictionary whose keys are sessions names and values a dictionary whose keys are
+            sequences names and values a list of Header sorted by instance number
+        """
+        sessions = {}
+        for header in self.getHeaders():
+            sessions.setdefault(header.getSessionName(), {}).setdefault(header.getSequenceName(), []).append(header)
+        for sequences in sessions.itervalues():
+            for headers in sequences.itervalues():
+                headers.sort(key=lambda header: header.getInstanceNumber())
+        return sessions
+
+
+class Header(object):
+
+    def __init__(self, filename, patientName, seriesNumber, seriesDescription, instanceNumber, echoTime):
+        """The few attributes of a dicom file required to sort it into a session and a sequence
+
+        see Dicom for a complete description of a dicom file
+
+        """
+        self.__filename = filename
+        self.__patientName = patientName
+        self.__seriesNumber = seriesNumber
+        self.__seriesDescription = seriesDescription
+        self.__instanceNumber = instanceNumber
+        self.__echoTime = echoTime
+
+    def __repr__(self):
+        return "filename = {}, patientName={}, seriesDescription={}, seriesNumber={}, instanceNumber={}, echoTime={}"\
+                .format(self.__filename, self.__patientName, self.__seriesDescription, self.__seriesNumber,
+                        self.__instanceNumber, self.__echoTime)
+
+    def getFileName(self):
+        return self.__filename
+
+    def getSequenceName(self):
+        return "{:02d}-{}".format(self.__seriesNumber, self.__seriesDescription)
+
+    def getSessionName(self):
+        return self.__patientName
+
+    def getSeriesDescription(self):
+        return self.__seriesDescription
+
+    def getSeriesNumber(self):
+        return self.__seriesNumber
+
+    def getInstanceNumber(self):
+        return self.__instanceNumber
+
+    def getEchoTime(self):
+        return self.__echoTime
+
+
+def listDirectory(directory):
+    """List the subdirectories and the files of a directory, symbolic links to directories are not followed
+
+    Args:
+        directory: an absolute directory name
+
+    Returns:
+        a 3 elements tuple: the directory, a sorted list of subdirectories names and a sorted list of files names
+    """
+    names = []
+    files = []
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return directory, names, files
+    for entry in sorted(entries):
+        path = os.path.join(directory, entry)
+        if os.path.isdir(path):
+            if not os.path.islink(path):
+                names.append(entry)
+        elif os.path.isfile(path):
+            files.append(entry)
+    return directory, names, files
+
+
+def readHeader(filename):
+    """Read the attributes of a dicom file required to sort it, the pixels data are never read
+
+    Args:
+        filename: a file name
+
+    Returns:
+        a tuple of the arguments of Header, None if the file is not a dicom
+    """
+    header = leanheader.read(filename)
+    if header is None:
+        return None
+
+    #Philips store the echo time into a private tag
+    echoTime = header.get('EchoTime', header.get('PhilipsEchoTime'))
+    if echoTime is None:
+        return None
+
+    try:
+        return (filename, util.slugify(str(header['PatientName'])), int(header['SeriesNumber']),
+                util.slugify(str(header['SeriesDescription'])), int(header['InstanceNumber']), str(echoTime))
+    except (KeyError, TypeError, ValueError):
+        return None
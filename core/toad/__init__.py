@@ -3,4 +3,4 @@ __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
 
-__all__=[ "config", "generictask", "load", "lock", "logger", "subject", "subjectmanager", "tasksmanager", "validation"]
\ No newline at end of file
+__all__=[ "config", "generictask", "load", "lock", "logger", "planner", "subject", "subjectmanager", "tasksmanager", "validation", "workflow"]
\ No newline at end of file
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import fcntl
+import errno
+import os
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Broker(object):
+
+    def __init__(self, tokensFile):
+        """Share the cpus of a node among the toad pipelines running on it
+
+        Each process that deploy threads register the number of threads it was granted into a token file
+        shared by all pipelines of the node. Tokens held by processes that do not exist anymore are
+        automatically reclaimed.
+
+        Args:
+            tokensFile: the file that hold the tokens of the node
+
+        """
+        self.__tokensFile = tokensFile
+
+
+    def getAvailableCpus(self):
+        """Return the number of cpus this process may use
+
+        The value is the lowest of the number of cpus of the node, the cpus allowed by the
+        affinity mask and the cpu quota of the cgroup.
+
+        Returns:
+            the number of cpus available, at least 1
+
+        """
+        cpus = [multiprocessing.cpu_count()]
+        allowed = self.__getAffinityCpus()
+        if allowed:
+            cpus.append(allowed)
+        quota = self.__getCgroupCpuQuota()
+        if quota:
+            cpus.append(quota)
+        return max(1, min(cpus))
+
+
+    def getAvailableMemory(self):
+        """Return the memory this process may still allocate
+
+        Returns:
+            the number of bytes available, None if it cannot be determine
+
+        """
+        memories = []
+        available = self.__readMeminfo("MemAvailable")
+        if available is not None:
+            memories.append(available)
+
+        limit, usage = self.__getCgroupMemory()
+        if limit is not None and usage is not None:
+            memories.append(max(0, limit - usage))
+
+        if memories:
+            return min(memories)
+        return None
+
+
+    def getNbActiveTasks(self):
+        """Return the number of processes currently holding tokens on this node
+
+        Returns:
+            the number of active processes
+        """
+        tokens = self.__transaction()
+        if tokens is None:
+            return 0
+        return len(tokens)
+
+
+    def getNbFreeCpus(self):
+        """Return the number of cpus available that are not held by any process of this node
+
+        Returns:
+            the number of free cpus
+        """
+        tokens = self.__transaction()
+        used = sum(tokens.values()) if tokens else 0
+        return max(0, self.getAvailableCpus() - used)
+
+
+    def acquire(self, threads):
+        """Request a number of threads for the current process
+
+        A previous grant of the current process is replaced by the new one.
+
+        Args:
+            threads: the number of threads requested
+
+        Returns:
+            the number of threads granted, at least 1
+
+        """
+        result = [threads]
+
+        def __grant(tokens):
+            used = sum(value for pid, value in tokens.iteritems() if pid != os.getpid())
+            result[0] = max(1, min(threads, self.getAvailableCpus() - used))
+            tokens[os.getpid()] = result[0]
+
+        self.__transaction(__grant)
+        return result[0]
+
+
+    def release(self):
+        """Give back the threads held by the current process
+
+        """
+        self.__transaction(lambda tokens: tokens.pop(os.getpid(), None))
+
+
+    def __transaction(self, function=None):
+        """Read, purge, update and write the token file while holding an exclusive lock
+
+        If the token file cannot be open, the tokens are not shared and the function is apply
+        on an empty dictionary
+
+        Args:
+            function: a function that receive and may modify the dictionary of tokens {pid: threads}
+
+        Returns:
+            the dictionary of tokens
+        """
+        tokens = {}
+        try:
+            descriptor = os.open(self.__tokensFile, os.O_RDWR | os.O_CREAT, 0o666)
+        except OSError:
+            if function is not None:
+                function(tokens)
+            return None
+        try:
+            #the token file is shared by the pipelines of every users
+            os.fchmod(descriptor, 0o666)
+        except OSError:
+            pass
+
+        with os.fdopen(descriptor, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            for line in f.readlines():
+                try:
+                    pid, threads = [int(token) for token in line.split()]
+                except ValueError:
+                    continue
+                if self.__isAlive(pid):
+                    tokens[pid] = threads
+            if function is not None:
+                function(tokens)
+            f.seek(0)
+            f.truncate()
+            for pid, threads in tokens.iteritems():
+                f.write("{} {}\n".format(pid, threads))
+        return tokens
+
+
+    def __isAlive(self, pid):
+        """Determine if a process exists
+
+        Args:
+            pid: a process id
+
+        Returns:
+            True if the process exists, False otherwise
+        """
+        try:
+            os.kill(pid, 0)
+        except OSError, error:
+            return error.errno == errno.EPERM
+        return True
+
+
+    def __getAffinityCpus(self):
+        """Count the cpus allowed by the affinity mask of the current process
+
+        Returns:
+            the number of cpus allowed, None if it cannot be determine
+        """
+        value = self.__readProcStatus("Cpus_allowed_list")
+        if value is None:
+            return None
+        count = 0
+        for cpuRange in value.split(","):
+            bounds = cpuRange.split("-")
+            try:
+                count += int(bounds[-1]) - int(bounds[0]) + 1
+            except ValueError:
+                return None
+        return count
+
+
+    def __getCgroupCpuQuota(self):
+        """Compute the number of cpus allowed by the cgroup cpu quota, cgroup v2 and v1 are supported
+
+        Returns:
+            the number of cpus allowed, None if there is no quota
+        """
+        cpuMax = self.__readCgroupFile("cpu.max", "cpu")
+        if cpuMax is not None:
+            tokens = cpuMax.split()
+            if len(tokens) == 2 and tokens[0] != "max":
+                return max(1, int(tokens[0]) // int(tokens[1]))
+            return None
+
+        quota = self.__readCgroupFile("cpu.cfs_quota_us", "cpu")
+        period = self.__readCgroupFile("cpu.cfs_period_us", "cpu")
+        if quota is not None and period is not None and int(quota) > 0:
+            return max(1, int(quota) // int(period))
+        return None
+
+
+    def __getCgroupMemory(self):
+        """Read the memory limit and usage of the cgroup, cgroup v2 and v1 are supported
+
+        Returns:
+            a tuple (limit, usage) in bytes, elements are None if they cannot be determine
+        """
+        limit = self.__readCgroupFile("memory.max", "memory")
+        if limit is not None:
+            usage = self.__readCgroupFile("memory.current", "memory")
+        else:
+            limit = self.__readCgroupFile("memory.limit_in_bytes", "memory")
+            usage = self.__readCgroupFile("memory.usage_in_bytes", "memory")
+        try:
+            return int(limit), int(usage)
+        except (TypeError, ValueError):
+            return None, None
+
+
+    def __readCgroupFile(self, name, controller):
+        """Read the content of a cgroup control file of the current process
+
+        Args:
+            name: the name of the control file
+            controller: the name of the cgroup v1 controller that provide the file
+
+        Returns:
+            the content of the file stripped, None if the file does not exists
+        """
+        candidates = []
+        try:
+            with open("/proc/self/cgroup", 'r') as f:
+                for line in f.readlines():
+                    hierarchy, controllers, path = line.strip().split(":", 2)
+                    if not controllers:
+                        candidates.append(os.path.join("/sys/fs/cgroup", path.lstrip("/"), name))
+                    elif controller in controllers.split(","):
+                        candidates.append(os.path.join("/sys/fs/cgroup", controllers, path.lstrip("/"), name))
+        except (IOError, ValueError):
+            pass
+        candidates.extend([os.path.join("/sys/fs/cgroup", name), os.path.join("/sys/fs/cgroup", controller, name)])
+
+        for candidate in candidates:
+            try:
+                with open(candidate, 'r') as f:
+                    return f.read().strip()
+            except IOError:
+                pass
+        return None
+
+
+    def __readProcStatus(self, field):
+        """Extract a field from /proc/self/status
+
+        Args:
+            field: the name of the field
+
+        Returns:
+            the value of the field, None if not found
+        """
+        try:
+            with open("/proc/self/status", 'r') as f:
+                for line in f.readlines():
+                    if line.startswith("{}:".format(field)):
+                        return line.split(":", 1)[1].strip()
+        except IOError:
+            pass
+        return None
+
+
+    def __readMeminfo(self, field):
+        """Extract a field from /proc/meminfo
+
+        Args:
+            field: the name of the field
+
+        Returns:
+            the value of the field in bytes, None if not found
+        """
+        try:
+            with open("/proc/meminfo", 'r') as f:
+                for line in f.readlines():
+                    if line.startswith("{}:".format(field)):
+                        return int(line.split()[1]) * 1024
+        except (IOError, ValueError):
+            pass
+        return None
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import shutil
+import stat
+import json
+import os
+
+from lib import util
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Cache(object):
+
+    #name of the file that record, into an entry, the names of the images the entry was built from
+    NAMES = ".names.json"
+
+    def __init__(self, config):
+        """Content addressed cache of tasks results shared across subjects and studies
+
+        An entry of the cache is a copy of the working directory of a task once it completed. Entries are
+        identified by the name of the task and its fingerprint, see Fingerprint.getFingerprint(). Files are
+        copied in both directions, never hardlinked, so the files of an entry, which are read only, are never
+        shared with a study.
+
+        Args:
+            config: a configParser
+
+        """
+        self.__cacheDir = None
+        self.__cacheSize = 0
+        self.__tasks = []
+        #output names are built from these sections, see util.buildName(), so they are part of the key
+        self.__naming = dict((section, sorted(config.items(section)))
+                             for section in ['prefix', 'postfix', 'extension'] if config.has_section(section))
+        if config.has_option('general', 'cache_dir') and config.get('general', 'cache_dir').strip():
+            self.__cacheDir = os.path.abspath(os.path.expanduser(config.get('general', 'cache_dir').strip()))
+            try:
+                self.__cacheSize = int(float(config.get('general', 'cache_size')) * 1024**3)
+            except ValueError:
+                self.__cacheSize = 0
+            self.__tasks = [task.strip() for task in util.arrayOfString(config.get('general', 'cache_tasks'))]
+
+
+    def isEnabled(self, taskName):
+        """Determine if the results of a task should be look up and store into the cache
+
+        Args:
+            taskName: the name of the task
+
+        Returns:
+            True if a cache directory is configured and the task is listed into cache_tasks, False otherwise
+
+        """
+        return self.__cacheDir is not None and taskName in self.__tasks
+
+
+    def getKey(self, taskName, fingerprint):
+        """Compute the key of a cache entry
+
+        The location of the images are not part of the key, only their roles and digests, so the same
+        images found into two different subjects lead to the same key while the same images given to
+        a task in different roles do not. The naming sections of the config are part of the key, outputs
+        named differently are never restored.
+
+        Args:
+            taskName: the name of the task
+            fingerprint: a fingerprint as return by Fingerprint.getFingerprint()
+
+        Returns:
+            an hexadecimal digest
+
+        """
+        signature = {'task': taskName,
+                     'inputs': sorted([role, signature['digest']]
+                                      for signature in fingerprint['inputs'].values()
+                                      for role in signature.get('roles', [None])),
+                     'config': fingerprint['config'],
+                     'naming': self.__naming,
+                     'softwares': fingerprint['softwares']}
+        return hashlib.sha1(json.dumps(signature, sort_keys=True)).hexdigest()
+
+
+    def isCached(self, key):
+        """Look if an entry exists into the cache
+
+        Args:
+            key: the key of the entry
+
+        Returns:
+            True if the entry exists, False otherwise
+
+        """
+        return os.path.isdir(os.path.join(self.__cacheDir, key))
+
+
+    def restore(self, key, target, fingerprint=None):
+        """Copy the content of a cache entry into a directory
+
+        Outputs are named after the inputs of the subject that produced the entry, ex: dwi_subj01_denoise.nii.gz.
+        When a fingerprint is provided, the restored files are renamed after the inputs of the current subject.
+
+        Args:
+            key: the key of the entry
+            target: the destination directory, usually the working directory of the task
+            fingerprint: the fingerprint of the task that restore the entry
+
+        Returns:
+            the destination directory
+
+        """
+        entry = os.path.join(self.__cacheDir, key)
+        renames = []
+        if fingerprint is not None and os.path.isfile(os.path.join(entry, self.NAMES)):
+            with open(os.path.join(entry, self.NAMES), 'r') as f:
+                stored = json.load(f)
+            current = self.__getNames(fingerprint)
+            renames = [(name, current[role]) for role, name in stored.iteritems()
+                       if role in current and current[role] != name]
+            #longest names first, dwi_subj01 must not be renamed as a part of dwi_subj01_b0
+            renames.sort(key=lambda rename: len(rename[0]), reverse=True)
+        self.__copyTree(entry, target, [self.NAMES], readOnly=False, renames=renames)
+        #mark the entry as recently used
+        os.utime(entry, None)
+        return target
+
+
+    def store(self, key, source, excludes=None, fingerprint=None):
+        """Copy the content of a directory into a new cache entry then evict the least recently used entries
+
+        Files of the entry are made read only, they are copies own exclusively by the cache.
+
+        Args:
+            key: the key of the entry
+            source: the directory to store, usually the working directory of the task
+            excludes: a list of file names that should not be store
+            fingerprint: the fingerprint of the task, the names of its inputs are recorded into the entry
+
+        Returns:
+            the entry directory
+
+        """
+        entry = os.path.join(self.__cacheDir, key)
+        if os.path.isdir(entry):
+            return entry
+        if not os.path.exists(self.__cacheDir):
+            os.makedirs(self.__cacheDir)
+
+        #entries are created under a temporary name so concurrent pipelines never see a partial entry
+        temporary = os.path.join(self.__cacheDir, ".{}.{}".format(key, os.getpid()))
+        self.__copyTree(source, temporary, excludes, True)
+        if fingerprint is not None:
+            with open(os.path.join(temporary, self.NAMES), 'w') as f:
+                json.dump(self.__getNames(fingerprint), f)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.__evict(entry)
+        return entry
+
+
+    def __getNames(self, fingerprint):
+        """Map the roles of the inputs of a task to the names of the images, without their extensions
+
+        Roles given to more than one image are ambiguous and left out.
+
+        Args:
+            fingerprint: a fingerprint as return by Fingerprint.getFingerprint()
+
+        Returns:
+            a dictionary of names indexed by roles
+
+        """
+        names = {}
+        ambiguous = set()
+        for image, signature in fingerprint['inputs'].iteritems():
+            name = os.path.basename(image).split(os.extsep)[0]
+            for role in signature.get('roles', [None]):
+                role = str(role)
+                if role in names and names[role] != name:
+                    ambiguous.add(role)
+                names[role] = name
+        return dict((role, name) for role, name in names.iteritems() if role not in ambiguous)
+
+
+    def __copyTree(self, source, target, excludes=None, readOnly=False, renames=None):
+        """Recursively copy the content of a source directory into a target directory
+
+        Files are copied rather than hardlinked: a hardlink share its permissions with the original file,
+        so making the files of an entry read only would also make the files of the study read only.
+        Symbolic links are recreated as is.
+
+        Args:
+            source: the source directory
+            target: the target directory
+            excludes: a list of file names into source root directory that should not be copied
+            readOnly: remove the write permissions of the copied files, otherwise the owner
+                      is granted the write permission
+            renames: a list of (old, new) substitutions applied to the names of the copied files
+
+        """
+        if excludes is None:
+            excludes = []
+        if renames is None:
+            renames = []
+
+        for root, dirs, files in os.walk(source):
+            relative = os.path.relpath(root, source)
+            destination = os.path.normpath(os.path.join(target, relative))
+            if not os.path.exists(destination):
+                os.makedirs(destination)
+
+            for name in files + [directory for directory in dirs if os.path.islink(os.path.join(root, directory))]:
+                if relative == "." and name in excludes:
+                    continue
+                src = os.path.join(root, name)
+                for old, new in renames:
+                    if old in name:
+                        name = name.replace(old, new)
+                        break
+                dst = os.path.join(destination, name)
+                if os.path.lexists(dst):
+                    os.remove(dst)
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), dst)
+                    continue
+                shutil.copy2(src, dst)
+                mode = os.stat(dst).st_mode
+                if readOnly:
+                    os.chmod(dst, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+                else:
+                    os.chmod(dst, mode | stat.S_IWUSR)
+
+
+    def __evict(self, keep):
+        """Remove the least recently used entries until the cache size is lower than cache_size
+
+        Args:
+            keep: an entry that should never be removed, usually the one just stored
+
+        """
+        if self.__cacheSize <= 0:
+            return
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.__cacheDir):
+            entry = os.path.join(self.__cacheDir, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            size = 0
+            for root, dirs, files in os.walk(entry):
+                for filename in files:
+                    size += os.lstat(os.path.join(root, filename)).st_size
+            entries.append((os.stat(entry).st_mtime, size, entry))
+            total += size
+
+        for mtime, size, entry in sorted(entries):
+            if total <= self.__cacheSize:
+                break
+            if entry == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
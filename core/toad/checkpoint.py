@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from lib import util
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Checkpoint(object):
+
+    def __init__(self):
+        """Record the steps of a task that completed so a resubmission could resume where it failed
+
+        A step is a function of the task with declared inputs and outputs files. Once a step complete, the
+        signature of its inputs and outputs, its arguments and its result are recorded into a checkpoints file
+        of the working directory. A step is skipped as long as its outputs are untouched, its inputs content
+        and its arguments did not change.
+
+        """
+        self.checkpoints = os.path.join(self.workingDir, "{}.checkpoints".format(self.getName()))
+
+
+    def step(self, name, inputs, outputs, function, *args, **kwargs):
+        """Execute a step of this task unless it already completed with the same inputs and arguments
+
+        Args:
+            name: a name that uniquely identify the step into the task
+            inputs: a list of files read by the step
+            outputs: a list of files produce by the step
+            function: the function that implement the step
+            *args: arguments of the function
+            **kwargs: keyword arguments of the function
+
+        Returns:
+            the value returned by the function, or the value it returned when the step completed the last time
+
+        """
+        arguments = repr((args, sorted(kwargs.items())))
+        checkpoints = self.__readCheckpoints()
+        known = checkpoints['steps'].get(name)
+        if known is not None and self.__isStepCompleted(known, inputs, outputs, arguments):
+            self.info("Step {} of task {} already completed, skipping it".format(name, self.getName()))
+            return known['result']
+
+        result = function(*args, **kwargs)
+
+        missing = [output for output in outputs if output and not os.path.exists(output)]
+        if missing:
+            self.warning("Step {} did not produce {}, it will not be checkpointed".format(name, ", ".join(missing)))
+            return result
+
+        checkpoints = self.__readCheckpoints()
+        checkpoints['steps'][name] = {'arguments': arguments,
+                                      'inputs': self.__getSignatures(inputs, known['inputs'] if known else {}),
+                                      'outputs': self.__getSignatures(outputs),
+                                      'result': result}
+        self.__writeCheckpoints(checkpoints)
+        return result
+
+
+    def isResumable(self):
+        """Determine if a resubmission of this task may resume from its checkpoints
+
+        Steps only compare their own inputs and arguments, so the checkpoints are discard once the options
+        of the task or the versions of the softwares changed.
+
+        Returns:
+            True if some steps completed with the current options and softwares versions, False otherwise
+
+        """
+        if not os.path.isfile(self.checkpoints):
+            return False
+        return len(self.__readCheckpoints()['steps']) > 0
+
+
+    def removeCheckpoints(self):
+        """Delete the checkpoints file of this task if it exists
+
+        """
+        if os.path.isfile(self.checkpoints):
+            os.remove(self.checkpoints)
+
+
+    def __isStepCompleted(self, known, inputs, outputs, arguments):
+        """Compare a recorded step with the current inputs, outputs and arguments
+
+        Args:
+            known: the step recorded into the checkpoints file
+            inputs: a list of files read by the step
+            outputs: a list of files produce by the step
+            arguments: the representation of the step arguments
+
+        Returns:
+            True if the step could be skipped, False otherwise
+        """
+        if known['arguments'] != arguments:
+            return False
+
+        if sorted(known['outputs'].keys()) != sorted(self.__getKeys(outputs)):
+            return False
+        for output, signature in known['outputs'].iteritems():
+            if not os.path.exists(output):
+                return False
+            stat = os.stat(output)
+            if stat.st_size != signature['size'] or stat.st_mtime != signature['mtime']:
+                return False
+
+        current = self.__getSignatures(inputs, known['inputs'])
+        return (dict((key, value['digest']) for key, value in current.iteritems()) ==
+                dict((key, value['digest']) for key, value in known['inputs'].iteritems()))
+
+
+    def __getKeys(self, sources):
+        return [os.path.abspath(source) for source in sources if source]
+
+
+    def __getSignatures(self, sources, previous=None):
+        """Compute the signature of a list of files
+
+        Input files are often produce again with the same content by a previous step of the task. The
+        digest of a file is only computed when its size or modification time differ from a previous signature.
+
+        Args:
+            sources: a list of files
+            previous: signatures previously recorded
+
+        Returns:
+            a dictionary of file names and {size, mtime, digest}
+        """
+        if previous is None:
+            previous = {}
+        signatures = {}
+        for source in self.__getKeys(sources):
+            if not os.path.isfile(source):
+                signatures[source] = {'size': None, 'mtime': None, 'digest': None}
+                continue
+            stat = os.stat(source)
+            signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            known = previous.get(source)
+            if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+                signature['digest'] = known['digest']
+            else:
+                signature['digest'] = util.digest(source)
+            signatures[source] = signature
+        return signatures
+
+
+    def __readCheckpoints(self):
+        """Read the checkpoints file of this task
+
+        Steps recorded with other options or softwares versions are discard
+
+        Returns:
+            a dictionary with config, softwares and steps keys
+        """
+        current = {'config': self.getOptions(), 'softwares': self.getSoftwaresVersions(), 'steps': {}}
+        if os.path.isfile(self.checkpoints):
+            try:
+                with open(self.checkpoints, 'r') as f:
+                    checkpoints = json.load(f)
+                if checkpoints['config'] == current['config'] and checkpoints['softwares'] == current['softwares']:
+                    return checkpoints
+            except ValueError:
+                self.warning("Checkpoints {} are corrupted and will be ignored".format(self.checkpoints))
+        return current
+
+
+    def __writeCheckpoints(self, checkpoints):
+        """Write the checkpoints file of this task, a partially written file is never visible
+
+        Args:
+            checkpoints: a dictionary with config, softwares and steps keys
+        """
+        temporary = "{}.tmp".format(self.checkpoints)
+        with open(temporary, 'w') as f:
+            json.dump(checkpoints, f, indent=2, sort_keys=True)
+        os.rename(temporary, self.checkpoints)
@@ -47,6 +47,9 @@ class Config(object):
         if arguments.stopBeforeTask and isinstance(arguments.stopBeforeTask, basestring):
             config.set('arguments', 'stop_before_task', arguments.stopBeforeTask)
 
+        if arguments.onlyTask and isinstance(arguments.onlyTask, basestring):
+            config.set('arguments', 'only_task', arguments.onlyTask)
+
         #add local options to config file
         if arguments.local:
             config.set('arguments', 'local', 'True')
@@ -58,6 +61,11 @@ class Config(object):
         else:
             config.set('arguments', 'reinitialize', 'False')
 
+        if arguments.plan:
+            config.set('arguments', 'plan', 'True')
+        else:
+            config.set('arguments', 'plan', 'False')
+
         if arguments.debug:
             config.set('arguments', 'debug', 'True')
         else:
@@ -87,6 +95,9 @@ class Config(object):
         if arguments.queue:
             config.set('general', 'sge_queue', arguments.queue)
 
+        if arguments.jobs:
+            config.set('general', 'nb_parallel_subjects', arguments.jobs)
+
         if arguments.noTractography:
             config.set('tractographymrtrix', 'ignore', 'True')
             config.set('tractographydipy', 'ignore', 'True')
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+
+from lib.images import Images
+from lib import xmlhelper
+from lib import util
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Fingerprint(object):
+
+    def __init__(self):
+        """Record and compare the fingerprint of a task execution
+
+        A fingerprint is made of the digests of the images required by the task, the options of the task
+        section into config.cfg and the versions of the softwares used by the pipeline. It is recorded into
+        a manifest once the task completed so a task could be submit again when one of those element change,
+        even if all the images it produce exists.
+
+        """
+        self.manifest = os.path.join(self.workingDir, "{}.manifest".format(self.getName()))
+
+
+    def getFingerprint(self, previous=None):
+        """Compute the fingerprint of this task
+
+        Digests are expensive to compute on large images. If a previous fingerprint is provided, the digest
+        of an image whose size and modification time did not change is taken from it. Each image also record
+        its roles, the descriptions meetRequirement gives to it.
+
+        Args:
+            previous: a fingerprint previously recorded
+
+        Returns:
+            a dictionary with inputs, config and softwares keys
+
+        """
+        inputs = {}
+        previousInputs = previous['inputs'] if previous is not None else {}
+        requirements = self.meetRequirement()
+        if isinstance(requirements, Images):
+            for image, description in requirements:
+                if image and os.path.isfile(image):
+                    image = os.path.abspath(image)
+                    if image in inputs:
+                        inputs[image]['roles'].append(description)
+                        continue
+                    stat = os.stat(image)
+                    #the roles of an image are the descriptions given by meetRequirement
+                    signature = {'size': stat.st_size, 'mtime': stat.st_mtime, 'roles': [description]}
+                    known = previousInputs.get(image)
+                    if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+                        signature['digest'] = known['digest']
+                    else:
+                        signature['digest'] = util.digest(image)
+                    inputs[image] = signature
+
+        return {'inputs': inputs, 'config': self.getOptions(), 'softwares': self.getSoftwaresVersions()}
+
+
+    def getOptions(self):
+        """Return the options of the task section into config.cfg that may change its results
+
+        Returns:
+            a dictionary of options name and raw values
+        """
+        config = {}
+        if self.config.has_section(self.getName()):
+            for option, value in self.config.items(self.getName(), raw=True):
+                if option not in ['ignore']:
+                    config[option] = value
+        return config
+
+
+    def isFingerprintChanged(self):
+        """Compare the current fingerprint of this task with the one recorded into its manifest
+
+        A task that do not have a manifest, like a task completed with a previous version of toad,
+        is consider unchanged.
+
+        Returns:
+            True if the fingerprint have changed since the last execution of this task, False otherwise
+
+        """
+        previous = self.__readManifest()
+        if previous is None:
+            return False
+
+        current = self.getFingerprint(previous)
+        currentDigests = dict((image, signature['digest']) for image, signature in current['inputs'].iteritems())
+        previousDigests = dict((image, signature['digest']) for image, signature in previous['inputs'].iteritems())
+
+        if currentDigests != previousDigests:
+            self.info("Images required by task {} have changed since its last execution".format(self.getName()))
+            return True
+        if current['config'] != previous['config']:
+            self.info("Options of section [{}] have changed since the last execution".format(self.getName()))
+            return True
+        if current['softwares'] != previous['softwares']:
+            self.info("Softwares versions have changed since the last execution of task {}".format(self.getName()))
+            return True
+        return False
+
+
+    def recordFingerprint(self, fingerprint=None):
+        """Write the fingerprint of this task into its manifest
+
+        Args:
+            fingerprint: a fingerprint already computed, the current fingerprint will be compute if None
+
+        Returns:
+            the manifest filename
+
+        """
+        if fingerprint is None:
+            fingerprint = self.getFingerprint()
+        with open(self.manifest, 'w') as f:
+            json.dump(fingerprint, f, indent=2, sort_keys=True)
+        return self.manifest
+
+
+    def removeFingerprint(self):
+        """Delete the manifest of this task if it exists
+
+        """
+        if os.path.isfile(self.manifest):
+            os.remove(self.manifest)
+
+
+    def __readManifest(self):
+        """Read the fingerprint recorded into the manifest of this task
+
+        Returns:
+            a fingerprint, None if the manifest does not exists or is unreadable
+
+        """
+        if not os.path.isfile(self.manifest):
+            return None
+        try:
+            with open(self.manifest, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            self.warning("Manifest {} is corrupted and will be ignored".format(self.manifest))
+            return None
+
+
+    def getSoftwaresVersions(self):
+        """Extract softwares versions from the newest application tag of the versions xml file
+
+        Returns:
+            a dictionary of softwares name and versions
+        """
+        softwares = {}
+        xmlFilename = os.path.join(self.logDir, self.config.get('general', 'versions_file_name'))
+        applicationTag = xmlhelper.getNewestApplicationTag(xmlFilename)
+        if applicationTag is not None:
+            for softwareTag in applicationTag.getElementsByTagName("software"):
+                name = softwareTag.getElementsByTagName("name")[0].firstChild
+                version = softwareTag.getElementsByTagName("version")[0].firstChild
+                if name is not None:
+                    softwares[name.data] = version.data if version is not None else ""
+        return softwares
@@ -7,9 +7,14 @@ import shutil
 import os
 
 from lib.images import Images
+from core.toad.fingerprint import Fingerprint
+from core.toad.checkpoint import Checkpoint
+from core.toad.cache import Cache
 from core.toad.logger import Logger
 from core.toad.qa import Qa
 from load import Load
+from lib import ledger
+from lib import mriutil
 from lib import util
 
 
@@ -18,7 +23,7 @@ __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
 
 
-class GenericTask(Logger, Load, Qa):
+class GenericTask(Logger, Load, Qa, Fingerprint, Checkpoint):
 
     def __init__(self, subject, *args):
         """Set up a TASK child class environment.
@@ -37,6 +42,7 @@ class GenericTask(Logger, Load, Qa):
         self.__name = self.__class__.__name__.lower()
         self.__moduleName = self.__class__.__module__.split(".")[-1]
         self.__cleanupBeforeImplement = True
+        self.__gridResources = {'threads': 1, 'memory': '4G', 'walltime': '12:00:00'}
         self.config = subject.getConfig()
         self.subject = subject
         self.subjectDir = self.subject.getDir()
@@ -45,9 +51,12 @@ class GenericTask(Logger, Load, Qa):
         self.logDir = os.path.join(self.subjectDir, self.get('dir', 'log'))
         self.qaDir = os.path.join(self.subjectDir, '00-qa')
         self.tasksAsReferences = None
+        self.__cache = Cache(self.config)
         Logger.__init__(self, subject.getLogDir())
         Load.__init__(self, self.config)
         Qa.__init__(self)
+        Fingerprint.__init__(self)
+        Checkpoint.__init__(self)
         self.dependencies = []
         self.__dependenciesDirNames = {}
         for arg in args:
@@ -184,13 +193,29 @@ class GenericTask(Logger, Load, Qa):
         if "qaSupplier" in dir(self):
             self.updateQaMenu()
         self.implement()
-        self.info("Create and supply images to the qa report ")
-        if "qaSupplier" in dir(self):
-            self.createQaReport(self.qaSupplier())
-        else:
+        os.chdir(self.subjectDir)
+
+
+    def __submitQaReport(self, onComplete):
+        """Produce the qa report of this task once its implementation completed
+
+        Args:
+            onComplete: a function without arguments called once the report is rendered, see Qa.submitQaReport()
+
+        """
+        if "qaSupplier" not in dir(self):
             self.info("task {} does not implement qaSupplier method".format(self.getName()))
+            onComplete()
+            return
 
-        os.chdir(self.subjectDir)
+        self.info("Create and supply images to the qa report ")
+        os.chdir(self.workingDir)
+        try:
+            self.submitQaReport(onComplete)
+        except Exception, exception:
+            self.warning("Cannot create the qa report of task {}, the error message is: {}".format(self.getName(), exception))
+        finally:
+            os.chdir(self.subjectDir)
 
 
     def implement(self):
@@ -285,6 +310,9 @@ class GenericTask(Logger, Load, Qa):
             else:
                 self.error("Illegal value return by isDirty method for task {}".format(self.getName()))
 
+            if not result and self.isFingerprintChanged():
+                result = True
+
             self.logFooter("isDirty", result)
             return result
 
@@ -313,6 +341,32 @@ class GenericTask(Logger, Load, Qa):
         self.__cleanupBeforeImplement = cleanup
 
 
+    def setGridResources(self, threads=None, memory=None, walltime=None):
+        """Declare the resources a grid engine should reserve when this task is submit as its own job
+
+        Args:
+            threads: the number of slots or cores
+            memory: the amount of memory, ex: 8G
+            walltime: the maximum execution time formated as HH:MM:SS
+
+        """
+        if threads is not None:
+            self.__gridResources['threads'] = threads
+        if memory is not None:
+            self.__gridResources['memory'] = memory
+        if walltime is not None:
+            self.__gridResources['walltime'] = walltime
+
+
+    def getGridResources(self):
+        """Return the resources a grid engine should reserve when this task is submit as its own job
+
+        Returns:
+            a dictionary with threads, memory and walltime keys
+        """
+        return self.__gridResources
+
+
     def __cleanup(self):
         """Base class that remove every files that may have been produce during the execution of the parent task.
 
@@ -344,8 +398,21 @@ class GenericTask(Logger, Load, Qa):
         attempt = 0
         self.logHeader("implement")
         start = datetime.now()
+        usage = ledger.snapshot()
+        ledger.activate(os.path.join(self.logDir, self.get('general', 'ledger_file_name')),
+                        self.subject.getName(), self.getName())
+        mriutil.setHeaderCache(os.path.join(self.logDir, self.get('general', 'header_cache_file_name')))
 
         if self.__meetRequirement():
+            if self.__restoreFromCache():
+                finish = datetime.now()
+                self.info("Time to finish the task = {} seconds".format(str(timedelta(seconds=(finish - start).seconds))))
+                ledger.record("task", self.getName(), ledger.measure(usage, True), "restored")
+                ledger.deactivate()
+                mriutil.flushHeaderCache()
+                self.logFooter("implement")
+                return
+
             try:
                 nbSubmission = int(self.config.get('general', 'nb_submissions'))
             except ValueError:
@@ -353,7 +420,11 @@ class GenericTask(Logger, Load, Qa):
 
             while(attempt < nbSubmission):
                 if self.__cleanupBeforeImplement:
-                    self.__cleanup()
+                    if self.isResumable():
+                        self.info("Resuming task {}, steps already completed will be skipped".format(self.getName()))
+                    else:
+                        self.__cleanup()
+                self.removeFingerprint()
 
                 try:
                     self.__implement()
@@ -365,6 +436,7 @@ class GenericTask(Logger, Load, Qa):
                     print "traceBack = ", traceback.format_exc()
                     self.warning("Exception have been caught, the error message is: {}".format(exception))
                     self.warning("Traceback is: {}".format(traceback.format_exc()))
+
                 if attempt == nbSubmission:
                     self.error("I already execute this task {} time and failed, exiting the pipeline")
 
@@ -374,8 +446,71 @@ class GenericTask(Logger, Load, Qa):
                 else:
                     finish = datetime.now()
                     self.info("Time to finish the task = {} seconds".format(str(timedelta(seconds=(finish - start).seconds))))
+                    ledger.record("task", self.getName(), ledger.measure(usage, True), "completed")
+                    fingerprint = self.getFingerprint()
+                    #the qa images are written into the working directory, the task is fingerprinted
+                    #and cached once they are rendered while the pipeline carry on with the next tasks
+                    def __onComplete():
+                        self.recordFingerprint(fingerprint)
+                        self.__storeIntoCache(fingerprint)
+                    self.__submitQaReport(__onComplete)
                     self.logFooter("implement")
                     break
+        ledger.deactivate()
+        mriutil.flushHeaderCache()
+
+
+    def __restoreFromCache(self):
+        """Look into the shared cache for the results of a previous execution of this task with the same fingerprint
+
+        If an entry is found, it is copied into the working directory and the qa report is produced
+        instead of launching the implementation
+
+        Returns:
+            True if the task have been restored from the cache, False otherwise
+
+        """
+        if not self.__cache.isEnabled(self.getName()):
+            return False
+
+        fingerprint = self.getFingerprint()
+        key = self.__cache.getKey(self.getName(), fingerprint)
+        if not self.__cache.isCached(key):
+            self.info("No cache entry found for task {}".format(self.getName()))
+            return False
+
+        self.info("Restoring results of task {} from cache entry {}".format(self.getName(), key))
+        self.__cleanup()
+        self.__cache.restore(key, self.workingDir, fingerprint)
+        if self.isTaskDirty():
+            self.warning("Cache entry {} is incomplete, task {} will be implemented".format(key, self.getName()))
+            return False
+
+        os.chdir(self.workingDir)
+        util.symlink(self.getLogFileName(), self.workingDir)
+        if "qaSupplier" in dir(self):
+            try:
+                self.updateQaMenu()
+            except Exception, exception:
+                self.warning("Cannot create the qa report from cached results, the error message is: {}".format(exception))
+        os.chdir(self.subjectDir)
+
+        self.__submitQaReport(lambda: self.recordFingerprint(fingerprint))
+        return True
+
+
+    def __storeIntoCache(self, fingerprint):
+        """Copy the results of this task into the shared cache
+
+        Args:
+            fingerprint: the fingerprint of this task execution
+
+        """
+        if self.__cache.isEnabled(self.getName()):
+            key = self.__cache.getKey(self.getName(), fingerprint)
+            self.info("Storing results of task {} into cache entry {}".format(self.getName(), key))
+            excludes = [os.path.basename(self.manifest), os.path.basename(self.checkpoints), os.path.basename(self.getLogFileName())]
+            self.__cache.store(key, self.workingDir, excludes, fingerprint)
 
 
     def getName(self):
@@ -384,6 +519,12 @@ class GenericTask(Logger, Load, Qa):
         return self.__name
 
 
+    def getModuleName(self):
+        """Return the name of the module that define this class
+        """
+        return self.__moduleName
+
+
     def getDependencies(self):
         """Return the list of all prerequisite to run this tasks.
         """
@@ -439,11 +580,10 @@ class GenericTask(Logger, Load, Qa):
 
         self.info("Launch {} command line...".format(binary))
         self.info("Command line submit: {}".format(cmd))
+        self.info("Output and error produce by {}: \n".format(binary))
 
-        (executedCmd, output, error)= util.launchCommand(cmd, stdout, stderr, timeout, nice)
-        if not (output is "" or output is "None" or output is None):
-            self.info("Output produce by {}: {} \n".format(binary, output))
-
+        #outputs are stream into the log file as they are produce instead of being keep into memory
+        (executedCmd, output, error)= util.launchCommand(cmd, stdout, stderr, timeout, nice, self.getLogFileName())
         if not (error is '' or error is "None" or error is None):
             self.info("Error produce by {}: {}\n".format(binary, error))
         self.info("------------------------\n")
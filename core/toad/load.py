@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import os
 
+from broker import Broker
+
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
@@ -24,6 +26,11 @@ class Load(object):
             self.nbSubjects = int(self.__config.get('general', 'nb_subjects'))
         except ValueError:
             self.nbSubjects = 1000
+        try:
+            self.__memoryPerThread = float(self.__config.get('general', 'memory_per_thread')) * 1024**3
+        except ValueError:
+            self.__memoryPerThread = 0
+        self.__broker = Broker(self.__config.get('general', 'tokens_file'))
 
 
     def __getLoad(self):
@@ -71,69 +78,62 @@ class Load(object):
         return self.__getNTreads()
 
 
-    def __getNTreads(self):
+    def __computeNTreads(self):
         """Define the number of thread that should be deploy without stressing the server too much
 
-            -First compute the number of threads base on the server capacity
+            -First share the cpus available to this process among the subjects processed concurrently
             -Second look if nbThreads have not been overwrite into the config file
-            -Third make sure the system is not overworking
-            -Last, if emergency have been call, pray to avoid a crash
+            -Third make sure the threads fit into the memory available
+            -Fourth make sure the system is not overworking
 
         Returns:
             the suggested number of threads that should be deploy
 
         """
+        cpus = self.__broker.getAvailableCpus()
 
-        serverName = self.__config.get('general', 'server')
-
-        #First compute the number of threads base on the server capacity
-        if 'magma' in serverName:
-            if self.nbSubjects <= 5:
-                value = 4
-            elif self.nbSubjects <= 10:
-                value = 3
-            elif self.nbSubjects <= 15:
-                value = 2
-            else:
-                value = 1
-
-        elif 'stark' in serverName:
-            if self.nbSubjects <= 5:
-                value = 5
-            elif self.nbSubjects <= 10:
-                value = 4
-            elif self.nbSubjects <= 15:
-                value = 3
-            elif self.nbSubjects <= 20:
-                value = 2
-            else:
-                value = 1
-
-        elif 'mammouth' in serverName:
-                value = 24
-        else:
-            value = 1
-
+        #First share the cpus available to this process among the subjects processed concurrently
+        value = max(1, cpus // max(1, self.nbSubjects))
 
         #Second look if nbThreads have not been overwrite into the config file
-        if self.__nbThreads is not "algorithm" or self.__nbThreads is not "unlimited":
-            try:
-                nbThreads = int(self.__nbThreads)
-                if nbThreads <= value:
-                    value = nbThreads
-            except ValueError:
-                pass
+        try:
+            value = min(value, int(self.__nbThreads))
+        except ValueError:
+            pass
 
+        #Third make sure the threads fit into the memory available
+        memory = self.__broker.getAvailableMemory()
+        if memory is not None and self.__memoryPerThread > 0:
+            value = min(value, max(1, int(memory // self.__memoryPerThread)))
 
-        #Third make sure the system is not overworking
-        if self.isSystemOverloaded(serverName):
+        #Fourth make sure the system is not overworking
+        if self.isSystemOverloaded(self.__config.get('general', 'server')):
             value = 1
 
-        #Last, if emergency have been call, pray to avoid a crash
-        if self.__nbThreads is "unlimited" and self.nbSubjects == 1:
-            value = 100
+        return value
+
+
+    def __getNTreads(self):
+        """Request threads to the broker of the node so concurrent pipelines never oversubscribe the server
 
-        return str(value)
+            -First compute the number of threads base on the server capacity
+            -Second acquire at most that number of threads from the tokens still available on the node
+            -Last, if emergency have been call, pray to avoid a crash
+
+        Returns:
+            the suggested number of threads that should be deploy
+
+        """
+        if self.__nbThreads == "unlimited" and self.nbSubjects == 1:
+            return str(self.__broker.getAvailableCpus())
+        return str(self.__broker.acquire(self.__computeNTreads()))
+
+
+    def releaseNTreads(self):
+        """Give back to the node the threads previously acquired by this process
+
+        """
+        self.__broker.release()
 
 
     def isSystemOverloaded(self, serverName):
@@ -152,6 +152,33 @@ class Load(object):
         return False
 
 
+    def getNbParallelTasks(self):
+        """Define the number of tasks of a subject that could run concurrently without stressing the server too much
+
+            -First look if nb_parallel_tasks have not been overwrite into the config file
+            -Second share the cpus available among the subjects processed concurrently, this is the subject core budget
+            -Last divide that budget by nb_threads if it have been set into the config file
+
+        Threads deploy by concurrent tasks are arbitrated by the broker of the node.
+
+        Returns:
+            the suggested number of tasks that could run concurrently
+
+        """
+        if self.__config.has_option('general', 'nb_parallel_tasks'):
+            try:
+                return max(1, int(self.__config.get('general', 'nb_parallel_tasks')))
+            except ValueError:
+                pass
+
+        value = self.__broker.getAvailableCpus() // max(1, self.nbSubjects)
+        try:
+            value = value // max(1, int(self.__nbThreads))
+        except ValueError:
+            pass
+        return max(1, value)
+
+
     def getNTreads(self):
         """Define the number of thread that should be deploy without stressing the server too much
 
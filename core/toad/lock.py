@@ -44,9 +44,11 @@ class Lock(object):
             the lock filename
 
         """
-        if self.isLock():
+        try:
+            #creation must be atomic, many toad pipelines may try to lock the same subject at once
+            os.close(os.open(self.__lockFile, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except OSError:
             return False
-        open(self.__lockFile, 'a').close()
         return self.__lockFile
 
 
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+import json
+import ast
+import re
+import os
+
+from core.toad.fingerprint import Fingerprint
+from core.toad import workflow
+from lib import util
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class TaskDescription(Fingerprint):
+
+    def __init__(self, taskFile, subject):
+        """Metadata of a task read from the source code of its module, the module itself is never imported
+
+        The name of a task is the name of its class, its dependencies are the arguments it pass to
+        GenericTask.__init__ and its outputs are the images its isDirty method look for. When isDirty look
+        for images into a conditional block, with arguments that are not literals or does not look for any
+        image, its outputs are incomplete and the status of the task cannot be determined.
+
+        Args:
+            taskFile: the python file that define the task
+            subject: the subject the task belongs to
+
+        Raises:
+            ValueError: the file does not define a task
+
+        """
+        self.taskFile = taskFile
+        self.config = subject.getConfig()
+        self.subjectDir = subject.getDir()
+        self.logDir = subject.getLogDir()
+        self.__moduleName = os.path.splitext(os.path.basename(taskFile))[0]
+        self.__order = None
+        if len(self.__moduleName.split('-')) > 1:
+            try:
+                self.__order = int(self.__moduleName.split('-')[0])
+            except ValueError:
+                pass
+        self.__name, self.__dependencies, self.__outputs, self.__complete, self.__ignores = self.__parse(taskFile)
+        self.workingDir = os.path.join(self.subjectDir, self.__moduleName)
+        Fingerprint.__init__(self)
+
+
+    def __repr__(self):
+        return self.__name
+
+
+    def getName(self):
+        """Return the name of the task into lower case
+        """
+        return self.__name
+
+
+    def getModuleName(self):
+        """Return the name of the module that define the task
+        """
+        return self.__moduleName
+
+
+    def getOrder(self):
+        """Return the order of the task taken from the prefix of its file name, None if there is no prefix
+        """
+        return self.__order
+
+
+    def getDependencies(self):
+        """Return the list of the names of the tasks this task depend on
+        """
+        return self.__dependencies
+
+
+    def getOutputs(self):
+        """Return the images looked up by the task to determine if it completed
+
+        Returns:
+            a list of tuples: the name of the task whose directory contain the image, None for this task,
+            and the arguments of util.getImage that follow the directory
+        """
+        return self.__outputs
+
+
+    def isOutputsComplete(self):
+        """Determine if the outputs are every images the isDirty method of the task may look for
+        """
+        return self.__complete
+
+
+    def isIgnore(self):
+        """Determine if the task is set to ignore into the configuration
+
+        Returns:
+            True if one of the ignore options read by the isIgnore method of the task is set, False otherwise
+        """
+        for section, option in self.__ignores:
+            if self.config.has_option(section, option) and self.config.get(section, option) in ["True", "true"]:
+                return True
+        return False
+
+
+    def getStatus(self, descriptions):
+        """Determine if the task need to be submit without instantiating it
+
+        The status is only an estimate: images required by the task are not digested, so a task whose inputs
+        changed while its outputs, its options and the softwares versions did not is reported as completed.
+        A task whose outputs are incomplete, see isOutputsComplete(), is reported as unknown instead.
+
+        Args:
+            descriptions: the descriptions of every tasks of the subject, used to locate their directories
+
+        Returns:
+            a 2 elements tuple: the status, ignored, dirty, unknown or completed, and the reason of that status
+        """
+        if self.isIgnore():
+            return "ignored", "ignore flag activated"
+
+        if not os.path.exists(self.workingDir):
+            return "dirty", "directory {} not found".format(self.__moduleName)
+
+        directories = dict((description.getName(), description.workingDir) for description in descriptions)
+        missing = 0
+        for taskName, arguments in self.__outputs:
+            directory = self.workingDir if taskName is None else directories.get(taskName)
+            if directory is None or not util.getImage(self.config, directory, *arguments):
+                missing += 1
+        if missing:
+            return "dirty", "{} image(s) missing".format(missing)
+
+        if os.path.isfile(self.manifest):
+            try:
+                with open(self.manifest, 'r') as f:
+                    previous = json.load(f)
+                if previous['config'] != self.getOptions():
+                    return "dirty", "options of section [{}] changed".format(self.__name)
+                if previous['softwares'] != self.getSoftwaresVersions():
+                    return "dirty", "softwares versions changed"
+            except (ValueError, KeyError):
+                pass
+        if not self.__complete:
+            return "unknown", "isDirty cannot be evaluated without running it"
+        return "completed", ""
+
+
+    def __parse(self, taskFile):
+        """Extract the metadata of a task from the abstract syntax tree of its module
+
+        Args:
+            taskFile: the python file that define the task
+
+        Returns:
+            a 5 elements tuple: the name, the dependencies, the outputs, if the outputs are complete and
+            the (section, option) read by the isIgnore method of the task
+
+        Raises:
+            ValueError: the file does not define a task
+        """
+        try:
+            with open(taskFile, 'r') as f:
+                tree = ast.parse(f.read(), taskFile)
+        except (IOError, SyntaxError), error:
+            raise ValueError("Cannot parse {}: {}".format(taskFile, error))
+
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and "GenericTask" in [self.__getIdentifier(base) for base in node.bases]:
+                break
+        else:
+            raise ValueError("No subclass of GenericTask found into {}".format(taskFile))
+
+        name = node.name.lower()
+        methods = dict((item.name, item) for item in node.body if isinstance(item, ast.FunctionDef))
+        for method in ["isDirty", "meetRequirement", "implement"]:
+            if method not in methods:
+                raise ValueError("{}() method not found into class {}".format(method, node.name))
+
+        dependencies = []
+        if "__init__" in methods:
+            for call in self.__getCalls(methods["__init__"]):
+                if self.__getIdentifier(call.func) == "GenericTask.__init__":
+                    dependencies = [argument for argument in self.__getLiterals(call.args[2:]) if argument is not None]
+
+        outputs = []
+        lookups = 0
+        for call in self.__getCalls(methods["isDirty"]):
+            if re.match(r"^self\.get(\w*)Image$", self.__getIdentifier(call.func)):
+                lookups += 1
+        for call in self.__getCalls(methods["isDirty"], conditional=False):
+            match = re.match(r"^self\.get(\w*)Image$", self.__getIdentifier(call.func))
+            if match:
+                arguments = self.__getLiterals(call.args, strict=True)
+                if arguments is not None:
+                    outputs.append((match.group(1).lower() or None, arguments))
+        complete = lookups > 0 and len(outputs) == lookups
+
+        ignores = []
+        if "isIgnore" in methods:
+            for call in self.__getCalls(methods["isIgnore"]):
+                if self.__getIdentifier(call.func) == "self.get":
+                    arguments = self.__getLiterals(call.args, strict=True)
+                    if arguments is not None and arguments[-1] == "ignore":
+                        ignores.append(tuple(arguments) if len(arguments) > 1 else (name, arguments[0]))
+
+        return name, dependencies, outputs, complete, ignores
+
+
+    def __getCalls(self, node, conditional=True):
+        """List the function calls found into a node of a syntax tree
+
+        Args:
+            node: a node of the syntax tree
+            conditional: also look into the if, for, while and try blocks
+
+        Returns:
+            a list of ast.Call nodes
+        """
+        calls = []
+        for child in ast.iter_child_nodes(node):
+            if not conditional and isinstance(child, (ast.If, ast.For, ast.While, ast.TryExcept, ast.IfExp)):
+                continue
+            if isinstance(child, ast.Call):
+                calls.append(child)
+            calls.extend(self.__getCalls(child, conditional))
+        return calls
+
+
+    def __getIdentifier(self, node):
+        """Return the dotted name of a node of a syntax tree, an empty string if it is not a name
+        """
+        if isinstance(node, ast.Name):
+            return node.id
+        elif isinstance(node, ast.Attribute):
+            return "{}.{}".format(self.__getIdentifier(node.value), node.attr)
+        return ""
+
+
+    def __getLiterals(self, nodes, strict=False):
+        """Evaluate a list of nodes that are literals
+
+        Args:
+            nodes: a list of nodes of the syntax tree
+            strict: return None if one of the nodes is not a literal, otherwise that node is evaluated as None
+
+        Returns:
+            a list of values
+        """
+        values = []
+        for node in nodes:
+            try:
+                values.append(ast.literal_eval(node))
+            except ValueError:
+                if strict:
+                    return None
+                values.append(None)
+        return values
+
+
+class Planner(object):
+
+    def __init__(self, subject):
+        """Determine which tasks of a subject would be submit into the pipeline
+
+        Unlike the TasksManager, task modules are never imported and tasks never instantiated, the plan
+        is computed from the description of each task, see TaskDescription
+
+        Args:
+            subject: a subject
+
+        """
+        self.__subject = subject
+        self.__descriptions = self.__initialize()
+
+
+    def getDescriptions(self):
+        """Return the description of every valid task sorted so dependencies are respected
+        """
+        return self.__descriptions
+
+
+    def getPlan(self):
+        """Compute the status of every task of the subject
+
+        A completed task is impacted and will be submit if one of the tasks it depend on is dirty or impacted,
+        see workflow.getWorkflow()
+
+        Returns:
+            a list of 3 elements tuples: a task description, its status and the reason of that status.
+            status is one of ignored, dirty, impacted, unknown or completed
+        """
+        return workflow.getWorkflow(self.__descriptions,
+                                    lambda description: description.getStatus(self.__descriptions))
+
+
+    def __initialize(self):
+        """Describe every task file of the pipeline and the custom tasks
+
+        Returns:
+            a list of task descriptions in topological order, see workflow.sortTasks()
+        """
+        descriptions = []
+        for taskFile in workflow.getTasksFiles(self.__subject.getConfig()):
+            try:
+                descriptions.append(TaskDescription(taskFile, self.__subject))
+            except ValueError:
+                if os.path.basename(taskFile) != "__init__.py":
+                    print "File {} do not appear as a valid task file".format(taskFile)
+        return workflow.sortTasks(descriptions)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import multiprocessing
+import fcntl
 import os
 import shutil
 import xml.dom.minidom as minidom
 from lib import qautil
 from lib import util
+from broker import Broker
 
 __author__ = "Christophe Bedetti"
 __copyright__ = "Copyright (C) 2014, TOAD"
@@ -11,6 +14,9 @@ __credits__ = ["Christophe Bedetti", "Mathieu Desrosiers"]
 
 class Qa(object):
 
+    #qa reports that may still be rendered in the background, see submitQaReport()
+    renders = []
+
     def __init__(self):
         self.qaImagesFormat = self.config.get('qa', 'images_format')
         self.qaImagesDir = os.path.join(
@@ -48,8 +54,9 @@ class Qa(object):
         """
         Wrapper of the class Plot4dVolume of qautil
         """
-        target = self.buildName(source, None, ext='gif')
-        qaPlot = qautil.Plot4dVolume(source, fov=fov)
+        target = self.buildName(source, None, ext='png')
+        qaPlot = qautil.Plot4dVolume(
+                source, fov=fov, nbProcesses=int(self.getNTreads()))
         qaPlot.save(target)
         return target
 
@@ -58,7 +65,7 @@ class Qa(object):
         """
         Wrapper of the class Plot4dVolume of qautil
         """
-        target = self.buildName(source1, 'compare', ext='gif')
+        target = self.buildName(source1, 'compare', ext='png')
         qaPlot = qautil.Plot4dVolume(source1, source2=source2, fov=fov)
         qaPlot.save(target)
         return target
@@ -97,8 +104,9 @@ class Qa(object):
         """
         targetSnr = self.buildName(source, 'snr', ext=self.qaImagesFormat)
         targetHist = self.buildName(source, 'hist', ext=self.qaImagesFormat)
-        qautil.noiseAnalysis(source, maskNoise, maskCc, targetSnr, targetHist)
-        return targetSnr, targetHist
+        targetTable = self.buildName(source, 'snr', ext='csv')
+        qautil.noiseAnalysis(source, maskNoise, maskCc, targetSnr, targetHist, targetTable)
+        return targetSnr, targetHist, targetTable
 
 
     def plotReconstruction(self, data, mask, cc, model, basename):
@@ -159,19 +167,97 @@ class Qa(object):
                 '<li><a id="{0}" href="{0}.html" target="_top">{0}</a></li>\n'
 
         #Add task link in qa menu if not already present
-        with open(menuFile, 'r') as f:
+        #the menu is lock because tasks of the same subject may run concurrently
+        with open(menuFile, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
             lines = f.readlines()
-        if not any(taskName in line for line in lines):
-            lines.insert(-1, menuLinkTemplate.format(taskName))
-        with open(menuFile, 'w') as f:
-            for line in lines:
-                f.write(line)
+            if not any(taskName in line for line in lines):
+                lines.insert(-1, menuLinkTemplate.format(taskName))
+                f.seek(0)
+                f.truncate()
+                for line in lines:
+                    f.write(line)
 
         #Create temporary html
         message = "Task is being processed. Refresh to check completion."
         self.createTaskHtml({'taskInfo':message})
 
 
+    def submitQaReport(self, onComplete=None):
+        """Produce the qa report of a task with qaSupplier implemented
+
+        If background_rendering is set into the [qa] section, images are rendered by a separate
+        process while the pipeline carry on with the next tasks. The qa images are written into the
+        working directory, so whatever need a complete working directory, like recording the fingerprint
+        or storing the results into the cache, should be given as onComplete. Each render hold a token
+        of the broker of the node, so renders wait for the oldest ones to complete when no cpu is free.
+
+        Args:
+            onComplete: a function without arguments called once the report is rendered, even if it failed
+
+        """
+        if self.config.getboolean('qa', 'background_rendering'):
+            #forget the renders already completed
+            Qa.renders = [process for process in Qa.renders if process.is_alive()]
+            broker = Broker(self.config.get('general', 'tokens_file'))
+            while Qa.renders and broker.getNbFreeCpus() < 1:
+                Qa.renders.pop(0).join()
+
+            process = multiprocessing.Process(
+                    target=self.__renderQaReport, args=(True, onComplete),
+                    name="qa-{}".format(self.getName()))
+            process.start()
+            Qa.renders.append(process)
+        else:
+            self.__renderQaReport(onComplete=onComplete)
+
+
+    def waitQaReport(self):
+        """Block until the qa report of this task rendered in the background is completed
+
+        A render must be joined before the working directory of its task is cleaned up
+        """
+        name = "qa-{}".format(self.getName())
+        for process in [process for process in Qa.renders if process.name == name]:
+            process.join()
+            Qa.renders.remove(process)
+
+
+    @staticmethod
+    def waitQaReports():
+        """Block until all qa reports rendered in the background are completed
+        """
+        while Qa.renders:
+            Qa.renders.pop(0).join()
+
+
+    def __renderQaReport(self, background=False, onComplete=None):
+        """Supply the images of this task and create its html report
+        Args:
+            background: the report is rendered by a separate process, errors are log
+                instead of being raise
+            onComplete: a function without arguments called once the report is rendered
+        """
+        if background:
+            broker = Broker(self.config.get('general', 'tokens_file'))
+            broker.acquire(1)
+        currentDir = os.getcwd()
+        os.chdir(self.workingDir)
+        try:
+            self.createQaReport(self.qaSupplier())
+        except Exception, exception:
+            if not background:
+                raise
+            self.warning("Cannot create the qa report of task {}, the error message is: {}"
+                    .format(self.getName(), exception))
+        finally:
+            os.chdir(currentDir)
+            if background:
+                broker.release()
+            if onComplete is not None:
+                onComplete()
+
+
     def createQaReport(self, images):
         """create html report for a task with qaSupplier implemented
         Args:
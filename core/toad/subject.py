@@ -5,7 +5,7 @@ import xml.dom.minidom
 
 from core.toad.validation import Validation
 from logger import Logger
-from lib import xmlhelper
+from lib import xmlhelper, mriutil
 from lock import Lock
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
@@ -69,6 +69,7 @@ class Subject(Logger, Lock, Validation):
             self.info("creating log dir {}".format(self.__logDir))
             os.mkdir(self.__logDir)
         Logger.__init__(self, self.__logDir)
+        mriutil.setHeaderCache(os.path.join(self.__logDir, self.__config.get('general', 'header_cache_file_name')))
 
 
     def removeLogDir(self):
@@ -1,9 +1,18 @@
 # -*- coding: utf-8 -*-
+import multiprocessing
+import Queue
+import fcntl
 import glob
 import copy
+import math
+import time
+import sys
+import re
 import os
 
 from core.toad.tasksmanager import TasksManager
+from core.toad.planner import Planner
+from core.toad.qa import Qa
 from subject import Subject
 from logger import Logger
 from config import Config
@@ -124,6 +133,11 @@ class SubjectManager(Logger, Config):
 
         """
         name = subject.getName()
+
+        #log versions that will be use for the pipeline execution, tasks fingerprint depend on them
+        if not subject.isLock():
+            subject.createXmlSoftwareVersionConfig(self.softwareVersions)
+
         self.info("Evaluating which task subject {} should process".format(name))
         tasksmanager = TasksManager(subject)
 
@@ -133,13 +147,9 @@ class SubjectManager(Logger, Config):
                 message += "{}, ".format(task.getName())
             self.info("{}will be submitted into the pipeline".format(message))
 
-            if not subject.isLock():
+            if subject.lock():
                 try:
                     self.info("Starting subject {} at task {}".format(name, tasksmanager.getFirstRunnableTasks().getName()))
-                    subject.lock()
-
-                    #log versions that will be use for the pipeline execution
-                    subject.createXmlSoftwareVersionConfig(self.softwareVersions)
                     tasksmanager.run()
 
                 finally:
@@ -151,31 +161,248 @@ class SubjectManager(Logger, Config):
             self.info("Subject {} already completed, it will not be submitted!".format(name))
 
 
-    def __submitGridEngine(self, subject):
-        """Submit execution of the subject into the grid engine
-           this function will wrap a toad call with proper parameters for submission into a Sun or Torque Grid Engine
+    def __submitLocalConcurrently(self, subjects, nbProcesses):
+        """Submit execution of many subjects locally, each subject into is own process
 
         Args:
-            subject:  a subject
+            subjects: a list of subjects
+            nbProcesses: the maximum number of subjects processed at the same time
 
         """
+        pending = list(subjects)
+        running = {}
+        queue = multiprocessing.Queue()
+
+        try:
+            while pending or running:
+                while pending and len(running) < nbProcesses:
+                    subject = pending.pop(0)
+                    process = multiprocessing.Process(target=self.__submitLocalProcess, args=(subject, queue),
+                                                      name=subject.getName())
+                    process.start()
+                    running[subject.getName()] = process
+
+                try:
+                    name = queue.get(True, 5)
+                except Queue.Empty:
+                    #a process may have been killed without notifying
+                    for name, process in running.items():
+                        if not process.is_alive() and process.exitcode != 0:
+                            process.join()
+                            del running[name]
+                            self.warning("Subject {} was interrupted".format(name))
+                    continue
+
+                if name in running:
+                    running.pop(name).join()
+
+        except (KeyboardInterrupt, SystemExit):
+            for process in running.values():
+                process.terminate()
+                process.join()
+            raise
+
+
+    def __submitLocalProcess(self, subject, queue):
+        """Submit execution of a subject locally into a child process and notify the parent once finish
+
+        Args:
+            subject: a subject
+            queue: a multiprocessing Queue where the subject name is put once the execution is over
+
+        """
+        try:
+            self.__submitLocal(subject)
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            queue.put(subject.getName())
+
+
+    def __submitLocalTask(self, subject, taskName):
+        """Execute a single task of the subject locally, this is what a task job of the grid engine does
+
+        Jobs of independent tasks of a subject run concurrently, so they do not take the subject lock. A job
+        refuse to run while another toad pipeline hold that lock, and hold a lock of its own task so two jobs of
+        the same task never run at once. Only the task of the job is evaluated, see TasksManager.
+
+        The pipeline exit with status 100 if the task did not complete. This status put a Sun Grid Engine
+        job into error state and is consider as a failure by Torque, so the dependent jobs are never started.
+
+        Args:
+            subject: a subject
+            taskName: the name of the task to execute
 
+        """
+        if subject.isLock():
+            self.warning("Subject {} is locked by another toad pipeline, see {}, task {} will not be executed"
+                         .format(subject.getName(), subject.getLock(), taskName))
+            sys.exit(100)
+
+        #the lock is release by the system if the job is killed
+        with open(os.path.join(subject.getLogDir(), "{}.{}.lock".format(subject.getName(), taskName)), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            #evaluated once the lock is held, the task may have been completed by another job meanwhile
+            tasks = TasksManager(subject, taskName).getRunnableTasks()
+            if not tasks:
+                self.info("Task {} of subject {} already completed, it will not be submitted!".format(taskName, subject.getName()))
+                return
+
+            task = tasks[0]
+            try:
+                task.run()
+            except SystemExit:
+                pass
+            finally:
+                Qa.waitQaReports()
+                task.releaseNTreads()
+
+            if task.isTaskDirty():
+                self.warning("Task {} of subject {} did not complete".format(taskName, subject.getName()))
+                sys.exit(100)
+
+
+    def __getGridFlags(self, subject):
+        """Build the grid engine flags common to every job of a subject
+
+        Args:
+            subject:  a subject
+
+        Returns:
+            a string of qsub flags
+        """
         gridFlags = " -q {}".format(subject.getConfig().get('general', 'sge_queue'))
         if subject.getConfig().get('general', 'server') in ['magma', 'stark']:
             gridFlags += " -notify "
+        return gridFlags
 
-        if subject.getConfig().get('general', 'server') in ['mammouth']:
-            gridFlags += " -l walltime=48:00:00 "
 
+    def __getToadFlags(self, subject):
+        """Build the toad command line flags of a job executing a subject
+
+        Args:
+            subject:  a subject
+
+        Returns:
+            a string of toad flags
+        """
         toadFlags = " -l -p "
         if subject.getConfig().has_option('arguments', 'stop_before_task'):
             toadFlags += " --stopBeforeTask {} ".format(subject.getConfig().get('arguments', 'stop_before_task'))
 
         if not subject.getConfig().getboolean('arguments', 'tractography'):
             toadFlags += " --noTractography "
+        return toadFlags
+
+
+    def __getResourcesFlags(self, engine, resources):
+        """Build the qsub flags that reserve the resources declared by a task
 
-        cmd = "echo {0}/bin/toad {1} {2} | qsub -V -N {3} -o {4} -e {4} {5}".format(self.config.get('arguments', 'toad_dir'),
-              subject.getDir(), toadFlags , subject.getName(), subject.getLogDir(), gridFlags)
+        Sun Grid Engine reserve memory per slot, so the memory of the task is divided by its number of threads
+
+        Args:
+            engine: the grid engine flavour, sge or torque
+            resources: a dictionary with threads, memory and walltime keys, see GenericTask.getGridResources()
+
+        Returns:
+            a string of qsub flags
+        """
+        if engine == 'torque':
+            return " -l nodes=1:ppn={},mem={},walltime={} ".format(
+                resources['threads'], resources['memory'].lower() + 'b', resources['walltime'])
+
+        units = {'K': 1.0 / 1024, 'M': 1, 'G': 1024, 'T': 1024**2}
+        match = re.match(r"([\d.]+)\s*([KMGT]?)", resources['memory'].upper())
+        memory = float(match.group(1)) * units.get(match.group(2) or 'M')
+        return " -pe {} {} -l h_vmem={}M -l h_rt={} ".format(
+            self.config.get('general', 'sge_parallel_environment'), resources['threads'],
+            int(math.ceil(memory / resources['threads'])), resources['walltime'])
+
+
+    def __getDependenciesFlags(self, engine, jobIds):
+        """Build the qsub flags that hold a job until the jobs it depend on completed successfully
+
+        Args:
+            engine: the grid engine flavour, sge or torque
+            jobIds: a list of job identifiers
+
+        Returns:
+            a string of qsub flags
+        """
+        if not jobIds:
+            return ""
+        if engine == 'torque':
+            return " -W depend=afterok:{} ".format(":".join(jobIds))
+        return " -hold_jid {} ".format(",".join(jobIds))
+
+
+    def __submitGridEngineTasks(self, subject):
+        """Submit every runnable task of the subject as its own grid engine job
+
+        Each job is hold until the jobs of the tasks it depend on completed successfully
+        and reserve the resources declared by its task
+
+        Args:
+            subject:  a subject
+
+        """
+        tasksmanager = TasksManager(subject)
+        if not tasksmanager.getNumberOfRunnableTasks():
+            self.info("Subject {} already completed, it will not be submitted!".format(subject.getName()))
+            return
+
+        #log versions that will be use for the pipeline execution, jobs of the same subject may run concurrently
+        subject.createXmlSoftwareVersionConfig(self.softwareVersions)
+
+        config = subject.getConfig()
+        engine = config.get('general', 'grid_engine')
+        stopBeforeTask = config.get('arguments', 'stop_before_task') if config.has_option('arguments', 'stop_before_task') else None
+        jobs = {}
+        for task in tasksmanager.getRunnableTasks():
+            if stopBeforeTask is not None and stopBeforeTask in [task.getName(), task.getModuleName().lower()]:
+                self.info("Reach {} which is the value set by stop_before_task, remaining tasks will not be submitted"
+                          .format(stopBeforeTask))
+                break
+
+            dependencies = [jobs[dependency] for dependency in task.getDependencies() if dependency in jobs]
+            cmd = "echo {0}/bin/toad {1} {2} --onlyTask {3} | {4} -V -N {5}_{3} -o {6} -e {6} {7} {8} {9}".format(
+                self.config.get('arguments', 'toad_dir'), subject.getDir(), self.__getToadFlags(subject), task.getName(),
+                config.get('general', 'qsub'), subject.getName(), subject.getLogDir(), self.__getGridFlags(subject),
+                self.__getResourcesFlags(engine, task.getGridResources()), self.__getDependenciesFlags(engine, dependencies))
+            if engine == 'sge':
+                cmd += " -terse "
+            self.info("Command launch: {}".format(cmd))
+
+            (executedCmd, output, error) = util.launchCommand(cmd)
+            tokens = output.split() if output else []
+            if not tokens:
+                self.error("Submission of task {} of subject {} failed: {}".format(task.getName(), subject.getName(), error))
+            jobs[task.getName()] = tokens[0]
+            self.info("Task {} of subject {} submitted as job {}".format(task.getName(), subject.getName(), tokens[0]))
+
+
+    def __submitGridEngine(self, subject):
+        """Submit execution of the subject into the grid engine
+           this function will wrap a toad call with proper parameters for submission into a Sun or Torque Grid Engine
+
+        If grid_submission is set to task, every task is submitted as its own job instead
+
+        Args:
+            subject:  a subject
+
+        """
+        if subject.getConfig().get('general', 'grid_submission') == 'task':
+            self.__submitGridEngineTasks(subject)
+            return
+
+        gridFlags = self.__getGridFlags(subject)
+        if subject.getConfig().get('general', 'server') in ['mammouth']:
+            gridFlags += " -l walltime=48:00:00 "
+
+        cmd = "echo {0}/bin/toad {1} {2} | {6} -V -N {3} -o {4} -e {4} {5}".format(self.config.get('arguments', 'toad_dir'),
+              subject.getDir(), self.__getToadFlags(subject), subject.getName(), subject.getLogDir(), gridFlags,
+              subject.getConfig().get('general', 'qsub'))
         self.info("Command launch: {}".format(cmd))
 
         import subprocess
@@ -271,22 +498,77 @@ class SubjectManager(Logger, Config):
                     subjects.append(subject)
         return subjects
 
+    def __plan(self, directories):
+        """Print the tasks that would be submitted for every subject of the study
+
+        Subjects are neither validated nor locked and nothing is written into their directories.
+        The status of the tasks is estimated without importing them, see Planner
+
+        Args:
+            directories: a list of directories that may contain subjects
+
+        """
+        start = time.time()
+        subjects = 0
+        submitted = 0
+        for directory in sorted(directories):
+            subject = Subject(self.__copyConfig(directory))
+            if not subject.isAToadSubject():
+                continue
+            subjects += 1
+            plan = Planner(subject).getPlan()
+            tasks = [description.getName() for description, status, reason in plan if status in ["dirty", "impacted"]]
+            unknowns = [description.getName() for description, status, reason in plan if status == "unknown"]
+            if tasks:
+                submitted += 1
+            print "Subject {}: {} task(s) will be submitted {}".format(subject.getName(), len(tasks),
+                                                                     ", ".join(tasks))
+            if unknowns:
+                print "Subject {}: {} task(s) may be submitted {}".format(subject.getName(), len(unknowns),
+                                                                        ", ".join(unknowns))
+            for description, status, reason in plan:
+                print "    {:<28}{:<11}{}".format(description.getModuleName(), status, reason)
+            print
+
+        print "Plan of {} subject(s) computed in {:.2f} seconds, {} subject(s) have tasks to submit".format(
+            subjects, time.time() - start, submitted)
+
+
     def run(self):
         """Launch the pipeline
         """
 
+        if self.config.getboolean('arguments', 'plan'):
+            self.__plan(self.__expandDirectories())
+            return
+
         #create and validate subjects
         subjects = self.__subjectsFactory(self.__expandDirectories())
 
         #determine if subject some subjects are currently process
         subjects = self.__processLocksSubjects(subjects)
 
+        try:
+            nbParallelSubjects = max(1, int(self.config.get('general', 'nb_parallel_subjects')))
+        except ValueError:
+            nbParallelSubjects = 1
+
         #configure how many subjects will be submit. This information is sensitive for load balancing the grid
+        #locally, only the subjects processed at the same time share the server
+        if self.config.getboolean('arguments', 'local'):
+            nbSubjects = min(nbParallelSubjects, len(subjects))
+        else:
+            nbSubjects = len(subjects)
         for subject in subjects:
-            subject.setConfigItem("general", "nb_subjects", str(len(subjects)))
+            subject.setConfigItem("general", "nb_subjects", str(nbSubjects))
 
         if self.config.getboolean('arguments', 'reinitialize'):
             self.__reinitialize(subjects)
+        elif self.config.has_option('arguments', 'only_task'):
+            for subject in subjects:
+                self.__submitLocalTask(subject, self.config.get('arguments', 'only_task'))
+        elif self.config.getboolean('arguments', 'local') and nbSubjects > 1:
+            self.__submitLocalConcurrently(subjects, nbSubjects)
         else:
             for subject in subjects:
                     if self.config.getboolean('arguments', 'local'):
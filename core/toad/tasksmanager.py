@@ -1,11 +1,16 @@
 # -*- coding: utf-8 -*-
-import functools
+import multiprocessing
 import importlib
+import traceback
 import inspect
-import glob
+import Queue
 import sys
 import os
 
+from load import Load
+from qa import Qa
+import workflow
+
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
@@ -13,10 +18,20 @@ __credits__ = ["Mathieu Desrosiers"]
 
 class TasksManager(object):
 
-    def __init__(self, subject):
+    def __init__(self, subject, taskName=None):
+        """Instantiate the tasks of a subject and determine which of them should be submit
+
+        Args:
+            subject: a subject
+            taskName: only evaluate the task of that name, see __initializeRunnableTask()
+
+        """
         self.__subject = subject
         self.__tasks = self.__initialize()
-        self.__runnableTasks = self.__initializeRunnableTasks(self.__tasks)
+        if taskName is None:
+            self.__runnableTasks = self.__initializeRunnableTasks(self.__tasks)
+        else:
+            self.__runnableTasks = self.__initializeRunnableTask(self.__tasks, taskName)
 
 
     def getSubjectName(self):
@@ -88,9 +103,125 @@ class TasksManager(object):
     def run(self):
         """Execute the run() methods of every runnable tasks
 
+        Tasks are launched as soon as all their dependencies are completed. Independent tasks
+        run concurrently, each into is own process, up to the number of parallel tasks allowed
+        by the subject core budget. see Load.getNbParallelTasks()
+
+        """
+        nbParallelTasks = Load(self.__subject.getConfig()).getNbParallelTasks()
+        try:
+            if nbParallelTasks < 2 or len(self.__runnableTasks) < 2:
+                for task in self.__runnableTasks:
+                    task.run()
+                    task.releaseNTreads()
+            else:
+                self.__runConcurrently(nbParallelTasks)
+        finally:
+            Qa.waitQaReports()
+
+
+    def __runConcurrently(self, nbProcesses):
+        """Execute the runnable tasks into a bounded pool of processes, respecting dependencies
+
+        If a task fail, no more tasks will be launched. The pipeline exit once the tasks
+        that are still running finish. A task is completed as soon as it notify its outcome, its
+        process may still be rendering its qa report in the background and is joined later.
+
+        Args:
+            nbProcesses: the maximum number of tasks that could run at the same time
+
+        """
+        pending = list(self.__runnableTasks)
+        runnableNames = [task.getName() for task in pending]
+        completed = set()
+        running = {}
+        rendering = []
+        failures = []
+        queue = multiprocessing.Queue()
+
+        def __isReady(task):
+            for dependency in task.getDependencies():
+                if dependency in runnableNames and dependency not in completed:
+                    return False
+            return True
+
+        try:
+            while pending or running:
+                #reap the processes whose qa report is rendered
+                for process in [process for process in rendering if not process.is_alive()]:
+                    process.join()
+                    rendering.remove(process)
+
+                if not failures:
+                    for task in [task for task in pending if __isReady(task)]:
+                        if len(running) >= nbProcesses:
+                            break
+                        process = multiprocessing.Process(target=self.__runTask, args=(task, queue), name=task.getName())
+                        process.start()
+                        running[task.getName()] = process
+                        pending.remove(task)
+
+                if not running:
+                    break
+
+                try:
+                    name, status = queue.get(True, 5)
+                except Queue.Empty:
+                    #a process may have been killed without notifying
+                    for name, process in running.items():
+                        if not process.is_alive() and process.exitcode != 0:
+                            process.join()
+                            del running[name]
+                            failures.append(name)
+                    continue
+
+                if name not in running:
+                    continue
+                #the process exit once the qa report of its task is rendered, dependent tasks do not wait for it
+                rendering.append(running.pop(name))
+                if status:
+                    completed.add(name)
+                else:
+                    failures.append(name)
+
+        except (KeyboardInterrupt, SystemExit):
+            for process in running.values() + rendering:
+                process.terminate()
+                process.join()
+            raise
+
+        for process in rendering:
+            process.join()
+
+        if failures:
+            print "Task(s) {} did not complete, exiting the pipeline".format(", ".join(failures))
+            sys.exit()
+
+        if pending:
+            print "Task(s) {} could not be launched, unresolved dependencies".format(
+                ", ".join([task.getName() for task in pending]))
+            sys.exit()
+
+
+    def __runTask(self, task, queue):
+        """Execute the run() method of a task into a child process and notify the parent of the outcome
+
+        Args:
+            task: the task to execute
+            queue: a multiprocessing Queue where a tuple (task name, success) is put once the task is over
+
         """
-        for task in self.__runnableTasks:
+        success = False
+        try:
             task.run()
+            #run() return normally even when every submission failed, the task is only over once it is clean
+            success = not task.isTaskDirty()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except Exception:
+            print "traceBack = ", traceback.format_exc()
+        finally:
+            queue.put((task.getName(), success))
 
 
     def __initialize(self):
@@ -103,12 +234,7 @@ class TasksManager(object):
 
         """
         tasks =[]
-        tasksFiles = glob.glob("{}/tasks/*.py".format(self.__subject.getConfig().get('arguments','toad_dir')))
-        customTasks = self.__subject.getConfig().get('arguments','custom_tasks')
-        if customTasks is not None:
-            for customTask in customTasks:
-                if os.path.isfile(customTask):
-                    tasksFiles.append(os.path.abspath(customTask))
+        tasksFiles = workflow.getTasksFiles(self.__subject.getConfig())
         for taskFile in tasksFiles:
             task= self.__instanciateIfATask(taskFile)
             if task is not None:
@@ -178,30 +304,20 @@ class TasksManager(object):
             A list of instances that need to be execute
         """
 
-        workflow = []
-
         #remove ignored tasks first
         tasks = self.__removeIgnoredTasks(tasks)
 
-        #resolve all dependencies
-        graphOfDependencies = self.__resolveDependencies(tasks)
-
-        orderedTasksList = []
-        for sameLevelSet in graphOfDependencies:
-            sameLevelList =  list(sameLevelSet)
-            orderedTasksList.extend(sorted(sameLevelList,
-                                           key=lambda task: task.getOrder() if task.getOrder() is not None else 100))
-
-        #reorder tasks list
+        #resolve all dependencies then reorder tasks list
+        orderedTasksList = workflow.sortTasks(tasks)
         for index, task in enumerate(orderedTasksList):
             task.setOrder(index)
-            orderedTasksList[index] = task
 
         #determine all impacts the dirty tasks could have
-        for dirtyTask in self.__getDirtyTasks(orderedTasksList):
-            workflow += self.__getWorkflow(dirtyTask, orderedTasksList)
+        def __getStatus(task):
+            return ("dirty", "") if task.isTaskDirty() else ("completed", "")
 
-        tasks = sorted(set(workflow))
+        tasks = sorted(task for task, status, reason in workflow.getWorkflow(orderedTasksList, __getStatus)
+                       if status in ["dirty", "impacted"])
 
         for task in tasks:
             task.initializeTasksAsReferences(tasks)
@@ -209,58 +325,24 @@ class TasksManager(object):
         return tasks
 
 
-    def __getWorkflow(self, source, tasks):
-        """
-        Return the work flow of a specific task
+    def __initializeRunnableTask(self, tasks, taskName):
+        """Determine if a single task should be submit, this is what a task job of the grid engine does
 
-        A workflow is an array that represent all tasks that will be impact if the source task is to be submit into the
-        pipeline
+        Other tasks are instantiated for their directories but never evaluated: a job is hold by the grid engine
+        until the jobs of the tasks it depend on completed, and a task impacted by them see its fingerprint change.
 
         Args:
-            instances: An array containing all pipeline tasks instances. see __getInstances
-            source: a task
-
-        Returns:
-            An array of task name that represent the workflow that a task will impact
-        """
-        arrayOfTasks = []
-        flaggedTasks = [source]
-
-        for task in tasks:
-            arrayOfTasks.append(task)
-
-        for task in tasks[:]:
-            if task is source:
-                break
-            else:
-                arrayOfTasks.remove(task)
-
-        for task in arrayOfTasks:
-            for dependency in task.getDependencies():
-                for flagged in flaggedTasks:
-                    if dependency == flagged.getName():
-                        flaggedTasks.append(task)
-
-        return sorted(set(flaggedTasks))
-
-
-    def __getDirtyTasks(self, tasks):
-        """ get the list of all dirty task
-
-        If a task is marked as ignore it will be remove from the list
-
-        Args:
-            tasks: a list containing all tasks into the pipeline
-
-        Returns:
-            a list of dirty tasks
+            tasks: a list of available tasks
+            taskName: the name of the task
 
+        Returns
+            A list that contain the task if it need to be execute, an empty list otherwise
         """
-        dirtyTasks=[]
         for task in tasks:
-            if task.isTaskDirty():
-                dirtyTasks.append(task)
-        return dirtyTasks
+            if task.getName() == taskName and not task.isIgnore() and task.isTaskDirty():
+                task.initializeTasksAsReferences([task])
+                return [task]
+        return []
 
 
     def __removeIgnoredTasks(self, tasks):
@@ -278,70 +360,3 @@ class TasksManager(object):
             if not task.isIgnore():
                 mandatory.append(task)
         return mandatory
-
-
-    def __sortGraph(self, dictionnaries):
-        """Dependencies are expressed as a dictionary whose keys are task order
-        and whose values are a set of order dependencies .
-
-        Args:
-            dictionnaries: a dictionary whose keys are task numerical order value and whose
-                values are a set of numerical dependencies see: GenericTask.setOrder()
-
-        Returns:
-            Output is a list of sets in topological order.
-
-        """
-        if len(dictionnaries) == 0:
-            return
-        dictionnaries = dictionnaries.copy()
-
-        for key, value in dictionnaries.items():
-            value.discard(key)
-
-        valueNotDependings= functools.reduce(set.union, dictionnaries.values()) - set(dictionnaries.keys())
-        dictionnaries.update({dependency:set() for dependency in valueNotDependings})
-        while True:
-            ordered = set(value for value, dependency in dictionnaries.items() if len(dependency) == 0)
-            if not ordered:
-                break
-            yield ordered
-            dictionnaries = {value: (dependency - ordered)
-                    for value, dependency in dictionnaries.items()
-                        if value not in ordered}
-
-        if len(dictionnaries) != 0:
-            raise ValueError('Found a cycling dependencies that exist among: {}'.format(', '.join(repr(value) for value in dictionnaries.items())))
-
-
-    def __resolveDependencies(self, tasks):
-        """Produce a list of sets of tasks in topological order base on dependencies.
-
-        Args:
-            tasks: A list of task
-
-        Returns:
-            a list of set of Tasks in topological order
-
-        """
-        tasksDictionnaries = {}
-        numericalDictionnaries = {}
-        tasksGraph = []
-        for index, task in enumerate(tasks):
-            tasksDictionnaries[task] = index
-
-        for task, order in tasksDictionnaries.iteritems():
-            dependenciesSet = set()
-            for dependency in task.getDependencies():
-                for task in tasks:
-                    if task.getName() == dependency:
-                        dependenciesSet |= {tasksDictionnaries[task]}
-            numericalDictionnaries[order] = dependenciesSet
-
-        for sets in list(self.__sortGraph(numericalDictionnaries)):
-            aSet = set()
-            for order in sets:
-                aSet.add(tasks[order])
-            tasksGraph.append(aSet)
-
-        return tasksGraph
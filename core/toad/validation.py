@@ -47,6 +47,9 @@ class Validation(object):
             False if one of those file are missing, True otherwise
 
         """
+        #headers read during a previous validation of this subject are reused
+        mriutil.setHeaderCache(os.path.join(self.workingDir, self.config.get('dir', 'log'),
+                                            self.config.get('general', 'header_cache_file_name')))
         result = True
 
         if os.path.exists(self.backupDir):
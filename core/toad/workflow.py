@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Discovery, ordering and impacts of the tasks of a subject
+
+These functions are shared by the TasksManager, which works on task instances, and by the Planner, which works
+on task descriptions. Tasks only need to provide getName(), getOrder() and getDependencies().
+"""
+
+
+def getTasksFiles(config):
+    """List the python files of the pipeline tasks and of the custom tasks
+
+    Args:
+        config: a configParser
+
+    Returns:
+        a list of file names
+    """
+    tasksFiles = glob.glob("{}/tasks/*.py".format(config.get('arguments', 'toad_dir')))
+    customTasks = config.get('arguments', 'custom_tasks')
+    if customTasks is not None:
+        for customTask in customTasks:
+            if os.path.isfile(customTask):
+                tasksFiles.append(os.path.abspath(customTask))
+    return tasksFiles
+
+
+def sortTasks(tasks):
+    """Sort tasks in topological order base on their dependencies
+
+    Tasks are grouped by level, a level only depend on the previous ones. Into a level, tasks are sorted
+    by order, tasks without order come last. Dependencies on tasks that are not into the list are ignored.
+
+    Args:
+        tasks: a list of tasks
+
+    Returns:
+        a new list of tasks
+
+    Raises:
+        ValueError: some tasks depend on each other
+    """
+    names = set(task.getName() for task in tasks)
+    pending = dict((task, set(dependency for dependency in task.getDependencies()
+                              if dependency in names and dependency != task.getName())) for task in tasks)
+    ordered = []
+    while pending:
+        level = [task for task, dependencies in pending.iteritems() if not dependencies]
+        if not level:
+            raise ValueError('Found a cycling dependencies that exist among: {}'.format(', '.join(map(repr, pending))))
+        done = set(task.getName() for task in level)
+        for task in level:
+            del pending[task]
+        for dependencies in pending.itervalues():
+            dependencies -= done
+        ordered.extend(sorted(level, key=lambda task: task.getOrder() if task.getOrder() is not None else 100))
+    return ordered
+
+
+def getWorkflow(tasks, getStatus):
+    """Determine the status of every task and the tasks impacted by the ones that need to be submit
+
+    Statuses are propagated in a single pass: a completed task that depend on a dirty or impacted task
+    is impacted, and a completed task that depend on a task whose status is unknown is unknown too.
+
+    Args:
+        tasks: a list of tasks sorted by sortTasks()
+        getStatus: a function that receive a task and return a 2 elements tuple, its status, ignored, dirty,
+                   unknown or completed, and the reason of that status
+
+    Returns:
+        a list of 3 elements tuples: a task, its status and the reason of that status.
+        status is one of ignored, dirty, impacted, unknown or completed
+    """
+    workflow = []
+    submitted = set()
+    unknowns = set()
+    for task in tasks:
+        status, reason = getStatus(task)
+        if status == "completed":
+            impacts = [dependency for dependency in task.getDependencies() if dependency in submitted]
+            uncertainties = [dependency for dependency in task.getDependencies() if dependency in unknowns]
+            if impacts:
+                status, reason = "impacted", "depend on {}".format(", ".join(impacts))
+            elif uncertainties:
+                status, reason = "unknown", "depend on {}".format(", ".join(uncertainties))
+        if status in ["dirty", "impacted"]:
+            submitted.add(task.getName())
+        elif status == "unknown":
+            unknowns.add(task.getName())
+        workflow.append((task, status, reason))
+    return workflow
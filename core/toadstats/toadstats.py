@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import glob
+import csv
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from lib import ledger
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class Toadstats(object):
+
+    def __init__(self, directories, ledgerName="ledger.csv"):
+        """Aggregate the ledgers recorded by the pipeline across one or many studies
+
+        Args:
+            directories: a list of study or subject directories
+            ledgerName: the name of the ledger files, see ledger_file_name into config.cfg
+
+        """
+        self.__ledgers = []
+        self.__records = []
+        for directory in directories:
+            #ledgers live into the log directory of each subject
+            for depth in range(0, 3):
+                pattern = os.path.join(directory, *(["*"] * depth + [ledgerName]))
+                for filename in sorted(glob.glob(pattern)):
+                    filename = os.path.abspath(filename)
+                    if filename not in self.__ledgers:
+                        self.__ledgers.append(filename)
+        for filename in self.__ledgers:
+            self.__records.extend(ledger.read(filename))
+
+
+    def getLedgers(self):
+        return self.__ledgers
+
+
+    def getRecords(self):
+        return self.__records
+
+
+    def summarize(self, key, kind="command"):
+        """Group the records of a kind by a key and sort the groups by cpu time consumed
+
+        Args:
+            key: the field used for grouping: binary, task or subject
+            kind: command or task
+
+        Returns:
+            a list of dictionaries, the most expensive group first
+        """
+        groups = {}
+        for record in self.__records:
+            if record['kind'] != kind:
+                continue
+            name = record[key]
+            if name not in groups:
+                groups[name] = {'name': name, 'count': 0, 'failures': 0, 'wall': 0.0, 'cpu': 0.0, 'maxrss': 0.0}
+            group = groups[name]
+            group['count'] += 1
+            if record['status'] not in ["0", "completed", "restored"]:
+                group['failures'] += 1
+            group['wall'] += record['wall']
+            group['cpu'] += record['user'] + record['system']
+            group['maxrss'] = max(group['maxrss'], record['maxrss'])
+
+        return sorted(groups.values(), key=lambda group: group['cpu'], reverse=True)
+
+
+    def writeCsv(self, source, key, kind="command"):
+        """Write a summary into a csv file
+
+        Args:
+            source: the csv file name
+            key: the field used for grouping: binary, task or subject
+            kind: command or task
+
+        """
+        fields = ['name', 'count', 'failures', 'wall', 'cpu', 'maxrss']
+        with open(source, 'w') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writerow(dict(zip(fields, fields)))
+            for group in self.summarize(key, kind):
+                writer.writerow(group)
+
+
+    def __formatSummary(self, title, groups, limit):
+        totalCpu = sum(group['cpu'] for group in groups)
+        msg = "\n{}\n".format(title)
+        msg += "\t{:<32}{:>8}{:>10}{:>12}{:>12}{:>8}{:>14}\n".format("name", "count", "failures", "wall (h)", "cpu (h)", "cpu %", "max rss (MB)")
+        for group in groups[:limit]:
+            share = 100.0 * group['cpu'] / totalCpu if totalCpu > 0 else 0.0
+            msg += "\t{:<32}{:>8}{:>10}{:>12.2f}{:>12.2f}{:>8.1f}{:>14.0f}\n".format(
+                group['name'][:31], group['count'], group['failures'],
+                group['wall'] / 3600.0, group['cpu'] / 3600.0, share, group['maxrss'] / 1024.0)
+        return msg
+
+
+    def report(self, limit=20):
+        """Produce a human readable report of the hotspots
+
+        Args:
+            limit: the maximum number of lines of each table
+
+        Returns:
+            the report as a string
+        """
+        if not self.__records:
+            return "No ledger found\n"
+
+        msg = "\t{} records found into {} ledgers\n".format(len(self.__records), len(self.__ledgers))
+        msg += self.__formatSummary("Commands ordered by cpu time:", self.summarize("binary", "command"), limit)
+        msg += self.__formatSummary("Tasks ordered by cpu time:", self.summarize("task", "task"), limit)
+        msg += self.__formatSummary("Subjects ordered by cpu time:", self.summarize("subject", "task"), limit)
+        return msg
+
+
+    def __repr__(self):
+        return self.report()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import struct
+import zlib
+
+from lib import lazy
+
+numpy = lazy.Module('numpy')
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Minimal animated png encoder
+
+Frames are compressed independently, so they could be compressed by the processes that render them,
+then assembled into a single animated png that every modern browser display like an animated gif.
+"""
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def compressFrame(pixels, level=6):
+    """Filter and compress the pixels of a frame
+
+    Every row use the png Up filter, the difference with the previous row, which is cheap to compute
+    and compress well the large uniform areas of the qa figures
+
+    Args:
+        pixels: a numpy array of shape (height, width, 3) or (height, width, 4), an alpha channel is dropped
+        level: the zlib compression level
+
+    Returns:
+        a 3 elements tuple: the width, the height and the compressed data of the frame
+    """
+    pixels = numpy.ascontiguousarray(pixels[:, :, :3], dtype=numpy.uint8)
+    height, width = pixels.shape[:2]
+    filtered = numpy.empty((height, width * 3 + 1), dtype=numpy.uint8)
+    filtered[:, 0] = 2
+    rows = pixels.reshape(height, width * 3)
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+    return width, height, zlib.compress(filtered.tostring(), level)
+
+
+def writeApng(frames, target, delay=30, plays=0):
+    """Assemble compressed frames into an animated png
+
+    Args:
+        frames: a list of frames as return by compressFrame, every frame must have the same dimension
+        target: the name of the animated png
+        delay: delay between frames in hundredths of second
+        plays: number of times the animation is played, 0 for infinite looping
+
+    Returns:
+        the name of the animated png
+    """
+    width, height = frames[0][:2]
+    sequence = 0
+    with open(target, 'wb') as f:
+        f.write(SIGNATURE)
+        f.write(__chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(__chunk(b'acTL', struct.pack(">II", len(frames), plays)))
+        for index, (frameWidth, frameHeight, data) in enumerate(frames):
+            if (frameWidth, frameHeight) != (width, height):
+                raise ValueError("Frame {} is {}x{} while the animation is {}x{}"
+                                 .format(index, frameWidth, frameHeight, width, height))
+            f.write(__chunk(b'fcTL', struct.pack(">IIIIIHHBB", sequence, width, height, 0, 0, delay, 100, 0, 0)))
+            sequence += 1
+            if index == 0:
+                f.write(__chunk(b'IDAT', data))
+            else:
+                f.write(__chunk(b'fdAT', struct.pack(">I", sequence) + data))
+                sequence += 1
+        f.write(__chunk(b'IEND', b''))
+    return target
+
+
+def __chunk(kind, data):
+    """Build a png chunk
+
+    Args:
+        kind: the 4 letters type of the chunk
+        data: the content of the chunk
+
+    Returns:
+        the chunk as a string of bytes
+    """
+    crc = zlib.crc32(kind + data) & 0xffffffff
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", crc)
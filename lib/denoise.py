@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+
+from lib import lazy
+
+numpy = lazy.Module('numpy', 'numpy.lib.format')
+nibabel = lazy.Module('nibabel')
+dipy = lazy.Module('dipy', 'dipy.denoise.nlmeans', 'dipy.denoise.noise_estimate')
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Parallel denoising of 4D images
+
+Volumes along the gradient axis are denoised independently by nlmeans, so they are distributed across a pool
+of processes. The source image is memory mapped and every process write its volumes straight into a
+preallocated float32 array, no process ever hold more than a few volumes in memory. The noise is estimated
+from the memory mapped image as well, a volume or a slice at a time.
+"""
+
+__worker = {}
+
+
+def nlmeans(source, target, sigma, nbProcesses=1, workingDir=None):
+    """Denoise a 4D image with the non local means algorithm using many processes
+
+    Args:
+        source: an uncompressed nifti image, usually a dwi
+        target: the name of the resulting image
+        sigma: the standard deviation of the noise
+        nbProcesses: the number of processes to deploy
+        workingDir: the directory where the intermediate array is created, the directory of target if None
+
+    Returns:
+        the name of the resulting image
+
+    """
+    image = nibabel.load(source)
+    header = image.get_header()
+    shape = header.get_data_shape()
+    if len(shape) < 4:
+        shape = tuple(shape) + (1,)
+
+    if workingDir is None:
+        workingDir = os.path.dirname(os.path.abspath(target))
+    output = os.path.join(workingDir, ".{}.{}.npy".format(os.path.basename(target), os.getpid()))
+    data = numpy.lib.format.open_memmap(output, mode='w+', dtype=numpy.float32, shape=shape, fortran_order=True)
+    del data
+
+    arguments = __getLayout(source)
+    arguments.update({'output': output, 'sigma': sigma})
+
+    volumes = range(shape[3])
+    try:
+        if nbProcesses > 1 and len(volumes) > 1:
+            pool = multiprocessing.Pool(min(nbProcesses, len(volumes)), __initWorker, (arguments,))
+            try:
+                pool.map(__denoiseVolume, volumes, chunksize=1)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            __initWorker(arguments)
+            for volume in volumes:
+                __denoiseVolume(volume)
+            __worker.clear()
+
+        data = numpy.load(output, mmap_mode='r')
+        if len(header.get_data_shape()) < 4:
+            data = data[..., 0]
+        resultHeader = header.copy()
+        resultHeader.set_data_dtype(numpy.float32)
+        #nibabel write memory mapped arrays slice by slice
+        nibabel.save(nibabel.Nifti1Image(data, image.get_affine(), resultHeader), target)
+        del data
+    finally:
+        if os.path.exists(output):
+            os.remove(output)
+    return target
+
+
+def noiseStd(source, mask):
+    """Compute the standard deviation of the voxels of a 4D image that are inside a mask, across every volume
+
+    The mean is computed first, then the deviations from it, each pass reading a volume at a time
+
+    Args:
+        source: an uncompressed nifti image, usually a dwi
+        mask: a 3D boolean array
+
+    Returns:
+        the standard deviation as a float
+    """
+    layout = __getLayout(source)
+    data = __memmap(layout)
+    nbVolumes = layout['shape'][3]
+    count = numpy.count_nonzero(mask) * nbVolumes
+    if count == 0:
+        return float('nan')
+
+    total = 0.0
+    for volume in range(nbVolumes):
+        total += __scale(data[..., volume][mask], layout).sum(dtype=numpy.float64)
+    mean = total / count
+
+    deviations = 0.0
+    for volume in range(nbVolumes):
+        values = __scale(data[..., volume][mask], layout).astype(numpy.float64) - mean
+        deviations += numpy.dot(values, values)
+    return numpy.sqrt(deviations / count)
+
+
+def piesno(source, N):
+    """Estimate the noise of a 4D image with the piesno algorithm of dipy, a slice at a time
+
+    Like dipy, each slice is estimated on its own across every volume, only that slice is read into memory
+
+    Args:
+        source: an uncompressed nifti image, usually a dwi
+        N: the number of phase array coils of the mri scanner
+
+    Returns:
+        a 2 elements tuple: an array of the standard deviations of the noise of each slice and
+        a 3D boolean mask of the voxels that are pure noise
+    """
+    layout = __getLayout(source)
+    data = __memmap(layout)
+    shape = layout['shape']
+    sigma = numpy.zeros(shape[2], dtype=numpy.float32)
+    mask = numpy.zeros(shape[:3], dtype=numpy.bool)
+    for index in range(shape[2]):
+        sigma[index], mask[..., index] = dipy.denoise.noise_estimate.piesno(
+            __scale(data[:, :, index, :], layout), N=N, return_mask=True)
+    return sigma, mask
+
+
+def __getLayout(source):
+    """Describe where and how the data of an uncompressed nifti image are stored
+
+    Args:
+        source: an uncompressed nifti image
+
+    Returns:
+        a dictionary with source, offset, dtype, shape, slope and inter keys, shape always have 4 dimensions
+    """
+    image = nibabel.load(source)
+    shape = image.get_header().get_data_shape()
+    if len(shape) < 4:
+        shape = tuple(shape) + (1,)
+
+    #the proxy know where the data start into the file, the image header does not
+    proxy = image.dataobj
+    return {'source': source,
+            'offset': int(proxy.offset),
+            'dtype': numpy.dtype(proxy.dtype),
+            'shape': shape,
+            'slope': proxy.slope,
+            'inter': proxy.inter}
+
+
+def __memmap(layout):
+    """Memory map the data of an uncompressed nifti image, see __getLayout()
+    """
+    return numpy.memmap(layout['source'], dtype=layout['dtype'], mode='r',
+                        offset=layout['offset'], shape=layout['shape'], order='F')
+
+
+def __scale(data, layout):
+    """Read a part of a memory mapped image as float32 values, the scaling of the image is applied
+
+    Args:
+        data: a part of a memory mapped image
+        layout: the description of the image, see __getLayout()
+
+    Returns:
+        an array of float32
+    """
+    data = numpy.asarray(data, dtype=numpy.float32)
+    slope, inter = layout['slope'], layout['inter']
+    if slope is not None and numpy.isfinite(slope) and slope != 0:
+        data = data * slope
+    if inter is not None and numpy.isfinite(inter):
+        data = data + inter
+    return data
+
+
+def __initWorker(arguments):
+    """Memory map the source image and the output array into a worker process
+
+    Args:
+        arguments: a dictionary describing the source and the output arrays
+
+    """
+    __worker.clear()
+    __worker.update(arguments)
+    __worker['data'] = __memmap(arguments)
+    __worker['result'] = numpy.load(arguments['output'], mmap_mode='r+')
+
+
+def __denoiseVolume(volume):
+    """Denoise a single volume of the source image and write it into the output array
+
+    Args:
+        volume: the index of the volume along the fourth axis
+
+    """
+    data = __scale(__worker['data'][..., volume], __worker)
+    __worker['result'][..., volume] = dipy.denoise.nlmeans.nlmeans(data, __worker['sigma'])
+    __worker['result'].flush()
+    return volume
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import importlib
+import types
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Import modules on first use
+
+Scientific packages like numpy, nibabel, dipy or matplotlib take seconds to import from a shared filesystem.
+Modules that only need them into some functions declare them as lazy modules instead:
+
+    numpy = lazy.Module('numpy')
+    dipy = lazy.Module('dipy', 'dipy.reconst.dti', 'dipy.segment.mask')
+
+The package and its submodules are imported the first time one of its attributes is accessed, so the code
+that use them is written exactly as if the modules had been imported at the top of the file.
+"""
+
+
+class Module(types.ModuleType):
+
+    def __init__(self, name, *submodules, **kwargs):
+        """A module that is imported the first time one of its attributes is accessed
+
+        Args:
+            name: the name of the package or module
+            *submodules: fully qualified names of submodules to import along with the package,
+                         they become attributes of the package like with an import statement
+            **kwargs: setup, a function call with the package once it is imported and before the
+                      submodules are imported, ex: to select the matplotlib backend
+
+        """
+        types.ModuleType.__init__(self, name)
+        self.__submodules = submodules
+        self.__setup = kwargs.get('setup')
+        self.__module = None
+
+
+    def __getattr__(self, name):
+        """Import the module, then return the attribute from the real module
+
+        The attributes of the module are copied into this one, so only the first access
+        and the attributes added to the module afterward go through this method
+
+        """
+        if name.startswith('_Module__'):
+            raise AttributeError(name)
+        if self.__module is None:
+            self.__load()
+        return getattr(self.__module, name)
+
+
+    def __repr__(self):
+        if self.__module is None:
+            return "<lazy module '{}' not yet imported>".format(self.__name__)
+        return repr(self.__module)
+
+
+    def __load(self):
+        """Import the module, call the setup function and import the submodules
+
+        """
+        module = importlib.import_module(self.__name__)
+        if self.__setup is not None:
+            self.__setup(module)
+        for submodule in self.__submodules:
+            importlib.import_module(submodule)
+        self.__dict__.update(module.__dict__)
+        self.__module = module
+
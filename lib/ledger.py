@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import datetime
+import resource
+import fcntl
+import time
+import csv
+import os
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+"""Timing ledger of the commands and tasks executed by the pipeline
+
+Every record is a line of a csv file stored into the log directory of a subject. Times are in seconds
+and the peak resident set size in kilobytes.
+"""
+
+FIELDS = ['timestamp', 'subject', 'task', 'kind', 'binary', 'wall', 'user', 'system', 'maxrss', 'status', 'command']
+
+__context = {'filename': None, 'subject': None, 'task': None}
+
+
+def activate(filename, subject, task):
+    """Record the following commands into a ledger file on behalf of a task
+
+    Args:
+        filename: the ledger file name
+        subject: the name of the subject
+        task: the name of the task
+
+    """
+    __context.update({'filename': filename, 'subject': subject, 'task': task})
+
+
+def deactivate():
+    """Stop recording commands into the ledger
+
+    """
+    __context.update({'filename': None, 'subject': None, 'task': None})
+
+
+def snapshot():
+    """Capture the wall clock and the resources usage of this process and its terminated children
+
+    Returns:
+        a 3 elements tuple: the time, the usage of this process and the usage of its children
+    """
+    return time.time(), resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def measure(start, includeSelf=False, rusage=None):
+    """Compute the resources consumed since a snapshot
+
+    Peak resident set size is the high water mark of the terminated children, and of
+    this process if includeSelf is True.
+
+    Args:
+        start: a snapshot as return by snapshot()
+        includeSelf: add the resources consumed by this process to the resources consumed by its children
+        rusage: the exact resources usage of a single child as return by os.wait4, used instead
+                of the difference of the children usage
+
+    Returns:
+        a dictionary with wall, user, system and maxrss keys
+    """
+    now, usageSelf, usageChildren = snapshot()
+    wall, startSelf, startChildren = start
+    if rusage is not None:
+        user = rusage.ru_utime
+        system = rusage.ru_stime
+        maxrss = rusage.ru_maxrss
+    else:
+        user = usageChildren.ru_utime - startChildren.ru_utime
+        system = usageChildren.ru_stime - startChildren.ru_stime
+        maxrss = usageChildren.ru_maxrss
+    if includeSelf:
+        user += usageSelf.ru_utime - startSelf.ru_utime
+        system += usageSelf.ru_stime - startSelf.ru_stime
+        maxrss = max(maxrss, usageSelf.ru_maxrss)
+    return {'wall': round(now - wall, 3), 'user': round(user, 3), 'system': round(system, 3), 'maxrss': maxrss}
+
+
+def record(kind, binary, usage, status, command=""):
+    """Append a record into the ledger if a ledger have been activated
+
+    Args:
+        kind: command or task
+        binary: the name of the program or of the task
+        usage: a dictionary as return by measure()
+        status: the exit status of the command or the outcome of the task
+        command: the command line executed
+
+    Returns:
+        True if the record have been written, False otherwise
+    """
+    filename = __context['filename']
+    if filename is None:
+        return False
+
+    row = dict(usage)
+    row.update({'timestamp': datetime.datetime.now().strftime("%Y%m%d %H:%M:%S"),
+                'subject': __context['subject'],
+                'task': __context['task'],
+                'kind': kind,
+                'binary': binary,
+                'status': status,
+                'command': command})
+    try:
+        with open(filename, 'a') as f:
+            #concurrent tasks of the same subject share the ledger
+            fcntl.flock(f, fcntl.LOCK_EX)
+            writer = csv.DictWriter(f, FIELDS)
+            if f.tell() == 0:
+                writer.writerow(dict(zip(FIELDS, FIELDS)))
+            writer.writerow(row)
+    except IOError:
+        return False
+    return True
+
+
+def read(filename):
+    """Read all records of a ledger
+
+    Args:
+        filename: the ledger file name
+
+    Returns:
+        a list of dictionaries, numerical values are converted to float
+    """
+    records = []
+    if not os.path.isfile(filename):
+        return records
+    with open(filename, 'r') as f:
+        for row in csv.DictReader(f):
+            for field in ['wall', 'user', 'system', 'maxrss']:
+                try:
+                    row[field] = float(row[field])
+                except (TypeError, ValueError):
+                    row[field] = 0.0
+            records.append(row)
+    return records
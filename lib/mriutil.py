@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
-import nibabel
 import random
-import scipy
-import numpy
+import atexit
 import util
+import lazy
+import fcntl
+import json
 import os
 from collections import OrderedDict
 
+nibabel = lazy.Module('nibabel', 'nibabel.orientations')
+scipy = lazy.Module('scipy', 'scipy.ndimage', 'scipy.ndimage.morphology')
+numpy = lazy.Module('numpy')
+
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers"]
@@ -147,6 +152,119 @@ def __getMrinfoFieldValues(text, field, delimiter=""):
     return output
 
 
+__headers = {'filename': None, 'entries': {}, 'pending': {}}
+
+
+def setHeaderCache(filename):
+    """Persist the headers read by getMriHeader into a file, usually one per subject
+
+    Headers already recorded into the file are loaded, so images headers are parsed only once
+    across the executions of the pipeline. The headers in memory are those of the current file only,
+    the headers read since the previous file was set are written into it first.
+
+    Args:
+        filename: a json file name, None to keep the headers into memory only
+
+    """
+    if filename == __headers['filename']:
+        return
+    flushHeaderCache()
+    __headers['filename'] = filename
+    __headers['entries'] = {}
+    if filename is not None and os.path.isfile(filename):
+        try:
+            with open(filename, 'r') as f:
+                __headers['entries'].update(json.load(f))
+        except (IOError, ValueError):
+            pass
+
+
+def flushHeaderCache():
+    """Write the headers read since the last flush into the headers cache file, see setHeaderCache
+
+    The file is rewritten once with every new entry, usually at the end of a task
+
+    """
+    filename = __headers['filename']
+    pending = __headers['pending']
+    __headers['pending'] = {}
+    if not pending or filename is None or not os.path.isdir(os.path.dirname(filename)):
+        return
+    try:
+        with open(filename, 'a+') as f:
+            #concurrent tasks of the same subject share the cache
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                entries = json.load(f)
+            except ValueError:
+                entries = {}
+            entries.update(pending)
+            f.seek(0)
+            f.truncate()
+            json.dump(entries, f)
+    except IOError:
+        pass
+
+
+atexit.register(flushHeaderCache)
+
+
+def getMriHeader(source):
+    """Read the dimensions, voxel size and strides of an image from its header, without reading the data
+
+    Headers are memoized by file name, modification time and size. Values are express the same way
+    mrinfo does: axes are reordered to match the closest RAS orientation and the strides describe the
+    layout of the data on disk.
+
+    Args:
+        source: A mri image
+
+    Returns:
+        a dictionary with dimensions, voxelSize and strides keys, each a list of strings,
+        None if the image format cannot be read by nibabel
+
+    """
+    source = os.path.abspath(source)
+    try:
+        stat = os.stat(source)
+    except OSError:
+        return None
+    entry = __headers['entries'].get(source)
+    if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+        return entry['header']
+
+    try:
+        image = nibabel.load(source)
+    except Exception:
+        return None
+    header = image.get_header()
+    shape = header.get_data_shape()
+    zooms = header.get_zooms()
+    try:
+        orientations = nibabel.orientations.io_orientation(image.get_affine())
+    except Exception:
+        orientations = [[axis, 1] for axis in range(3)]
+
+    dimensions = list(shape)
+    voxelSize = list(zooms)
+    strides = range(1, len(shape) + 1)
+    for axis, (closest, flip) in enumerate(orientations[:len(shape)]):
+        if numpy.isnan(closest):
+            continue
+        dimensions[int(closest)] = shape[axis]
+        voxelSize[int(closest)] = zooms[axis]
+        strides[int(closest)] = (axis + 1) * int(flip)
+
+    entry = {'mtime': stat.st_mtime, 'size': stat.st_size,
+             'header': {'dimensions': [str(dimension) for dimension in dimensions],
+                        'voxelSize': ["{:g}".format(size) for size in voxelSize],
+                        'strides': [str(stride) for stride in strides]}}
+    __headers['entries'][source] = entry
+    __headers['pending'][source] = entry
+    return entry['header']
+
+
 def getMriDimensions(source):
     """get the image dimension along each axis of the source image
 
@@ -157,6 +275,9 @@ def getMriDimensions(source):
         the image dimension along each axis
 
     """
+    header = getMriHeader(source)
+    if header is not None:
+        return header['dimensions']
     return __getMrinfoFieldValues(mrinfo(source), "Dimensions:", "x")
 
 
@@ -170,6 +291,9 @@ def getMriVoxelSize(source):
         the voxel size of the source image
 
     """
+    header = getMriHeader(source)
+    if header is not None:
+        return header['voxelSize']
     return __getMrinfoFieldValues(mrinfo(source), "Voxel size:", "x")
 
 
@@ -199,6 +323,9 @@ def getDataStridesOrientation(source):
         An array of string elements representing the layout of the image
 
     """
+    header = getMriHeader(source)
+    if header is not None:
+        return ",".join(header['strides'])
     return ",".join(__getMrinfoFieldValues(mrinfo(source), "Data strides:").strip("[]").split())
 
 
@@ -251,38 +378,48 @@ def applyGradientCorrection(bFilename, eddyFilename, target):
         the resulting gradient encoding file
 
     """
-    f = open(eddyFilename, 'r')
-    g = open(bFilename, 'r')
-    eddys = f.readlines()
-    b_line = g.readlines()
-    f.close()
-    g.close()
-
-    h = open(target, 'w')
+    #columns 4 to 6 of eddy parameters are the rotations around x, y and z in radians
+    angles = numpy.loadtxt(eddyFilename, ndmin=2)[:, 3:6]
+    encoding = numpy.loadtxt(bFilename, dtype=str, ndmin=2)[:len(angles)]
+    gradients = rotateGradients(encoding[:, 0:3].astype(float), angles)
+
+    with open(target, 'w') as h:
+        h.writelines(["{}\t{}\t{}\t{}\n".format(x, y, z, bValue)
+                      for (x, y, z), bValue in zip(gradients.tolist(), encoding[:, 3])])
+    return target
 
-    for index, line in enumerate(eddys):
-        row_four_to_six_eddy = line.split('  ')[3:6]
-        x= numpy.matrix([[1, 0, 0],
-                         [0,numpy.cos(float(row_four_to_six_eddy[0])), numpy.sin(float(row_four_to_six_eddy[0]))],
-                         [0,-numpy.sin(float(row_four_to_six_eddy[0])), numpy.cos(float(row_four_to_six_eddy[0]))]])
 
-        y= numpy.matrix([[numpy.cos(float(row_four_to_six_eddy[1])), 0, numpy.sin(float(row_four_to_six_eddy[1]))],
-                     [0, 1, 0],
-                     [-numpy.sin(float(row_four_to_six_eddy[1])), 0, numpy.cos(float(row_four_to_six_eddy[1]))]])
+def rotateGradients(gradients, angles):
+    """Undo the rotation of each volume on its gradient direction
 
-        z= numpy.matrix([[numpy.cos(float(row_four_to_six_eddy[1])), numpy.sin(float(row_four_to_six_eddy[1])), 0],
-                     [-numpy.sin(float(row_four_to_six_eddy[1])), numpy.cos(float(row_four_to_six_eddy[1])), 0],
-                     [0, 0, 1]])
-        matrix = (z*y*x).I
-        b_values = b_line[index].replace('\t',' ').split()
-        gradient = numpy.matrix([[float(b_values[0]), float(b_values[1]),float(b_values[2])]])
-        new_gradient = matrix*gradient.T
+    The rotation of a volume is Rz.Ry.Rx, the rotations around x, y and z. Since a rotation matrix is orthogonal,
+    its inverse is its transpose. FSL bvecs, which are store one direction per column, should be transposed first.
 
-        values = str(float(new_gradient[0]))+'\t'+str(float(new_gradient[1]))+'\t'+str(float(new_gradient[2]))+'\t'+b_values[3].strip()+'\n'
-        h.write(values)
+    Args:
+        gradients: a (N, 3) array of gradient directions
+        angles: a (N, 3) array of rotations around x, y and z in radians, like columns 4 to 6 of eddy parameters
 
-    h.close()
-    return target
+    Returns:
+        a (N, 3) array of the corrected gradient directions
+    """
+    angles = numpy.asarray(angles, dtype=float)
+    cos = numpy.cos(angles)
+    sin = numpy.sin(angles)
+    zeros = numpy.zeros(len(angles))
+    ones = numpy.ones(len(angles))
+
+    x = numpy.array([[ones, zeros, zeros],
+                     [zeros, cos[:, 0], sin[:, 0]],
+                     [zeros, -sin[:, 0], cos[:, 0]]]).transpose(2, 0, 1)
+    y = numpy.array([[cos[:, 1], zeros, sin[:, 1]],
+                     [zeros, ones, zeros],
+                     [-sin[:, 1], zeros, cos[:, 1]]]).transpose(2, 0, 1)
+    z = numpy.array([[cos[:, 2], sin[:, 2], zeros],
+                     [-sin[:, 2], cos[:, 2], zeros],
+                     [zeros, zeros, ones]]).transpose(2, 0, 1)
+
+    rotations = numpy.einsum('nij,njk,nkl->nil', z, y, x)
+    return numpy.einsum('nji,nj->ni', rotations, numpy.asarray(gradients, dtype=float))
 
 
 def fslToMrtrixEncoding(dwi, bVecs, bVals, target):
@@ -323,23 +460,210 @@ def extractStructure(values, source, target):
     Args:
         values: A list of values (integer) to extract from an input image
         source: An mri image
+        target: the output image, it is not overwritten if it already exists
 
     returns:
         a new image that contain areas specified by values
     """
+    return extractStructures(source, [(values, target)])[0]
+
+
+def extractStructures(source, structures):
+    """ Extract many structures from the same image, the image is read once and its labels looked up once
+
+    Args:
+        source: An mri image
+        structures: a list of tuples: a list of values (integer) to extract and the output image, outputs
+                    that already exist are not overwritten
+
+    returns:
+        the list of the output images
+    """
     image = nibabel.load(source)
     data = image.get_data()
-    c = []
-    for value in values:
-        c.append(numpy.where(data==value))
+    masks = labelMasks(data, [values for values, target in structures])
+    for mask, (values, target) in zip(masks, structures):
+        if not os.path.exists(target):
+            nibabel.save(nibabel.Nifti1Image(mask.astype(data.dtype), image.get_affine()), target)
+    return [target for values, target in structures]
+
 
-    data.fill(0)
-    for i in range(len(values)):
-        data[c[i]] = 1
+def labelMasks(data, groups):
+    """ Compute the masks of several groups of labels in a single pass over a label image
 
-    if not os.path.exists(target):
-        nibabel.save(nibabel.Nifti1Image(data, image.get_affine()), target)
-        return target
+    A lookup table indexed by label store, for each label, a bitfield of the groups that contain it. The
+    bitfield of every voxel is looked up once, then each mask is a bit of that bitfield.
+
+    Args:
+        data: an array of labels, voxels whose value is not an integer belong to no group
+        groups: a list of at most 64 lists of labels (integer)
+
+    returns:
+        a list of boolean arrays of the shape of data, one per group
+    """
+    bits = labelBits(data, groups)
+    return [numpy.bitwise_and(bits, bits.dtype.type(1 << index)) != 0 for index in range(len(groups))]
+
+
+def labelBits(data, groups):
+    """ Compute, for each voxel of a label image, a bitfield of the groups of labels it belongs to
+
+    Labels are usually looked up into a table indexed by label. When the labels span a range too large for
+    such a table, like a few large or negative float values, they are looked up into the sorted labels of the
+    groups instead.
+
+    Args:
+        data: an array of labels, voxels whose value is not an integer, including NaN and infinity, belong to no group
+        groups: a list of at most 64 lists of labels (integer)
+
+    returns:
+        an array of unsigned integers of the shape of data, bit i is set if the voxel belongs to group i
+    """
+    if len(groups) > 64:
+        raise ValueError("At most 64 groups of labels may be looked up at once, got {}".format(len(groups)))
+    dtype = [numpy.uint8, numpy.uint16, numpy.uint32, numpy.uint64][max(0, (len(groups) - 1) / 8).bit_length()]
+    data = numpy.asarray(data)
+    if data.size == 0:
+        return numpy.zeros(data.shape, dtype=dtype)
+
+    labels = data
+    invalid = None
+    if data.dtype.kind not in 'iu':
+        with numpy.errstate(invalid='ignore'):
+            labels = numpy.rint(data)
+            invalid = ~numpy.isfinite(labels) | (labels != data)
+        if invalid.all():
+            return numpy.zeros(data.shape, dtype=dtype)
+        #voxels that belong to no group take a valid label so the lookup never see them
+        labels[invalid] = labels[~invalid][0]
+
+    bitfields = {}
+    for index, values in enumerate(groups):
+        for value in values:
+            bitfields[int(value)] = bitfields.get(int(value), 0) | (1 << index)
+    if not bitfields:
+        return numpy.zeros(data.shape, dtype=dtype)
+
+    low = int(labels.min())
+    high = int(labels.max())
+    if high - low < max(1 << 16, labels.size):
+        lut = numpy.zeros(high - low + 1, dtype=dtype)
+        for value, bitfield in bitfields.iteritems():
+            if low <= value <= high:
+                lut[value - low] = dtype(bitfield)
+        bits = lut[(labels - low).astype(numpy.intp)]
+    else:
+        keys = numpy.array(sorted(bitfields), dtype=numpy.int64)
+        table = numpy.array([bitfields[key] for key in keys], dtype=dtype)
+        indexes = numpy.minimum(numpy.searchsorted(keys, labels), len(keys) - 1)
+        bits = numpy.where(keys[indexes] == labels, table[indexes], dtype(0)).astype(dtype)
+
+    if invalid is not None:
+        bits[invalid] = 0
+    return bits
+
+
+def fillSurface(vertices, polys, affine, shape):
+    """ Rasterize the inside of a closed surface into a binary volume with vtk
+
+    Vertices and triangles are handed to vtk as whole arrays rather than point by point.
+
+    Args:
+        vertices: a (N, 3) array of vertices in world coordinates
+        polys: a (M, 3) array of triangles, indices into vertices
+        affine: the voxel to world affine of the volume
+        shape: the shape of the volume
+
+    returns:
+        an uint8 array of the transposed shape, 1 inside the surface, 0 elsewhere
+    """
+    import vtk
+    from vtk.util import numpy_support
+
+    voxverts = nibabel.affines.apply_affine(numpy.linalg.inv(affine), vertices)
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(voxverts, dtype=numpy.float64), deep=True))
+
+    #vtk legacy cells layout: the number of points of each cell followed by the indices of its points
+    cells = numpy.empty((len(polys), polys.shape[1] + 1), dtype=numpy_support.ID_TYPE_CODE)
+    cells[:, 0] = polys.shape[1]
+    cells[:, 1:] = polys
+    tris = vtk.vtkCellArray()
+    tris.SetCells(len(polys), numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=True))
+
+    pd = vtk.vtkPolyData()
+    pd.SetPoints(points)
+    pd.SetPolys(tris)
+    del points, tris, cells
+
+    pdtis = vtk.vtkPolyDataToImageStencil()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        pdtis.SetInput(pd)
+    else:
+        pdtis.SetInputData(pd)
+
+    pdtis.SetOutputWholeExtent(0, int(shape[0])-1, 0, int(shape[1])-1, 0, int(shape[2])-1)
+    pdtis.Update()
+
+    if hasattr(vtk, 'vtkImageStencilToImage'):
+        #rasterize the stencil directly, without allocating an image of ones to be masked
+        imgstenc = vtk.vtkImageStencilToImage()
+        imgstenc.SetInputConnection(pdtis.GetOutputPort())
+        imgstenc.SetInsideValue(1)
+        imgstenc.SetOutsideValue(0)
+        imgstenc.SetOutputScalarTypeToUnsignedChar()
+        whiteimg = None
+    else:
+        whiteimg = vtk.vtkImageData()
+        whiteimg.SetDimensions(shape)
+        whiteimg.SetScalarType(vtk.VTK_UNSIGNED_CHAR)
+        ones = numpy.ones(numpy.prod(shape), dtype=numpy.uint8)
+        whiteimg.GetPointData().SetScalars(numpy_support.numpy_to_vtk(ones))
+        imgstenc = vtk.vtkImageStencil()
+        imgstenc.SetInput(whiteimg)
+        imgstenc.SetStencil(pdtis.GetOutput())
+        imgstenc.SetBackgroundValue(0)
+
+    imgstenc.Update()
+
+    data = numpy_support.vtk_to_numpy(
+        imgstenc.GetOutput().GetPointData().GetScalars()).reshape(shape).transpose(2,1,0)
+    del pd, voxverts, whiteimg, pdtis, imgstenc
+    return data
+
+
+def blockAverage(data, factor, slabSize=8):
+    """ Average each block of factor**3 voxels of a volume
+
+    The volume is processed by slabs of slabSize planes of the result to keep temporaries small, the last
+    slab may be thinner. Voxels are summed one axis at a time so every reduction but the last run over
+    contiguous memory. Boolean volumes, like a binary fill, are summed into the smallest integers that hold
+    factor**3, other volumes into 64 bits values.
+
+    Args:
+        data: a 3 dimensions array whose shape is a multiple of factor
+        factor: the size of a block along each axis
+        slabSize: the number of planes of the result computed at a time
+
+    returns:
+        a float32 array of the shape of data divided by factor
+    """
+    nx, ny, nz = [size / factor for size in data.shape]
+    if data.dtype == numpy.bool:
+        dtype = numpy.uint8 if factor**3 < 256 else numpy.uint16
+    elif data.dtype.kind == 'f':
+        dtype = numpy.float64
+    else:
+        #integers are summed into the platform integer
+        dtype = None
+    pve = numpy.empty((nx, ny, nz), dtype=numpy.float32)
+    for start in range(0, nx, slabSize):
+        stop = min(start + slabSize, nx)
+        slab = data[start*factor:stop*factor].reshape(stop - start, factor, -1).sum(axis=1, dtype=dtype)
+        slab = slab.reshape(stop - start, ny, factor, nz*factor).sum(axis=2, dtype=dtype)
+        pve[start:stop] = slab.reshape(stop - start, ny, nz, factor).sum(axis=3, dtype=dtype)
+    pve /= float(factor**3)
+    return pve
 
 
 def plotConnectome(source, target,  lutFile=None, title=None, label=None, skiprows=0, usecols=None, useGrid=False):
@@ -410,16 +734,6 @@ def plotConnectome(source, target,  lutFile=None, title=None, label=None, skipro
     return target
 
 
-def transform_to_affine(streams, header, affine):
-    from dipy.tracking.utils import move_streamlines
-    rotation, scale = numpy.linalg.qr(affine)
-    streams = move_streamlines(streams, rotation)
-    scale[0:3,0:3] = numpy.dot(scale[0:3,0:3], numpy.diag(1./header['voxel_size']))
-    scale[0:3,3] = abs(scale[0:3,3])
-    streams = move_streamlines(streams, scale)
-    return streams
-
-
 def read_mrtrix_tracks(in_file, as_generator=True):
     header = read_mrtrix_header(in_file)
     streamlines = read_mrtrix_streamlines(in_file, header, as_generator)
@@ -445,66 +759,159 @@ def read_mrtrix_header(in_file):
 
 
 def read_mrtrix_streamlines(in_file, header, as_generator=True):
-    offset = header['offset']
-    stream_count = header['count']
-    fileobj = open(in_file,'r')
-    fileobj.seek(offset)
-    endianness = nibabel.volumeutils.native_code
-    f4dt = numpy.dtype(endianness + 'f4')
-    pt_cols = 3
-    bytesize = pt_cols*4
-    def points_per_track(offset):
-        track_points = []
-        all_str = fileobj.read()
-        num_triplets = len(all_str)/bytesize
-        pts = numpy.ndarray(shape=(num_triplets,pt_cols), dtype='f4',buffer=all_str)
-        nonfinite_list = numpy.where(numpy.isfinite(pts[:,2]) == False)
-        nonfinite_list = list(nonfinite_list[0])[0:-1]
-        for idx, value in enumerate(nonfinite_list):
-            if idx == 0:
-                track_points.append(nonfinite_list[idx])
-            else:
-                track_points.append(nonfinite_list[idx]-nonfinite_list[idx-1]-1)
-        return track_points, nonfinite_list
-
-    def track_gen(track_points):
-        n_streams = 0
-        while True:
-            try:
-                n_pts = track_points[n_streams]
-            except IndexError:
-                break
-            pts_str = fileobj.read(n_pts * bytesize)
-            nan_str = fileobj.read(bytesize)
-            if len(pts_str) < (n_pts * bytesize):
-                if not n_streams == stream_count:
-                    raise StandardError
-                break
-            pts = numpy.ndarray(
-                shape = (n_pts, pt_cols),
-                dtype = f4dt,
-                buffer = pts_str)
-            nan_pt = numpy.ndarray(
-                shape = (1, pt_cols),
-                dtype = f4dt,
-                buffer = nan_str)
-            if numpy.isfinite(nan_pt[0][0]):
-                raise ValueError
-                break
-            xyz = pts[:,:3]
-            yield xyz
-            n_streams += 1
-            if n_streams == stream_count:
-                raise StopIteration
-
-    track_points, nonfinite_list = points_per_track(offset)
-    fileobj.seek(offset)
-    streamlines = track_gen(track_points)
+    tck = TckFile(in_file, header)
+    streamlines = iter(tck)
     if not as_generator:
         streamlines = list(streamlines)
     return streamlines
 
 
+class TckFile(object):
+
+    #number of points scanned at once while looking for the delimiters of the streamlines
+    CHUNK_SIZE = 1 << 22
+
+    def __init__(self, filename, header=None, indexFile=None):
+        """Random access to the streamlines of a mrtrix .tck file without reading them into memory
+
+        The points of the file are memory mapped. The offsets of the streamlines are found once by looking for
+        the delimiters of the streamlines a chunk of points at a time. Streamlines are returned as read only views
+        of the mapped points, so no point data is ever copied.
+
+        Args:
+            filename: an mrtrix tractography file
+            header: the header of the file as return by read_mrtrix_header, read from the file if None
+            indexFile: a .npy file where the offsets are saved once computed and loaded from if it is more recent
+                       than the tractography file
+
+        """
+        self.__filename = filename
+        self.__header = header if header is not None else read_mrtrix_header(filename)
+        self.__points = self.__map()
+        self.__offsets = self.__index(indexFile)
+
+
+    def __repr__(self):
+        return "filename={}, count={}, points={}".format(self.__filename, len(self), len(self.__points))
+
+
+    def __len__(self):
+        return len(self.__offsets) - 1
+
+
+    def __getitem__(self, index):
+        """Return a streamline as a (n, 3) array, or a list of streamlines if index is a slice
+        """
+        if isinstance(index, slice):
+            return [self.getTrack(track) for track in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Track index {} out of range".format(index))
+        return self.getTrack(index)
+
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self.getTrack(index)
+
+
+    def getHeader(self):
+        return self.__header
+
+
+    def getPoints(self):
+        """Return every points of the file, streamlines are separated by a row of NaN
+        """
+        return self.__points
+
+
+    def getOffsets(self):
+        """Return the offsets of the streamlines
+
+        Returns:
+            an int64 array of len(self) + 1 elements, streamline i span the points offsets[i] to offsets[i+1] - 2,
+            the point offsets[i+1] - 1 being its delimiter
+        """
+        return self.__offsets
+
+
+    def getTrack(self, index):
+        return self.__points[self.__offsets[index]:self.__offsets[index + 1] - 1]
+
+
+    def iterChunks(self, nbTracks):
+        """Iterate over the streamlines a block at a time
+
+        Args:
+            nbTracks: the number of streamlines of each block
+
+        Returns:
+            a generator of 2 elements tuple: a view of the points of the block, delimiters included, and the
+            offsets of the streamlines of the block relative to the first point of the block
+        """
+        for first in xrange(0, len(self), nbTracks):
+            last = min(first + nbTracks, len(self))
+            offsets = self.__offsets[first:last + 1]
+            yield self.__points[offsets[0]:offsets[-1]], offsets - offsets[0]
+
+
+    def __map(self):
+        """Memory map the points of the file
+
+        Returns:
+            a read only (n, 3) array
+        """
+        datatypes = {'Float32LE': '<f4', 'Float32BE': '>f4', 'Float64LE': '<f8', 'Float64BE': '>f8'}
+        dtype = numpy.dtype(datatypes.get(self.__header.get('datatype', '').strip(), nibabel.volumeutils.native_code + 'f4'))
+        offset = self.__header['offset']
+        count = (os.path.getsize(self.__filename) - offset) / (dtype.itemsize * 3)
+        if count <= 0:
+            return numpy.empty((0, 3), dtype=dtype)
+        return numpy.memmap(self.__filename, dtype=dtype, mode='r', offset=offset, shape=(count, 3))
+
+
+    def __index(self, indexFile):
+        """Find the offsets of the streamlines
+
+        A row of NaN end each streamline and a row of infinite values end the data
+
+        Args:
+            indexFile: a .npy file where the offsets are saved, None to always compute the offsets
+
+        Returns:
+            an int64 array, see getOffsets
+        """
+        if indexFile is not None and os.path.isfile(indexFile) \
+                and os.path.getmtime(indexFile) >= os.path.getmtime(self.__filename):
+            return numpy.load(indexFile)
+
+        delimiters = [numpy.empty(0, dtype=numpy.int64)]
+        for start in xrange(0, len(self.__points), self.CHUNK_SIZE):
+            values = self.__points[start:start + self.CHUNK_SIZE, 0]
+            rows = numpy.flatnonzero(~numpy.isfinite(values))
+            ends = numpy.flatnonzero(numpy.isinf(values[rows]))
+            if len(ends):
+                delimiters.append(rows[:ends[0]] + start)
+                break
+            delimiters.append(rows + start)
+        delimiters = numpy.concatenate(delimiters)
+
+        count = self.__header.get('count', 0)
+        if 0 < count < len(delimiters):
+            delimiters = delimiters[:count]
+
+        offsets = numpy.zeros(len(delimiters) + 1, dtype=numpy.int64)
+        offsets[1:] = delimiters + 1
+
+        if indexFile is not None:
+            try:
+                numpy.save(indexFile, offsets)
+            except (IOError, OSError):
+                pass
+        return offsets
+
+
 def get_data_dims(volume):
     if isinstance(volume, list):
         volume = volume[0]
@@ -523,14 +930,19 @@ def get_vox_dims(volume):
     return [float(voxdims[0]), float(voxdims[1]), float(voxdims[2])]
 
 
-def tck2trk(source, anatomical ,target):
-    """ Converts MRtrix (.tck) tract files into TrackVis (.trk) format using functions from dipy
+def tck2trk(source, anatomical, target, nbTracks=100000):
+    """ Converts MRtrix (.tck) tract files into TrackVis (.trk) format
+
+    Streamlines are converted a block of nbTracks at a time: the points of a block are moved into trackvis
+    voxmm space with a single matrix product and the records of the block are written at once, so the
+    memory used does not depend on the size of the tractography.
 
     Args:
 
         source: an mrtrix tractography file
         anatomical: a high resolution image
         target: an output Trackvis format image
+        nbTracks: the number of streamlines converted at once
 
     """
     dx, dy, dz = get_data_dims(anatomical)
@@ -538,21 +950,54 @@ def tck2trk(source, anatomical ,target):
     image_file = nibabel.load(anatomical)
     affine = image_file.get_affine()
 
-    header, streamlines = read_mrtrix_tracks(source, as_generator=True)
+    tck = TckFile(source)
     trk_header = nibabel.trackvis.empty_header()
     trk_header['dim'] = [dx,dy,dz]
     trk_header['voxel_size'] = [vx,vy,vz]
-    trk_header['n_count'] = header['count']
+    trk_header['n_count'] = len(tck)
 
     axcode = nibabel.orientations.aff2axcodes(affine)
     trk_header['voxel_order'] = axcode[0]+axcode[1]+axcode[2]
     trk_header['vox_to_ras'] = affine
-    transformed_streamlines = transform_to_affine(streamlines, trk_header, affine)
-    trk_tracks = ((ii, None, None) for ii in transformed_streamlines)
-    nibabel.trackvis.write(target, trk_tracks, trk_header)
+
+    transform = __voxmmTransform(affine, trk_header['voxel_size'])
+    linear = transform[0:3, 0:3].T
+    translation = transform[0:3, 3]
+    with open(target, 'wb', 1 << 20) as f:
+        f.write(trk_header.tostring())
+        for points, offsets in tck.iterChunks(nbTracks):
+            lengths = numpy.diff(offsets) - 1
+            delimiters = numpy.zeros(len(points), dtype=bool)
+            delimiters[offsets[1:] - 1] = True
+
+            #each record is the number of points of the streamline followed by its points
+            records = numpy.empty(len(lengths) + 3 * lengths.sum(), dtype=numpy.float32)
+            counts = numpy.zeros(len(records), dtype=bool)
+            counts[3 * offsets[:-1] - 2 * numpy.arange(len(lengths))] = True
+            records[~counts] = (numpy.dot(points[~delimiters], linear) + translation).ravel()
+            records.view(numpy.int32)[counts] = lengths
+            f.write(records.tostring())
     return target
 
 
+def __voxmmTransform(affine, voxelSize):
+    """Compute the transform that move points from the space of a tractography to trackvis voxmm space
+
+    Args:
+        affine: the affine of the anatomical image
+        voxelSize: the voxel size of the anatomical image
+
+    Returns:
+        a 4x4 matrix
+    """
+    rotation, scale = numpy.linalg.qr(affine)
+    scale[0:3,0:3] = numpy.dot(scale[0:3,0:3], numpy.diag(1./voxelSize))
+    scale[0:3,3] = abs(scale[0:3,3])
+    rotation[3] = [0, 0, 0, 1]
+    scale[3] = [0, 0, 0, 1]
+    return numpy.dot(scale, rotation)
+
+
 def isAfreesurferStructure(directory):
     """Validate if the specified directory qualify as a freesurfer structure
 
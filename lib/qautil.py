@@ -1,19 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import functools
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot
-import mpl_toolkits.mplot3d
-import nibabel
-import numpy
+import multiprocessing
+import gzip
+import csv
 import tempfile
-import dipy.data
-import dipy.reconst.dti
-import dipy.segment.mask
-import dipy.viz.colormap
-import dipy.viz.fvtk
 from lib import util
+from lib import apng
+from lib import lazy
+
+#scientific packages are imported on first use, the qa is mixed into every task
+matplotlib = lazy.Module('matplotlib', 'matplotlib.pyplot', 'matplotlib.colors', setup=lambda module: module.use('Agg'))
+mpl_toolkits = lazy.Module('mpl_toolkits', 'mpl_toolkits.mplot3d', setup=lambda module: matplotlib.pyplot)
+nibabel = lazy.Module('nibabel')
+numpy = lazy.Module('numpy')
+dipy = lazy.Module('dipy', 'dipy.data', 'dipy.reconst.dti', 'dipy.segment.mask', 'dipy.viz.colormap', 'dipy.viz.fvtk')
 
 __author__ = "Christophe Bedetti"
 __copyright__ = "Copyright (C) 2014, TOAD"
@@ -98,6 +99,41 @@ def frames2Gif(frames, target, gifSpeed):
     util.launchCommand(cmd)
 
 
+def iterVolumes(source):
+    """Read the volumes of a 4D image one at a time
+
+    Volumes are contiguous into a nifti file, so they are read sequentially from the file, compressed or not,
+    and only one volume is hold in memory at a time.
+
+    Args:
+        source: a nifti image
+    Yields:
+        3d numpy arrays, scaled by the slope and intercept of the image
+    """
+    #the proxy know where the data start into the file, the image header does not
+    proxy = nibabel.load(source).dataobj
+    shape = proxy.shape
+    dtype = numpy.dtype(proxy.dtype)
+    slope, inter = proxy.slope, proxy.inter
+    volumeShape = tuple(shape[:3])
+    volumeSize = int(numpy.prod(volumeShape)) * dtype.itemsize
+    volumeNumber = shape[3] if len(shape) > 3 else 1
+
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, 'rb') as f:
+        f.seek(int(proxy.offset))
+        for index in range(volumeNumber):
+            chunk = f.read(volumeSize)
+            if len(chunk) != volumeSize:
+                raise IOError("Unexpected end of file while reading volume {} of {}".format(index, source))
+            volume = numpy.frombuffer(chunk, dtype=dtype).reshape(volumeShape, order='F')
+            if slope is not None and numpy.isfinite(slope) and slope != 0:
+                volume = volume * slope
+            if inter is not None and numpy.isfinite(inter) and inter != 0:
+                volume = volume + inter
+            yield volume
+
+
 #~~~~~~~~~#
 # Classes #
 #~~~~~~~~~#
@@ -225,6 +261,30 @@ class Plot3dVolume(object):
         """
             target : link of the output image
         """
+        self.__layout(smallSize)
+        self.fig.savefig(target, facecolor='black')
+        matplotlib.pyplot.close()
+
+
+    def render(self, smallSize=False):
+        """Render the figure into memory instead of a file
+        Return:
+            numpy array of shape (height, width, 3) with the rgb pixels
+        """
+        self.__layout(smallSize)
+        self.fig.patch.set_facecolor('black')
+        dpi = matplotlib.rcParams['savefig.dpi']
+        if isinstance(dpi, (int, float)):
+            self.fig.set_dpi(dpi)
+        self.fig.canvas.draw()
+        width, height = self.fig.canvas.get_width_height()
+        pixels = numpy.frombuffer(
+                self.fig.canvas.tostring_rgb(), dtype=numpy.uint8)
+        matplotlib.pyplot.close()
+        return pixels.reshape(height, width, 3)
+
+
+    def __layout(self, smallSize):
         self.showSlices()
         matplotlib.pyplot.subplots_adjust(
                 left=0, right=1, bottom=0, top=1, hspace=0.001)
@@ -233,8 +293,6 @@ class Plot3dVolume(object):
         else:
             self.fig.set_size_inches(self.figsize)
         if self.colorbar: self.__showColorbar()
-        self.fig.savefig(target, facecolor='black')
-        matplotlib.pyplot.close()
 
 
     def __showEdges(self, dim):
@@ -290,20 +348,24 @@ class Plot3dVolume(object):
 class Plot4dVolume(object):
 
     def __init__(
-            self, source, source2=None, gifSpeed=30, vmax=None, fov=None):
-        """Create a animated gif from a 4d NIfTI image
+            self, source, source2=None, delay=30, vmax=None, fov=None, nbProcesses=1):
+        """Create an animated png from a 4d NIfTI image, see apng.writeApng()
         Args:
             source: 4D NIfTI image
-            target: outputfile gif name
-            gifSpeed: delay between images (tens of ms), default=30
+            source2: a second 4D NIfTI image, the animation then alternate between source and source2
+            delay: delay between frames (hundredths of second), default=30
+            vmax: upper bound of the color scale, default to the 99th percentile of source
+            fov: field of view of the frames
+            nbProcesses: number of processes rendering the frames, default=1
         """
-        self.gifSpeed = gifSpeed
+        self.delay = delay
+        self.nbProcesses = nbProcesses
         self.fov = fov
         self.imageData = nibabel.load(source).get_data()
         self.vmax = self.initVmax(vmax)
         self.compareVolumes = False
         if source2 != None:
-            self.gifSpeed = 100
+            self.delay = 100
             self.imageData2 = nibabel.load(source2).get_data()
             self.compareVolumes = True
             # Check if imageData has an odd number of slices
@@ -322,44 +384,73 @@ class Plot4dVolume(object):
 
 
     def save(self, target):
-        """Generate animated gif with convert from imagemagick
+        """Generate an animated png, frames are rendered and compressed in memory
         Args:
-            imageList: list of png to convert
             target: output filename
-            gifSpeed: delay between images (tens of ms)
         """
         if self.compareVolumes:
-            frameList = self.__createCompareFrames()
+            frames = self.__createCompareFrames()
         else:
-            frameList = self.__createFrames()
-        frames2Gif(frameList, target, self.gifSpeed)
-        for frame in frameList: frame.close
+            frames = self.__createFrames()
+        apng.writeApng(frames, target, self.delay)
 
 
     def __createFrames(self):
-        frameList = []
-        for num in range(self.imageData.shape[-1]):
-            frame = tempfile.NamedTemporaryFile(suffix='.jpg')
-            plot = Plot3dVolume(
-                    self.imageData[:,:,:,num], vmax=self.vmax,
-                    sourceIsData=True, fov=self.fov, grid=True)
-            plot.save(frame.name, smallSize=True)
-            frameList.append(frame)
-        return frameList
+        return renderFrames(
+                self.imageData, self.vmax, self.fov, self.nbProcesses)
 
 
     def __createCompareFrames(self):
-        frameList = []
+        frames = []
         for imageData, textData in (
                 [self.imageData, 'before'], [self.imageData2, 'after']):
-            frame = tempfile.NamedTemporaryFile(suffix='.jpg')
             volume = imageData[:,:,:,2]
             plot = Plot3dVolume(
                     volume, vmax=self.vmax,
                     sourceIsData=True, fov=self.fov, textData=textData)
-            plot.save(frame.name, smallSize=True)
-            frameList.append(frame)
-        return frameList
+            frames.append(apng.compressFrame(plot.render(smallSize=True)))
+        return frames
+
+
+__frames = {}
+
+
+def renderFrames(imageData, vmax, fov=None, nbProcesses=1):
+    """Render and compress each volume of a 4D array using a pool of processes
+    Args:
+        imageData: 4D image as numpy array
+        vmax: maximum value for vizualisation
+        fov: nifti file to know where to slice the image
+        nbProcesses: number of processes rendering the frames
+    Return:
+        list of compressed frames, see apng.compressFrame
+    """
+    #workers inherit the data when they are forked instead of receiving a copy
+    __frames.update({'imageData': imageData, 'vmax': vmax, 'fov': fov})
+    try:
+        volumes = range(imageData.shape[-1])
+        if nbProcesses > 1 and len(volumes) > 1:
+            pool = multiprocessing.Pool(min(nbProcesses, len(volumes)))
+            try:
+                frames = pool.map(__renderFrame, volumes, chunksize=1)
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        else:
+            frames = map(__renderFrame, volumes)
+    finally:
+        __frames.clear()
+    return frames
+
+
+def __renderFrame(num):
+    plot = Plot3dVolume(
+            __frames['imageData'][:,:,:,num], vmax=__frames['vmax'],
+            sourceIsData=True, fov=__frames['fov'], grid=True)
+    return apng.compressFrame(plot.render(smallSize=True))
 
 
 def plotMovement(parametersFile, targetTranslations, targetRotations):
@@ -447,47 +538,69 @@ def plotSigma(sigma, target):
     matplotlib.rcdefaults()
 
 
-def noiseAnalysis(source, maskNoise, maskCc, targetSnr, targetHist):
+def computeSnr(source, maskNoise, maskCc, histogramBins=40, histogramRange=(0, 150)):
+    """Compute the signal to noise ratio of each volume of a dwi in a single pass over the image
+
+    The signal is the mean intensity into the corpus callosum, the noise is the standard deviation of
+    the intensity into the noise mask.
+
+    Args:
+        source: a 4D dwi image
+        maskNoise: a 3D mask of the voxels that contain pure noise
+        maskCc: a 3D mask of the corpus callosum
+        histogramBins: the number of bins of the noise histogram
+        histogramRange: the range of the noise histogram
+
+    Returns:
+        a numpy record array with volume, signal, noise and snr fields, one row per volume
+        and the noise histogram counts and edges, without the first volume
     """
+    maskNoiseData = nibabel.load(maskNoise).get_data() > 0
+    maskCcData = nibabel.load(maskCc).get_data() > 0
+
+    rows = []
+    counts = numpy.zeros(histogramBins, dtype=numpy.int64)
+    edges = numpy.linspace(histogramRange[0], histogramRange[1], histogramBins + 1)
+    for index, volume in enumerate(iterVolumes(source)):
+        #masks could be short of a slice in the z direction
+        z = min(volume.shape[2], maskNoiseData.shape[2], maskCcData.shape[2])
+        noise = volume[:, :, :z][maskNoiseData[:, :, :z]].astype(numpy.float64)
+        signal = volume[:, :, :z][maskCcData[:, :, :z]].astype(numpy.float64)
+        noiseStd = noise.std() if noise.size else numpy.nan
+        signalMean = signal.mean() if signal.size else numpy.nan
+        rows.append((index, signalMean, noiseStd, signalMean / noiseStd if noiseStd else numpy.nan))
+        if index > 0:
+            counts += numpy.histogram(noise, bins=edges)[0]
+
+    table = numpy.array(rows, dtype=[('volume', numpy.int32), ('signal', numpy.float64),
+                                     ('noise', numpy.float64), ('snr', numpy.float64)])
+    return table.view(numpy.recarray), counts, edges
+
+
+def noiseAnalysis(source, maskNoise, maskCc, targetSnr, targetHist, targetTable=None):
+    """Plot the signal to noise ratio of each volume of a dwi and the histogram of the noise
+
+    Args:
+        source: a 4D dwi image
+        maskNoise: a 3D mask of the voxels that contain pure noise
+        maskCc: a 3D mask of the corpus callosum
+        targetSnr: the name of the snr plot
+        targetHist: the name of the noise histogram plot
+        targetTable: a csv file where the snr of each volume is written, optional
+
+    Returns:
+        the snr table as return by computeSnr
     """
-    dwiImage = nibabel.load(source)
-    maskNoiseImage = nibabel.load(maskNoise)
-    maskCcImage = nibabel.load(maskCc)
-
-    dwiData = dwiImage.get_data()
-    maskNoiseData = maskNoiseImage.get_data()
-    maskCcData = maskCcImage.get_data()
-
-    volumeNumber = dwiData.shape[3]
-
-    if dwiData.shape[2] != maskNoiseData.shape[2]:
-        zSliceShape = dwiData.shape[:2] + (1,)
-        zMaskNoise = numpy.zeros(zSliceShape, dtype=maskNoiseData.dtype)
-        zCc = numpy.zeros(zSliceShape, dtype=maskCcData.dtype)
-        maskNoiseData = numpy.concatenate((maskNoiseData, zMaskNoise), axis=2)
-        maskCcData = numpy.concatenate((maskCcData, zCc), axis=2)
-
-    #Corpus Callossum masking
-    dwiDataMaskCc = numpy.empty(dwiData.shape)
-    maskCcData4d = numpy.tile(maskCcData,(volumeNumber,1,1,1))
-    maskCcData4d = numpy.rollaxis(maskCcData4d, 0, start=4)
-    dwiDataMaskCc = numpy.ma.masked_where(maskCcData4d == 0, dwiData)
-
-    #Noise masking
-    dwiDataMaskNoise = numpy.empty(dwiData.shape)
-    maskNoise4d = numpy.tile(maskNoiseData,(volumeNumber,1,1,1))
-    maskNoise4d = numpy.rollaxis(maskNoise4d, 0, start=4)
-    dwiDataMaskNoise = numpy.ma.masked_where(maskNoise4d == 0, dwiData)
-
-    #SNR
-    volumeSize = numpy.prod(dwiData.shape[:3])
-    mean_signal = numpy.reshape(dwiDataMaskCc, [volumeSize, volumeNumber])
-    mean_signal = numpy.mean(mean_signal, axis=0)
-    noise_std = numpy.reshape(dwiDataMaskNoise, [volumeSize, volumeNumber])
-    noise_std = numpy.std(noise_std, axis=0)
-
-    SNR = mean_signal / noise_std
-    matplotlib.pyplot.plot(SNR)
+    table, counts, edges = computeSnr(source, maskNoise, maskCc)
+
+    if targetTable is not None:
+        with open(targetTable, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(table.dtype.names)
+            for row in table:
+                writer.writerow(row.tolist())
+
+    matplotlib.pyplot.plot(table.snr)
     matplotlib.pyplot.xlabel('Volumes')
     matplotlib.pyplot.ylabel('SNR')
     matplotlib.pyplot.savefig(targetSnr)
@@ -495,20 +608,17 @@ def noiseAnalysis(source, maskNoise, maskCc, targetSnr, targetHist):
     matplotlib.rcdefaults()
 
     #Hist plot
-    noiseHistData = dwiDataMaskNoise[:,:,:,1:]
-    noiseHistData = numpy.reshape(
-            noiseHistData, numpy.prod(noiseHistData.shape))
-    num_bins = 40
-    #xlim = numpy.percentile(noiseHistData, 98)
     matplotlib.pyplot.hist(
-            noiseHistData, num_bins,
-            histtype='stepfilled', facecolor='g', range=[0, 150])
+            edges[:-1], edges, weights=counts,
+            histtype='stepfilled', facecolor='g')
     matplotlib.pyplot.xlabel('Intensity')
     matplotlib.pyplot.ylabel('Voxels number')
     matplotlib.pyplot.savefig(targetHist)
     matplotlib.pyplot.close()
     matplotlib.rcdefaults()
 
+    return table
+
 
 def plotReconstruction(data, mask, cc, target, model):
     """
@@ -1,15 +1,18 @@
 # -*- coding: utf-8 -*-
 import subprocess
-import datetime
+import hashlib
+import threading
 import termios
 import signal
+import errno
 import shutil
 import time
-import glob
+import fnmatch
 import sys
 import re
 import os
 from string import Template
+import ledger
 
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
@@ -85,42 +88,203 @@ def gzip(source):
     return "{}.gz".format(source)
 
 
-def launchCommand(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=None, nice=0):
+def launchCommand(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=None, nice=0, logFile=None):
     """Execute a program in a new process
 
+    The program is launch into its own process group so the whole process tree, including the
+    processes it forks, is terminated when the timeout expire or when the pipeline is interrupted.
+
     Args:
         command: a string representing a unix command to execute
         stdout: this attribute is a file object that provides output from the child process
         stderr: this attribute is a file object that provides error from the child process
         timeout: Number of seconds before a process is consider inactive, usefull against deadlock
         nice: run cmd  with  an  adjusted  niceness, which affects process scheduling
+        logFile: a file name where the standards output and error are append as they are produce
+                 instead of being keep into memory. Only apply when stdout or stderr are subprocess.PIPE
 
 
     Returns
         return a 3 elements tuples representing the command line launch, the standards output and the standard error message
+        output and error are None when they are stream into logFile
 
     Raises
         OSError:      the function trying to execute a non-existent file.
         ValueError :  the command line is called with invalid arguments
 
     """
+    usage = ledger.snapshot()
+    binary = os.path.basename(cmd.split(" ").pop(0))
 
-    start = datetime.datetime.now()
-    process = subprocess.Popen(cmd, preexec_fn=lambda: os.nice(nice), stdout=stdout, stderr=stderr, shell=True)
+    log = None
+    if logFile is not None and subprocess.PIPE in [stdout, stderr]:
+        log = open(logFile, 'a')
+        if stdout == subprocess.PIPE:
+            stdout = log
+        if stderr == subprocess.PIPE:
+            stderr = subprocess.STDOUT if stdout is log else log
 
-    if timeout is None:
-        process.wait()
-    else:
-        while process.poll() is None:
-            time.sleep(0.2)
-            now = datetime.datetime.now()
-            if (now - start).seconds > timeout:
-                os.kill(process.pid, signal.SIGKILL)
-                os.waitpid(-1, os.WNOHANG)
-                return None, "Error, a timeout for this process occurred"
-    output = list(process.communicate())
-    output.insert(0,cmd)
-    return tuple(output)
+    def __preexec():
+        os.setpgrp()
+        os.nice(nice)
+
+    try:
+        process = subprocess.Popen(cmd, preexec_fn=__preexec, stdout=stdout, stderr=stderr, shell=True)
+    finally:
+        if log is not None:
+            log.close()
+
+    #pipes are drained while the process run, a full pipe would block the process forever
+    streams = {}
+    readers = []
+    for name, stream in [('output', process.stdout), ('error', process.stderr)]:
+        if stream is not None:
+            reader = threading.Thread(target=__readStream, args=(stream, streams, name))
+            reader.daemon = True
+            reader.start()
+            readers.append(reader)
+
+    expired = threading.Event()
+    completed = threading.Event()
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, __expire, args=(process.pid, expired, completed))
+        timer.daemon = True
+        timer.start()
+
+    try:
+        status, rusage = __waitProcess(process.pid)
+    except (KeyboardInterrupt, SystemExit):
+        completed.set()
+        __terminateProcessGroup(process.pid)
+        raise
+    finally:
+        if timer is not None:
+            timer.cancel()
+    completed.set()
+    if expired.is_set():
+        #the shell may be gone while some of its children ignored SIGTERM
+        __killProcessGroup(process.pid, signal.SIGKILL)
+
+    process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    for reader in readers:
+        reader.join()
+
+    output, error = streams.get('output'), streams.get('error')
+    if expired.is_set():
+        ledger.record("command", binary, ledger.measure(usage, rusage=rusage), "timeout", cmd)
+        return cmd, output, "Error, a timeout for this process occurred"
+    ledger.record("command", binary, ledger.measure(usage, rusage=rusage), process.returncode, cmd)
+    return cmd, output, error
+
+
+def __readStream(stream, streams, name):
+    """Read a stream until its end
+
+    Args:
+        stream: a file object
+        streams: a dictionary where the content read is store
+        name: the key of the content into streams
+
+    """
+    chunks = []
+    for chunk in iter(lambda: stream.read(2**16), ''):
+        chunks.append(chunk)
+    stream.close()
+    streams[name] = "".join(chunks)
+
+
+def __waitProcess(pid):
+    """Block until a process terminate
+
+    Args:
+        pid: the process id
+
+    Returns:
+        a 2 elements tuple, the exit status and the resources usage of the process
+
+    """
+    while True:
+        try:
+            returnedPid, status, rusage = os.wait4(pid, 0)
+            return status, rusage
+        except OSError, error:
+            if error.errno != errno.EINTR:
+                raise
+
+
+def __expire(pid, expired, completed, grace=10):
+    """Terminate a process group whose timeout expired
+
+    The processes get a SIGTERM then a SIGKILL if they are still alive after a grace period
+
+    Args:
+        pid: the process id of the process group leader
+        expired: an event set once the timeout expired
+        completed: an event set by launchCommand once the process have terminated
+        grace: number of seconds given to the processes to exit
+
+    """
+    expired.set()
+    __killProcessGroup(pid, signal.SIGTERM)
+    if not completed.wait(grace):
+        __killProcessGroup(pid, signal.SIGKILL)
+
+
+def __terminateProcessGroup(pid, grace=5):
+    """Terminate all processes of a group then reap the group leader
+
+    Args:
+        pid: the process id of the process group leader
+        grace: number of seconds given to the processes to exit before they are killed
+
+    """
+    __killProcessGroup(pid, signal.SIGTERM)
+    deadline = time.time() + grace
+    while time.time() < deadline:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0] != 0:
+                break
+        except OSError:
+            break
+        time.sleep(0.1)
+    __killProcessGroup(pid, signal.SIGKILL)
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except OSError:
+        pass
+
+
+def __killProcessGroup(pid, signalNumber):
+    """Send a signal to all processes of a group, ignoring groups that do not exist anymore
+
+    Args:
+        pid: the process id of the process group leader
+        signalNumber: the signal to send
+
+    """
+    try:
+        os.killpg(pid, signalNumber)
+    except OSError:
+        pass
+
+
+def digest(source, blockSize=2**20):
+    """Compute the sha1 digest of a file content
+
+    Args:
+        source: a file name
+        blockSize: the number of bytes read at a time
+
+    Returns:
+        an hexadecimal digest
+
+    """
+    sha1 = hashlib.sha1()
+    with open(source, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
 
 
 def createScript(source, text):
@@ -243,7 +407,7 @@ def getImage(config, dir, prefix, postfix=None, extension="nii.gz"):
         extension=extension.replace(".", "", 1)
 
     if postfix is None:
-        images = glob.glob("{}/{}*.{}".format(dir, config.get('prefix', prefix), extension))
+        criterias = "{}*.{}".format(config.get('prefix', prefix), extension)
     else:
         pfixs = ""
         if isinstance(postfix, str):
@@ -257,14 +421,43 @@ def getImage(config, dir, prefix, postfix=None, extension="nii.gz"):
                     pfixs = pfixs + config.get('postfix', element)
                 else:
                     pfixs = pfixs + "_{}".format(element)
-        criterias = "{}/{}*{}.{}".format(dir, config.get('prefix',prefix), pfixs, extension)
-        images = glob.glob(criterias)
+        criterias = "{}*{}.{}".format(config.get('prefix',prefix), pfixs, extension)
 
+    images = [name for name in __listDirectory(dir) if fnmatch.fnmatchcase(name, criterias)]
     if len(images) > 0:
-        return images.pop()
+        #the shortest name is the less derived image, ex: dwi.nii.gz rather than dwi_denoise.nii.gz
+        return os.path.join(dir, min(images, key=lambda name: (len(name), name)))
     return False
 
 
+__directories = {}
+
+
+def __listDirectory(source):
+    """List the entries of a directory, the list is kept in memory until the directory is modified
+
+    Hidden entries are excluded, like glob does
+
+    Args:
+        source: a directory
+
+    Returns:
+        a list of entries names
+    """
+    try:
+        mtime = os.stat(source).st_mtime
+    except (OSError, TypeError):
+        return []
+    known = __directories.get(source)
+    if known is not None and known[0] == mtime:
+        return known[1]
+    names = [name for name in os.listdir(source) if not name.startswith('.')]
+    #a directory modified within the resolution of its timestamp could be modified again unnoticed
+    if time.time() - mtime > 2:
+        __directories[source] = (mtime, names)
+    return names
+
+
 def buildName(config, target, source, postfix=None, extension=None, absolute=True):
     """A simple utility function that return a file name that contain the postfix and the current working directory
 
@@ -2,14 +2,13 @@
 import os
 import random
 
-import numpy
-import scipy
-import scipy.ndimage
-import nibabel
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
-from lib import util, mriutil
+from lib import util, mriutil, lazy
+
+numpy = lazy.Module('numpy')
+scipy = lazy.Module('scipy', 'scipy.ndimage', 'scipy.ndimage.morphology')
+nibabel = lazy.Module('nibabel')
 
 
 __author__ = "Mathieu Desrosiers"
@@ -21,6 +20,7 @@ class Parcellation(GenericTask):
 
     def __init__(self, subject):
         GenericTask.__init__(self, subject, 'preparation', 'qa')
+        self.setGridResources(threads=4, memory='8G', walltime='48:00:00')
         self.id = self.get('id')
         #self.setCleanupBeforeImplement(False)
 
@@ -30,7 +30,7 @@ class Parcellation(GenericTask):
 
         #look if a freesurfer tree is already available
         if not self.__findAndLinkFreesurferStructure():
-            self.__submitReconAll(anat)
+            self.step("recon-all", [anat], self.__getReconAllOutputs(), self.__submitReconAll, anat)
             #@TODO backup the recon-all to backup dir
 
 
@@ -81,6 +81,16 @@ class Parcellation(GenericTask):
         self.launchCommand(cmd, None, None, 86400)
 
 
+    def __getReconAllOutputs(self):
+        """Return the freesurfer images converted by this task once recon-all completed
+
+        Returns:
+            a list of file names
+        """
+        return [os.path.join(self.workingDir, self.id, "mri", source)
+                for source in ["T1.mgz", "aparc+aseg.mgz", "wmparc.mgz", "rh.ribbon.mgz", "lh.ribbon.mgz", "norm.mgz"]]
+
+
     def __convertFeesurferImageIntoNifti(self, anatomicalName):
 
         """
@@ -127,64 +137,6 @@ class Parcellation(GenericTask):
                 verts[:] = nibabel.affines.apply_affine(surf2world, verts)
                 return verts, tris
 
-        def surf_fill_vtk(vertices, polys, mat, shape):
-            
-            import vtk
-            from vtk.util import numpy_support
-
-            voxverts = nibabel.affines.apply_affine(numpy.linalg.inv(mat), vertices)
-            points = vtk.vtkPoints()
-            points.SetNumberOfPoints(len(voxverts))
-            for i,pt in enumerate(voxverts):
-                points.InsertPoint(i, pt)
-
-            tris  = vtk.vtkCellArray()
-            for vert in polys:
-                tris.InsertNextCell(len(vert))
-                for v in vert:
-                    tris.InsertCellPoint(v)
-
-            pd = vtk.vtkPolyData()
-            pd.SetPoints(points)
-            pd.SetPolys(tris)
-            del points, tris
-            
-            whiteimg = vtk.vtkImageData()
-            whiteimg.SetDimensions(shape)
-            if vtk.VTK_MAJOR_VERSION <= 5:
-                whiteimg.SetScalarType(vtk.VTK_UNSIGNED_CHAR)
-            else:
-                info = vtk.vtkInformation()
-                whiteimg.SetPointDataActiveScalarInfo(info, vtk.VTK_UNSIGNED_CHAR, 1)
-                    
-            ones = numpy.ones(numpy.prod(shape), dtype=numpy.uint8)
-            whiteimg.GetPointData().SetScalars(numpy_support.numpy_to_vtk(ones))
-    
-            pdtis = vtk.vtkPolyDataToImageStencil()
-            if vtk.VTK_MAJOR_VERSION <= 5:
-                pdtis.SetInput(pd)
-            else:
-                pdtis.SetInputData(pd)
-
-            pdtis.SetOutputWholeExtent(whiteimg.GetExtent())
-            pdtis.Update()
-
-            imgstenc = vtk.vtkImageStencil()
-            if vtk.VTK_MAJOR_VERSION <= 5:
-                imgstenc.SetInput(whiteimg)
-                imgstenc.SetStencil(pdtis.GetOutput())
-            else:
-                imgstenc.SetInputData(whiteimg)
-                imgstenc.SetStencilConnection(pdtis.GetOutputPort())
-            imgstenc.SetBackgroundValue(0)
-                
-            imgstenc.Update()
-    
-            data = numpy_support.vtk_to_numpy(
-                imgstenc.GetOutput().GetPointData().GetScalars()).reshape(shape).transpose(2,1,0)
-            del pd,voxverts,whiteimg,pdtis,imgstenc
-            return data
-
 
         def fill_hemis(lh_surf,rh_surf):
             vertices = numpy.vstack([lh_surf[0],rh_surf[0]])
@@ -192,20 +144,9 @@ class Parcellation(GenericTask):
                               rh_surf[1]+lh_surf[0].shape[0]])
             mat = parc.affine.dot(numpy.diag([1/float(subdiv)]*3+[1]))
             shape = numpy.asarray(parc.shape)*subdiv
-            fill = surf_fill_vtk(vertices, tris, mat, shape)
-            pve = reduce(
-                lambda x,y: x+fill[y[0]::subdiv,y[1]::subdiv,y[2]::subdiv],
-                numpy.mgrid[:subdiv,:subdiv,:subdiv].reshape(3,-1).T,0
-                ).astype(numpy.float32)
-            pve /= float(subdiv**3)
-            return pve
-
-
-        def group_rois(rois_ids):
-            m = numpy.zeros(parc.shape, dtype=numpy.bool)
-            for i in rois_ids:
-                numpy.logical_or(parc_data==i, m, m)
-            return m
+            fill = mriutil.fillSurface(vertices, tris, mat, shape)
+            #fill is a transposed view of the binary vtk image, average the contiguous image then transpose it back
+            return mriutil.blockAverage(fill.transpose(2,1,0).view(numpy.bool), subdiv).transpose(2,1,0)
 
 
         parc = nibabel.load(aparcAseg)
@@ -218,19 +159,28 @@ class Parcellation(GenericTask):
         wm_pve = fill_hemis(lh_wm,rh_wm)
         gm_pve = fill_hemis(lh_gm,rh_gm)
 
-        gm_rois = group_rois([8,47,17,18,53,54]).astype(numpy.float32)
+        #every groups of labels are looked up in a single pass over the parcellation
+        gm_rois, subcort_rois, wm_rois, bs_vdc_rois, bs_vdc_excl_rois, csf_rois, bs_mask, mask88 = \
+            mriutil.labelMasks(parc_data, [[8,47,17,18,53,54],
+                                           [10,11,12,13,26,49,50,51,52,58],
+                                           [7,16,28,46,60,85,192,88,250,251,252,253,254,255],
+                                           [16,60,28],
+                                           [16,7,46,60,28,10,49,2,41,0],
+                                           [4,5,14,15,24,30,31,43,44,62,63,72],
+                                           [16],
+                                           [88]])
+
+        gm_rois = gm_rois.astype(numpy.float32)
         gm_smooth = scipy.ndimage.gaussian_filter(gm_rois, sigma=voxsize)
 
-        subcort_rois = group_rois([10,11,12,13,26,49,50,51,52,58]).astype(numpy.float32)
+        subcort_rois = subcort_rois.astype(numpy.float32)
         subcort_smooth = scipy.ndimage.gaussian_filter(subcort_rois, sigma=voxsize)
 
-        wm_rois = group_rois([7,16,28,46,60,85,192,88,
-                             250,251,252,253,254,255]).astype(numpy.float32)
+        wm_rois = wm_rois.astype(numpy.float32)
 
         wm_smooth = scipy.ndimage.gaussian_filter(wm_rois,sigma=voxsize)
-        bs_mask = parc_data==16
-        bs_vdc_dil = scipy.ndimage.morphology.binary_dilation(group_rois([16,60,28]), iterations=2)
-        bs_vdc_excl = numpy.logical_and(bs_vdc_dil, numpy.logical_not(group_rois([16,7,46,60,28,10,49,2,41,0])))
+        bs_vdc_dil = scipy.ndimage.morphology.binary_dilation(bs_vdc_rois, iterations=2)
+        bs_vdc_excl = numpy.logical_and(bs_vdc_dil, numpy.logical_not(bs_vdc_excl_rois))
 
         lbs = numpy.where((bs_mask).any(-1).any(0))[0][-1]-3
 
@@ -240,8 +190,6 @@ class Parcellation(GenericTask):
             scipy.ndimage.morphology.binary_dilation(parc_data_mask))
 
 
-        csf_rois = group_rois([4,5,14,15,24,30,31,43,44,62,63,72])
-
         csf_smooth = scipy.ndimage.gaussian_filter(
             numpy.logical_or(csf_rois, outer_csf).astype(numpy.float32),
             sigma=voxsize)
@@ -255,7 +203,6 @@ class Parcellation(GenericTask):
         csf_smooth[bs_vdc_excl] += gm_smooth[bs_vdc_excl]
         gm_smooth[bs_vdc_excl] = 0
 
-        mask88 = parc_data==88
         wm = wm_pve+wm_smooth-csf_smooth-subcort_smooth
         wm[wm>1] = 1
         wm[wm<0] = 0
@@ -1,14 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
 
-import numpy
-import nibabel
-import dipy.denoise.nlmeans
-import dipy.denoise.noise_estimate
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
-from lib import util, mriutil
+from lib import util, mriutil, denoise, lazy
+
+numpy = lazy.Module('numpy')
+nibabel = lazy.Module('nibabel')
 
 
 __author__ = "Mathieu Desrosiers"
@@ -21,6 +19,7 @@ class Denoising(GenericTask):
 
     def __init__(self, subject):
         GenericTask.__init__(self, subject,'preparation', 'parcellation', 'qa')
+        self.setGridResources(threads=5, memory='16G', walltime='24:00:00')
         self.matlabWarning = False
         self.sigmaVector = None
         self.algorithm = None
@@ -54,23 +53,25 @@ class Denoising(GenericTask):
         if self.get("algorithm") == "nlmeans":
 
             self.algorithm = "nlmeans"
-            dwiImage = nibabel.load(dwi)
-            dwiData  = dwiImage.get_data()
+            #an uncompressed copy of the dwi could be memory mapped by the noise estimation and every denoising
+            #processes, the whole dwi is never loaded into memory
+            dwiUncompress = self.uncompressImage(dwi)
+            dwiImage = nibabel.load(dwiUncompress)
             if self.get('number_array_coil') == "32":
                 noiseMask = mriutil.computeNoiseMask(mask, self.buildName(mask, 'noise_mask'))
                 noiseMaskImage = nibabel.load(noiseMask)
                 noiseMaskData  = noiseMaskImage.get_data()
-                sigma = numpy.std(dwiData[noiseMaskData > 0])
-                self.info("sigma value that will be apply into nlmeans = {}".format(sigma))
-                denoisingData = dipy.denoise.nlmeans.nlmeans(dwiData, sigma)
+                sigma = denoise.noiseStd(dwiUncompress, noiseMaskData > 0)
 
             else:
-                self.sigmaVector, sigma, piesnoNoiseMask = self.__computeSigmaAndNoiseMask(dwiData)
-                self.info("sigma value that will be apply into nlmeans = {}".format(sigma))
-                denoisingData = dipy.denoise.nlmeans.nlmeans(dwiData, sigma)
+                self.sigmaVector, sigma, piesnoNoiseMask = self.__computeSigmaAndNoiseMask(dwiUncompress)
                 nibabel.save(nibabel.Nifti1Image(piesnoNoiseMask.astype(numpy.float32),dwiImage.get_affine()), self.buildName(target, "piesno_noise_mask"))
 
-            nibabel.save(nibabel.Nifti1Image(denoisingData.astype(numpy.float32), dwiImage.get_affine()), target)
+            self.info("sigma value that will be apply into nlmeans = {}".format(sigma))
+            nbProcesses = int(self.getNTreads())
+            self.info("Denoising {} volumes with {} processes".format(dwiImage.get_header().get_data_shape()[-1], nbProcesses))
+            denoise.nlmeans(dwiUncompress, target, sigma, nbProcesses, self.workingDir)
+            os.remove(dwiUncompress)
 
         elif self.get('general', 'matlab_available'):
             dwiUncompress = self.uncompressImage(dwi)
@@ -120,11 +121,11 @@ class Denoising(GenericTask):
         self.launchMatlabCommand(pyscript, None, None, 10800)
 
 
-    def __computeSigmaAndNoiseMask(self, data):
+    def __computeSigmaAndNoiseMask(self, source):
         """Use piesno algorithm to estimate sigma and noise
 
         Args:
-            data: A dMRI 4D matrix
+            source: an uncompressed dMRI 4D image, it is read a slice at a time, see denoise.piesno()
 
         Returns:
             a list of float representing sigmas for each z slices
@@ -136,9 +137,8 @@ class Denoising(GenericTask):
             numberArrayCoil = int(self.get("number_array_coil"))
         except ValueError:
             numberArrayCoil = 1
-        sigmaVector = numpy.zeros(data.shape[2], dtype=numpy.float32)
-
-        sigmaMatrix, maskNoise = dipy.denoise.noise_estimate.piesno(data, N=numberArrayCoil, return_mask=True)
+        sigmaMatrix, maskNoise = denoise.piesno(source, numberArrayCoil)
+        sigmaVector = numpy.zeros(len(sigmaMatrix), dtype=numpy.float32)
         return sigmaVector, sigmaMatrix, maskNoise
 
 
@@ -2,8 +2,6 @@
 import os
 import math
 
-import matplotlib
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
 from lib import util, mriutil
@@ -14,12 +12,11 @@ __copyright__ = "Copyright (C) 2014, TOAD"
 __credits__ = ["Mathieu Desrosiers", "Basile Pinsard"]
 
 
-matplotlib.use('Agg')
-
 class Correction(GenericTask):
 
     def __init__(self, subject):
         GenericTask.__init__(self, subject, 'preparation', 'parcellation', 'denoising', 'qa')
+        self.setGridResources(threads=4, memory='8G', walltime='24:00:00')
         self.__topupCorrection = False
         self.__fieldmapCorrection = False
 
@@ -76,7 +73,10 @@ class Correction(GenericTask):
             acqpTopup = self.__createAcquisitionParameterFile('topup')
 
             #Lauch topup on concatenate B0 image
-            [topupBaseName, topupImage] = self.__topup(concatenateB0Image, acqpTopup, self.get('b02b0_filename'))
+            [topupBaseName, topupImage] = self.step("topup",
+                                                    [concatenateB0Image, acqpTopup],
+                                                    self.__getTopupOutputs(),
+                                                    self.__topup, concatenateB0Image, acqpTopup, self.get('b02b0_filename'))
             b0Image = self.__fslmathsTmean(os.path.join(self.workingDir, topupImage))
             self.__topupCorrection = True
 
@@ -98,13 +98,18 @@ class Correction(GenericTask):
         #create an index file
         indexFile = self.__createIndexFile(mriutil.getNbDirectionsFromDWI(dwi))
 
-        outputImage = self.__correctionEddy2(dwi,
-                                    mask, topupBaseName, indexFile, acqpEddy, bVecs, bVals)
+        eddyInputs = [dwi, mask, indexFile, acqpEddy, bVecs, bVals]
+        eddyImage = self.buildName(dwi, "eddy")
+        if topupBaseName is not None:
+            eddyInputs.extend(self.__getTopupOutputs())
+            eddyImage = self.buildName(dwi, "eddy_topup")
+        eddyParameterFiles = self.__getEddyParameters(eddyImage)
+        outputImage = self.step("eddy", eddyInputs, [eddyImage, eddyParameterFiles],
+                                self.__correctionEddy2, dwi, eddyImage, mask, topupBaseName, indexFile, acqpEddy, bVecs, bVals)
 
 
 
-        eddyParameterFiles = self.getImage('dwi', None, 'eddy_parameters')
-        if eddyParameterFiles:
+        if os.path.exists(eddyParameterFiles):
             self.info("Apply eddy movement correction to gradient encodings directions")
             bEnc = mriutil.applyGradientCorrection(bEnc, eddyParameterFiles, self.buildName(outputImage, None, 'b'))
             self.info(mriutil.mrtrixToFslEncoding(outputImage,
@@ -118,8 +123,20 @@ class Correction(GenericTask):
         if mag and phase:
             #@TODO retirer le switch self.get("force_fieldmap")
             if not self.__topupCorrection or self.get("force_fieldmap"):
-                eddyCorrectionImage = self.__correctionEddy2(dwi, mask, None, indexFile, acqpEddy, bVecs, bVals)
-                outputImage = self.__computeFieldmap(eddyCorrectionImage, bVals, mag, phase, norm, parcellationMask, freesurferAnat)
+                if topupBaseName is None:
+                    #eddy already ran without topup, the fieldmap correction start from its result
+                    eddyCorrectionImage = outputImage
+                else:
+                    eddyCorrectionImage = self.step("eddy_fieldmap",
+                                                    [dwi, mask, indexFile, acqpEddy, bVecs, bVals],
+                                                    [self.buildName(dwi, "eddy"),
+                                                     self.__getEddyParameters(self.buildName(dwi, "eddy"))],
+                                                    self.__correctionEddy2, dwi, self.buildName(dwi, "eddy"),
+                                                    mask, None, indexFile, acqpEddy, bVecs, bVals)
+                outputImage = self.step("fieldmap",
+                                        [eddyCorrectionImage, bVals, mag, phase, norm, parcellationMask, freesurferAnat],
+                                        [self.buildName(eddyCorrectionImage, 'unwarp')],
+                                        self.__computeFieldmap, eddyCorrectionImage, bVals, mag, phase, norm, parcellationMask, freesurferAnat)
                 self.__fieldmapCorrection = True
 
 
@@ -283,6 +300,18 @@ class Correction(GenericTask):
         return [baseName, output]
 
 
+    def __getTopupOutputs(self):
+        """Return the files produce by topup
+
+        Returns:
+            a list of file names
+        """
+        baseName = os.path.join(self.workingDir, self.get('topup_results_base_name'))
+        return [os.path.join(self.workingDir, self.get('topup_results_output')),
+                "{}_fieldcoef.nii.gz".format(baseName),
+                "{}_movpar.txt".format(baseName)]
+
+
     def __fslmathsTmean(self, source):
 
         target = source.replace(".nii", "_tmean.nii")
@@ -290,11 +319,12 @@ class Correction(GenericTask):
         return target
 
 
-    def __correctionEddy2(self, source, mask, topup, index, acqp, bVecs, bVals):
+    def __correctionEddy2(self, source, target, mask, topup, index, acqp, bVecs, bVals):
         """Performs eddy correction on a dwi file.
 
         Args:
             source:	File containing all the images to estimate distortions for
+            target: The name of the resulting file
             mask:	Mask to indicate brain
             topup:  Base name for output files from topup
             index:	File containing indices for all volumes in --imain into --acqp and --topup
@@ -307,8 +337,8 @@ class Correction(GenericTask):
 
         """
         self.info("Launch eddy correction from fsl")
-        tmp = self.buildName(source, "tmp")
-        target = self.buildName(source, "eddy")
+        #each run has its own base name so the side files of a run, like its parameters, are never overwritten
+        tmp = self.buildName(target, "tmp")
         cmd = "eddy --imain={} --mask={} --index={} --acqp={} --bvecs={} --bvals={} --out={} "\
               .format(source, mask, index, acqp, bVecs, bVals, tmp)
 
@@ -321,6 +351,18 @@ class Correction(GenericTask):
 
 
 
+    def __getEddyParameters(self, target):
+        """Return the name of the movement parameters file written by the eddy run that produce target
+
+        Args:
+            target: the resulting file of the eddy run, see __correctionEddy2()
+
+        Returns:
+            the name of the eddy parameters file
+        """
+        return self.buildName(target, "tmp", "eddy_parameters")
+
+
     def __computeFieldmap(self, dwi, bVals, mag, phase, norm, parcellationMask, freesurferAnat):
 
         #extract a b0 from the dwi image
@@ -578,7 +620,10 @@ class Correction(GenericTask):
 
         dwiCorrected = self.getImage('dwi', 'corrected')
         brainMask = self.getImage('mask', 'corrected')
-        eddyParameterFiles = self.getImage('dwi', None, 'eddy_parameters')
+        #the gradient encodings were corrected with the parameters of the first eddy run, with topup if it was used
+        eddyParameterFiles = self.getImage('dwi', ['eddy', 'topup', 'tmp'], 'eddy_parameters')
+        if not eddyParameterFiles:
+            eddyParameterFiles = self.getImage('dwi', ['eddy', 'tmp'], 'eddy_parameters')
         bVecs=  self.getPreparationImage('grad',  None, 'bvecs')
         bVecsCorrected = self.getImage('grad',  None, 'bvecs')
 
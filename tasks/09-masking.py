@@ -36,12 +36,9 @@ class Masking(GenericTask):
         self.info(mriutil.mrcalc(aparcAsegResample, '1024', self.buildName('aparc_aseg', ['1024', 'mask'],'nii.gz')))
 
         #produce optionnal mask
-        if self.get("start_seeds").strip():
-            self.__createRegionMaskFromAparcAseg(aparcAsegResample, 'start')
-        if self.get("stop_seeds").strip():
-            self.__createRegionMaskFromAparcAseg(aparcAsegResample, 'stop')
-        if self.get("exclude_seeds").strip():
-            self.__createRegionMaskFromAparcAseg(aparcAsegResample, 'exclude')
+        operands = [operand for operand in ['start', 'stop', 'exclude'] if self.get("{}_seeds".format(operand)).strip()]
+        if operands:
+            self.__createRegionMasksFromAparcAseg(aparcAsegResample, operands)
 
         #extract the white matter mask from the act
         whiteMatterAct = self.__extractWhiteMatterFrom5tt(tt5Resample)
@@ -51,16 +48,19 @@ class Masking(GenericTask):
         shutil.copy(colorLut, self.workingDir)
 
 
-    def __createRegionMaskFromAparcAseg(self, source, operand):
+    def __createRegionMasksFromAparcAseg(self, source, operands):
 
-        option = "{}_seeds".format(operand)
-        self.info("Extract {} regions from {} image".format(operand, source))
-        regions = util.arrayOfInteger(self.get( option))
-        self.info("Regions to extract: {}".format(regions))
+        structures = []
+        for operand in operands:
+            option = "{}_seeds".format(operand)
+            self.info("Extract {} regions from {} image".format(operand, source))
+            regions = util.arrayOfInteger(self.get( option))
+            self.info("Regions to extract: {}".format(regions))
+            structures.append((regions, self.buildName(source, [operand, "extract"])))
 
-        target = self.buildName(source, [operand, "extract"])
-        structures = mriutil.extractStructure(regions, source, target)
-        self.__createMask(structures)
+        #every structures are extracted from a single read of the parcellation
+        for structure in mriutil.extractStructures(source, structures):
+            self.__createMask(structure)
 
 
     def __extractWhiteMatterFrom5tt(self, source):
@@ -1,13 +1,11 @@
 # -*- coding: utf-8 -*-
-import numpy
-import nibabel
-import dipy.core.gradients
-import dipy.reconst.dti
-import dipy.segment.mask
-import dipy.reconst.dti
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
+from lib import lazy
+
+numpy = lazy.Module('numpy')
+nibabel = lazy.Module('nibabel')
+dipy = lazy.Module('dipy', 'dipy.core.gradients', 'dipy.reconst.dti', 'dipy.segment.mask')
 
 
 __author__ = "Mathieu Desrosiers"
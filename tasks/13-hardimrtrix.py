@@ -12,6 +12,7 @@ class HardiMrtrix(GenericTask):
 
     def __init__(self, subject):
         GenericTask.__init__(self, subject, 'upsampling', 'registration', 'masking', 'qa')
+        self.setGridResources(threads=4, memory='8G')
 
 
     def implement(self):
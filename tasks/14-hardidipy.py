@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
-import numpy
-import nibabel
-import dipy
-import dipy.direction
-import dipy.reconst.csdeconv
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
+from lib import lazy
+
+numpy = lazy.Module('numpy')
+nibabel = lazy.Module('nibabel')
+dipy = lazy.Module('dipy', 'dipy.core.gradients', 'dipy.data', 'dipy.direction', 'dipy.reconst.csdeconv',
+                   'dipy.segment.mask')
 
 
 __author__ = "Mathieu Desrosiers"
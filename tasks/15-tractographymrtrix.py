@@ -1,10 +1,11 @@
 # -*- coding: utf-8 -*-
-import numpy
 import os
 from core.toad.generictask import GenericTask
-from lib import mriutil
+from lib import mriutil, lazy
 from lib.images import Images
 
+numpy = lazy.Module('numpy')
+
 
 __author__ = "Mathieu Desrosiers"
 __copyright__ = "Copyright (C) 2014, TOAD"
@@ -16,6 +17,7 @@ class TractographyMrtrix(GenericTask):
 
     def __init__(self, subject):
         GenericTask.__init__(self, subject, 'upsampling', 'hardimrtrix', 'masking', 'registration', 'atlasregistration' ,'qa')
+        self.setGridResources(threads=8, memory='8G', walltime='24:00:00')
         self.__tckDetRoiTrk = None
         self.__tckProbRoiTrk = None
         self.__tckgenRoiTrk = None
@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
-import numpy
-import nibabel
-import scipy.ndimage.morphology
-
 from core.toad.generictask import GenericTask
 from lib.images import Images
-from lib import mriutil
+from lib import mriutil, lazy
+
+numpy = lazy.Module('numpy')
+nibabel = lazy.Module('nibabel')
+scipy = lazy.Module('scipy', 'scipy.ndimage', 'scipy.ndimage.morphology')
 
 
 __author__ = "Christophe Bedetti"
@@ -42,9 +42,7 @@ class Snr(GenericTask):
         """
 
         """
-        snrPng = self.buildName(dwi, 'snr', 'png')
-        histPng = self.buildName(dwi, 'hist', 'png')
-        self.noiseAnalysis(dwi, noiseMask, ccMask, snrPng, histPng)
+        snrPng, histPng, snrTable = self.noiseAnalysis(dwi, noiseMask, ccMask)
         qaImages.extend(Images(
             (snrPng, '{} DWI image: SNR for each volume'.format(description)),
             (histPng, '{} DWI image: noise histogram'.format(description)),
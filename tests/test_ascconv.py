@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import collections
+import unittest
+import tempfile
+import shutil
+import math
+import os
+
+from core.dicom import ascconv
+from core.dicom.ascconv import Ascconv
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+ASCCONV = ("### ASCCONV BEGIN ###\n"
+           "ulVersion = 0x14b44b6\n"
+           "tSequenceFileName = \"%SiemensSeq%\\ep2d_diff\"\n"
+           "tProtocolName = \"ep2d_diff # 64 = dir\"\n"
+           "sKSpace.ucPhasePartialFourier = 0x10\n"
+           "sKSpace.lBaseResolution = 128  # readout\n"
+           "sKSpace.lPhaseEncodingLines = 96\n"
+           "sKSpace.dPhaseResolution = 1\n"
+           "sKSpace.dPhaseOversamplingForDialog = 0\n"
+           "sPat.lAccelFactPE = 2\n"
+           "sSliceArray.asSlice[0].dInPlaneRot = 0.0\n"
+           "sSliceArray.asSlice[0].dInPlaneRot = 3.14159\n"
+           "sCoilSelectMeas.aRxCoilSelectData[0].asList[0].lRxChannelConnected = 1\n"
+           "sCoilSelectMeas.aRxCoilSelectData[0].asList[1].lRxChannelConnected = 2\n"
+           "sCoilSelectMeas.aRxCoilSelectData[0].asList[2].lRxChannelConnected = 3\n"
+           "### ASCCONV END ###")
+
+
+def ascconvPerLine(ascconv):
+    """Derive the parameters of an ASCCONV block line by line like Ascconv did before the block was parsed
+
+    Args:
+        ascconv: the text of the block
+
+    Returns:
+        a dictionary of the values of the Ascconv getters
+    """
+    def phaseEncodingDirection(line):
+        tolerance = 0.2
+        try:
+            value = float(line.split("=")[-1].strip())
+        except ValueError:
+            return 1
+        if value < tolerance and value > -tolerance:
+            return 1
+        if (value > math.pi - tolerance) or (value < tolerance - math.pi):
+            return 0
+        if (value > (math.pi/2) - tolerance) and (value < (math.pi/2)+tolerance):
+            return 2
+        if (value < math.copysign((math.pi/2)-tolerance,-0.0)) and (value > math.copysign((math.pi/2)+tolerance, -0.0)):
+            return 3
+        return 1
+
+    values = {'phaseEncodingDirection': 1, 'patFactor': 1, 'epiFactor': 1,
+              'phaseResolution': 1, 'phaseOversampling': 1, 'numberArrayCoil': 0}
+    for line in ascconv.split("\n"):
+        line = line.lower()
+        if "coil" in line and "meas" in line and "lrxchannelconnected" in line:
+            values['numberArrayCoil'] += 1
+        elif "sslicearray.asslice" in line and ".dinplanerot" in line:
+            values['phaseEncodingDirection'] = int(phaseEncodingDirection(line))
+        else:
+            for tag, name, cast in [("spat.laccelfactpe", 'patFactor', float),
+                                    ("skspace.lphaseencodinglines", 'epiFactor', int),
+                                    ("skspace.dphaseresolution", 'phaseResolution', int),
+                                    ("skspace.dphaseoversamplingfordialog", 'phaseOversampling', int)]:
+                if tag in line:
+                    try:
+                        values[name] = cast(line.split("=")[-1].strip())
+                    except ValueError:
+                        pass
+                    break
+    return values
+
+
+class AscconvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        Ascconv._Ascconv__series.clear()
+
+
+    def testParse(self):
+        parameters = ascconv.parse(ASCCONV)
+        self.assertIsInstance(parameters, collections.OrderedDict)
+        self.assertEqual(parameters['ulVersion'], 0x14b44b6)
+        self.assertEqual(parameters['tSequenceFileName'], "%SiemensSeq%\\ep2d_diff")
+        self.assertEqual(parameters['tProtocolName'], "ep2d_diff # 64 = dir")
+        self.assertEqual(parameters['sKSpace.ucPhasePartialFourier'], 16)
+        self.assertEqual(parameters['sKSpace.lBaseResolution'], 128)
+        self.assertIsInstance(parameters['sKSpace.lBaseResolution'], int)
+        self.assertEqual(parameters['sPat.lAccelFactPE'], 2)
+        #the last value of a repeated key is kept, as the line by line parser did
+        self.assertEqual(parameters['sSliceArray.asSlice[0].dInPlaneRot'], 3.14159)
+        self.assertIsInstance(parameters['sSliceArray.asSlice[0].dInPlaneRot'], float)
+        self.assertEqual(len(parameters), 13)
+        self.assertFalse(any(key.startswith("#") for key in parameters))
+
+
+    def testGetters(self):
+        for block in [ASCCONV,
+                      ASCCONV.replace("dInPlaneRot = 3.14159", "dInPlaneRot = 1.5708"),
+                      ASCCONV.replace("dInPlaneRot = 3.14159", "dInPlaneRot = -1.5708"),
+                      ASCCONV.replace("dPhaseResolution = 1", "dPhaseResolution = 0.75"),
+                      ASCCONV.replace("lAccelFactPE = 2", "lAccelFactPE = 3.0")]:
+            expected = ascconvPerLine(block)
+            header = Ascconv("unused.dcm", block)
+            self.assertTrue(header.isValid())
+            self.assertEqual(header.getPhaseEncodingDirection(), expected['phaseEncodingDirection'])
+            self.assertEqual(header.getPatFactor(), expected['patFactor'])
+            self.assertEqual(header.getEpiFactor(), expected['epiFactor'])
+            self.assertEqual(header.getPhaseResolution(), expected['phaseResolution'])
+            self.assertEqual(header.getPhaseOversampling(), expected['phaseOversampling'])
+            self.assertEqual(header.getNumberArrayCoil(), expected['numberArrayCoil'])
+
+        header = Ascconv("unused.dcm", ASCCONV)
+        self.assertEqual((header.getPhaseEncodingDirection(), header.getPatFactor(), header.getEpiFactor(),
+                          header.getPhaseResolution(), header.getPhaseOversampling(), header.getNumberArrayCoil()),
+                         (0, 2.0, 96, 1, 0, 3))
+
+
+    def testTrailingComment(self):
+        #the line by line parser could not convert a value followed by a comment and kept the default
+        block = ASCCONV.replace("lAccelFactPE = 2", "lAccelFactPE = 2  # GRAPPA")
+        self.assertEqual(ascconvPerLine(block)['patFactor'], 1)
+        self.assertEqual(Ascconv("unused.dcm", block).getPatFactor(), 2.0)
+
+
+    def testExtract(self):
+        filename = os.path.join(self.directory, "siemens.dcm")
+        with open(filename, 'wb') as f:
+            f.write(b"\0" * 132 + b"DICM" + b"SV10\4\3\2\1" + ASCCONV + b"\0\0 trailing data")
+        self.assertEqual(ascconv.extract(filename), ASCCONV[:-len(ascconv.ASCCONV_END)])
+        self.assertEqual(Ascconv(filename).getParameters(), ascconv.parse(ASCCONV))
+
+        empty = os.path.join(self.directory, "empty.dcm")
+        open(empty, 'wb').close()
+        self.assertIsNone(ascconv.extract(empty))
+        self.assertFalse(Ascconv(empty).isValid())
+
+
+    def testSeries(self):
+        filename = os.path.join(self.directory, "siemens.dcm")
+        with open(filename, 'wb') as f:
+            f.write(ASCCONV)
+        first = Ascconv(filename, series="1.2.3")
+        os.remove(filename)
+        #the block of the following slices of the series is never read
+        second = Ascconv(filename, series="1.2.3")
+        self.assertTrue(second.isValid())
+        self.assertEqual(second.getParameters(), first.getParameters())
+        self.assertFalse(Ascconv(filename, series="1.2.4").isValid())
+
+
+if __name__ == '__main__':
+    unittest.main()
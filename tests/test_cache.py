@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import ConfigParser
+import unittest
+import tempfile
+import shutil
+import os
+
+from core.toad.cache import Cache
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = self.__config("_denoise")
+        self.cache = Cache(self.config)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+    def testKeyIncludeNaming(self):
+        fingerprint = self.__fingerprint("subj01")
+        other = Cache(self.__config("_nlmeans"))
+        self.assertEqual(self.cache.getKey("denoising", fingerprint),
+                         Cache(self.__config("_denoise")).getKey("denoising", fingerprint))
+        self.assertNotEqual(self.cache.getKey("denoising", fingerprint), other.getKey("denoising", fingerprint))
+
+
+    def testKeyIgnoreSubjectNames(self):
+        self.assertEqual(self.cache.getKey("denoising", self.__fingerprint("subj01")),
+                         self.cache.getKey("denoising", self.__fingerprint("subj02")))
+
+
+    def testRestoreRenameOutputs(self):
+        source = self.__fingerprint("subj01")
+        workingDir = os.path.join(self.directory, "subj01", "04-denoising")
+        self.__write(os.path.join(workingDir, "dwi_subj01_denoise.nii.gz"), "denoised")
+        self.__write(os.path.join(workingDir, "dwi_subj01_b0_denoise.nii.gz"), "b0")
+        self.__write(os.path.join(workingDir, "noise.nii.gz"), "noise")
+        key = self.cache.getKey("denoising", source)
+        self.cache.store(key, workingDir, fingerprint=source)
+
+        target = os.path.join(self.directory, "subj02", "04-denoising")
+        os.makedirs(target)
+        self.cache.restore(key, target, self.__fingerprint("subj02"))
+        self.assertEqual(sorted(os.listdir(target)),
+                         ["dwi_subj02_b0_denoise.nii.gz", "dwi_subj02_denoise.nii.gz", "noise.nii.gz"])
+        with open(os.path.join(target, "dwi_subj02_denoise.nii.gz"), 'r') as f:
+            self.assertEqual(f.read(), "denoised")
+
+
+    def __config(self, postfix):
+        config = ConfigParser.ConfigParser()
+        config.add_section('general')
+        config.set('general', 'cache_dir', os.path.join(self.directory, "cache"))
+        config.set('general', 'cache_size', '0')
+        config.set('general', 'cache_tasks', 'denoising')
+        config.add_section('prefix')
+        config.set('prefix', 'dwi', 'dwi')
+        config.add_section('postfix')
+        config.set('postfix', 'denoise', postfix)
+        return config
+
+
+    def __fingerprint(self, subject):
+        return {'inputs': {os.path.join(self.directory, subject, "dwi_{}.nii.gz".format(subject)):
+                               {'digest': 'dwi', 'roles': ['diffusion weighted']},
+                           os.path.join(self.directory, subject, "dwi_{}_b0.nii.gz".format(subject)):
+                               {'digest': 'b0', 'roles': ['b0']}},
+                'config': {'algorithm': 'nlmeans'},
+                'softwares': {'dipy': '0.10'}}
+
+
+    def __write(self, filename, content):
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+
+
+if __name__ == '__main__':
+    unittest.main()
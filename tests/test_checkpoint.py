@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import os
+
+from core.toad.checkpoint import Checkpoint
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class FakeTask(Checkpoint):
+
+    def __init__(self, workingDir):
+        self.workingDir = workingDir
+        self.options = {'option': '1'}
+        self.calls = []
+        Checkpoint.__init__(self)
+
+
+    def getName(self):
+        return "fake"
+
+
+    def getOptions(self):
+        return dict(self.options)
+
+
+    def getSoftwaresVersions(self):
+        return {'fsl': '5.0'}
+
+
+    def info(self, message):
+        pass
+
+
+    def warning(self, message):
+        pass
+
+
+    def copy(self, source, target, suffix=""):
+        self.calls.append((source, target, suffix))
+        with open(source, 'r') as f:
+            content = f.read()
+        if target is not None:
+            with open(target, 'w') as f:
+                f.write(content + suffix)
+        return target
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, "source.txt")
+        self.target = os.path.join(self.directory, "target.txt")
+        self.__write(self.source, "content")
+        self.task = FakeTask(self.directory)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def __write(self, filename, content):
+        with open(filename, 'w') as f:
+            f.write(content)
+
+
+    def __step(self, suffix=""):
+        return self.task.step("copy", [self.source], [self.target], self.task.copy, self.source, self.target, suffix=suffix)
+
+
+    def testCompletedStepIsSkipped(self):
+        self.assertFalse(self.task.isResumable())
+        self.assertEqual(self.__step(), self.target)
+        self.assertTrue(self.task.isResumable())
+
+        #a new instance, like a resubmission of the task, read the checkpoints file
+        task = FakeTask(self.directory)
+        self.assertEqual(task.step("copy", [self.source], [self.target], task.copy, self.source, self.target, suffix=""),
+                         self.target)
+        self.assertEqual(task.calls, [])
+
+
+    def testChangedInputRerunStep(self):
+        self.__step()
+        self.__write(self.source, "another content")
+        os.utime(self.source, (0, 0))
+        self.__step()
+        self.assertEqual(len(self.task.calls), 2)
+        with open(self.target) as f:
+            self.assertEqual(f.read(), "another content")
+
+
+    def testChangedArgumentRerunStep(self):
+        self.__step()
+        self.__step("!")
+        self.__step("!")
+        self.assertEqual([suffix for source, target, suffix in self.task.calls], ["", "!"])
+
+
+    def testModifiedOutputRerunStep(self):
+        self.__step()
+        self.__write(self.target, "modified")
+        os.utime(self.target, (0, 0))
+        self.__step()
+        self.assertEqual(len(self.task.calls), 2)
+
+
+    def testMissingOutputIsNotCheckpointed(self):
+        missing = os.path.join(self.directory, "missing.txt")
+        self.task.step("copy", [self.source], [self.target, missing], self.task.copy, self.source, self.target)
+        self.assertFalse(self.task.isResumable())
+        self.task.step("copy", [self.source], [self.target, missing], self.task.copy, self.source, self.target)
+        self.assertEqual(len(self.task.calls), 2)
+
+
+    def testChangedOptionsDiscardCheckpoints(self):
+        self.__step()
+        self.task.options['option'] = '2'
+        self.assertFalse(self.task.isResumable())
+        self.__step()
+        self.assertEqual(len(self.task.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import os
+
+try:
+    import numpy
+    import nibabel
+except ImportError:
+    numpy = None
+
+try:
+    from dipy.denoise.noise_estimate import piesno
+except ImportError:
+    piesno = None
+
+from lib import denoise
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+@unittest.skipIf(numpy is None, "numpy and nibabel are required")
+class DenoiseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = numpy.random.RandomState(0)
+        data = self.random.randint(0, 1000, (12, 10, 8, 6)).astype(numpy.int16)
+        image = nibabel.Nifti1Image(data, numpy.eye(4))
+        image.get_header().set_slope_inter(0.5, 10)
+        self.source = os.path.join(self.directory, "dwi.nii")
+        nibabel.save(image, self.source)
+        self.data = nibabel.load(self.source).get_data()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def testNoiseStd(self):
+        mask = self.random.rand(12, 10, 8) > 0.7
+        self.assertAlmostEqual(denoise.noiseStd(self.source, mask), numpy.std(self.data[mask]), places=6)
+
+
+    @unittest.skipIf(piesno is None, "dipy is required")
+    def testPiesno(self):
+        sigma, mask = denoise.piesno(self.source, 1)
+        expectedSigma, expectedMask = piesno(self.data, N=1, return_mask=True)
+        numpy.testing.assert_allclose(sigma, expectedSigma, rtol=1e-5)
+        numpy.testing.assert_array_equal(mask, expectedMask)
+
+
+if __name__ == '__main__':
+    unittest.main()
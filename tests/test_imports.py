@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import unittest
+import sys
+import os
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+TOAD_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+#packages that must only be imported when a task use them, see lib.lazy
+HEAVY_PACKAGES = ['numpy', 'scipy', 'nibabel', 'dipy', 'matplotlib', 'vtk']
+
+#print the heavy packages found into sys.modules after the statements
+SCRIPT = """
+import sys
+sys.path.insert(0, {0!r})
+{1}
+print ' '.join(sorted(set(name.split('.')[0] for name, module in sys.modules.items()
+                          if module is not None and name.split('.')[0] in {2!r})))
+"""
+
+
+class ImportsTest(unittest.TestCase):
+
+    def __getImportedPackages(self, statements):
+        """Execute statements into a fresh interpreter, modules imported by the tests are not shared
+        """
+        process = subprocess.Popen([sys.executable, '-c', SCRIPT.format(TOAD_DIR, statements, HEAVY_PACKAGES)],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=TOAD_DIR)
+        output, error = process.communicate()
+        self.assertEqual(process.returncode, 0, error)
+        return output.split()
+
+
+    def testGenericTask(self):
+        self.assertEqual(self.__getImportedPackages("import core.toad.generictask"), [])
+
+
+    def testSubjectManager(self):
+        self.assertEqual(self.__getImportedPackages("import core.toad.subjectmanager"), [])
+
+
+    def testTasksModules(self):
+        statements = "\n".join(["import glob, imp",
+                                "for taskFile in glob.glob({!r}):".format(os.path.join(TOAD_DIR, 'tasks', '[0-9]*.py')),
+                                "    imp.load_source(taskFile, taskFile)"])
+        self.assertEqual(self.__getImportedPackages(statements), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
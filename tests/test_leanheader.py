@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import struct
+import os
+
+from core.dicom import leanheader, ascconv
+from pydicom.dataset import Dataset, FileDataset
+from pydicom.sequence import Sequence
+from pydicom.filereader import read_file
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+ASCCONV = ("### ASCCONV BEGIN ###\n"
+           "sKSpace.ucPhasePartialFourier = 0x10\n"
+           "sSliceArray.asSlice[0].dInPlaneRot = 3.14159\n"
+           "### ASCCONV END ###")
+
+#(transfer syntax, implicit value representation, little endian)
+TRANSFER_SYNTAXES = {'implicit': ('1.2.840.10008.1.2', True, True),
+                     'explicit': ('1.2.840.10008.1.2.1', False, True),
+                     'bigendian': ('1.2.840.10008.1.2.2', False, False)}
+
+
+def writeDicom(filename, syntax, manufacturer):
+    """Write a small dicom file with the elements read by leanheader, a nested sequence and pixel data
+
+    Args:
+        filename: the name of the dicom file
+        syntax: a key of TRANSFER_SYNTAXES
+        manufacturer: SIEMENS or Philips
+    """
+    transferSyntax, isImplicitVR, isLittleEndian = TRANSFER_SYNTAXES[syntax]
+    meta = Dataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+    meta.MediaStorageSOPInstanceUID = '1.2.3.4.5.6'
+    meta.TransferSyntaxUID = transferSyntax
+    meta.ImplementationClassUID = '1.2.3.4'
+
+    dataset = FileDataset(filename, {}, file_meta=meta, preamble=b"\0" * 128,
+                          is_implicit_VR=isImplicitVR, is_little_endian=isLittleEndian)
+    dataset.Manufacturer = manufacturer
+    dataset.SeriesDescription = "ep2d_diff_64dir"
+    dataset.PatientName = "Doe^John"
+    dataset.SeriesInstanceUID = "1.2.3.4.5.6.7"
+    dataset.SeriesNumber = "12"
+    dataset.InstanceNumber = "7"
+
+    reference = Dataset()
+    reference.ReferencedSOPInstanceUID = "1.2.3"
+    reference.EchoTime = "12.5"
+    dataset.ReferencedImageSequence = Sequence([reference])
+
+    if manufacturer == "SIEMENS":
+        dataset.EchoTime = "89.000000"
+        endian = "<" if isLittleEndian else ">"
+        dataset.add_new((0x0019, 0x0010), 'LO', "SIEMENS MR HEADER")
+        dataset.add_new((0x0019, 0x1028), 'FD', struct.unpack(endian + "d", struct.pack(endian + "d", 29.5))[0])
+        dataset.add_new((0x0029, 0x0010), 'LO', "SIEMENS CSA HEADER")
+        dataset.add_new((0x0029, 0x1020), 'OB', b"SV10\4\3\2\1" + ASCCONV + b"\0\0")
+    else:
+        dataset.add_new((0x2001, 0x0010), 'LO', "Philips Imaging DD 001")
+        dataset.add_new((0x2001, 0x1025), 'SH', "89.0")
+    dataset.Rows = 2
+    dataset.Columns = 2
+    dataset.add_new((0x7fe0, 0x0010), 'OW', b"\0" * 8)
+    dataset.save_as(filename)
+    return filename
+
+
+class LeanHeaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = []
+        for syntax in sorted(TRANSFER_SYNTAXES):
+            for manufacturer in ["SIEMENS", "Philips"]:
+                filename = os.path.join(self.directory, "{}_{}.dcm".format(syntax, manufacturer))
+                self.files.append(writeDicom(filename, syntax, manufacturer))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def testLeanReadMatchPydicom(self):
+        for filename in self.files:
+            lean = leanheader.leanRead(filename)
+            reference = leanheader.pydicomRead(filename)
+            self.assertEqual(sorted(lean.keys()), sorted(reference.keys()), filename)
+            for name, value in reference.iteritems():
+                if type(value) is float:
+                    self.assertAlmostEqual(lean[name], value, msg="{} of {}".format(name, filename))
+                else:
+                    self.assertEqual(str(lean[name]), str(value), "{} of {}".format(name, filename))
+
+
+    def testAscconv(self):
+        for filename in self.files:
+            expected = ascconv.search(ASCCONV) if "SIEMENS" in filename else None
+            self.assertEqual(leanheader.leanRead(filename)['Ascconv'], expected, filename)
+            self.assertEqual(leanheader.pydicomRead(filename)['Ascconv'], expected, filename)
+
+
+    def testEchoTime(self):
+        #the echo time is kept as stored, like Dicom did with pydicom, the echo directories depend on it
+        for filename in self.files:
+            header = leanheader.read(filename)
+            name = 'EchoTime' if "SIEMENS" in filename else 'PhilipsEchoTime'
+            self.assertEqual(str(header[name]), "89.000000" if name == 'EchoTime' else "89.0", filename)
+            self.assertEqual(str(header[name]), str(read_file(filename)[leanheader.TAGS[name]].value), filename)
+            self.assertNotIn('EchoTime' if name == 'PhilipsEchoTime' else 'PhilipsEchoTime', header)
+
+
+    def testNotADicom(self):
+        filename = os.path.join(self.directory, "notADicom.txt")
+        with open(filename, 'w') as f:
+            f.write("not a dicom file" * 20)
+        self.assertIsNone(leanheader.read(filename))
+        self.assertIsNone(leanheader.pydicomRead(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+import unittest
+import tempfile
+import shutil
+import os
+
+try:
+    import numpy
+    import nibabel
+    import nibabel.trackvis
+    import nibabel.orientations
+except ImportError:
+    numpy = None
+
+try:
+    import vtk
+    from vtk.util import numpy_support
+except ImportError:
+    vtk = None
+
+from lib import mriutil
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+def writeTck(filename, streamlines, count=None, terminated=True):
+    """Write streamlines into a mrtrix .tck file
+
+    Args:
+        filename: the name of the tck file
+        streamlines: a list of arrays of points
+        count: the number of streamlines written into the header, len(streamlines) if None
+        terminated: end the data with a row of infinite values
+    """
+    header = "mrtrix tracks\ncount: {:010d}\ndatatype: Float32LE\nfile: . {:05d}\nEND\n"
+    offset = len(header.format(0, 0))
+    points = [numpy.empty((0, 3), dtype='<f4')]
+    for streamline in streamlines:
+        points.append(numpy.asarray(streamline, dtype='<f4'))
+        points.append(numpy.full((1, 3), numpy.nan, dtype='<f4'))
+    if terminated:
+        points.append(numpy.full((1, 3), numpy.inf, dtype='<f4'))
+    with open(filename, 'wb') as f:
+        f.write(header.format(len(streamlines) if count is None else count, offset))
+        numpy.concatenate(points).tofile(f)
+
+
+def tck2trkPerStreamline(source, anatomical, target):
+    """The conversion as it was done before streamlines were converted by blocks, one streamline at a time
+
+    """
+    affine = nibabel.load(anatomical).get_affine()
+    header, streamlines = mriutil.read_mrtrix_tracks(source, as_generator=True)
+    trkHeader = nibabel.trackvis.empty_header()
+    trkHeader['dim'] = mriutil.get_data_dims(anatomical)
+    trkHeader['voxel_size'] = mriutil.get_vox_dims(anatomical)
+    trkHeader['n_count'] = header['count']
+    axcode = nibabel.orientations.aff2axcodes(affine)
+    trkHeader['voxel_order'] = axcode[0] + axcode[1] + axcode[2]
+    trkHeader['vox_to_ras'] = affine
+
+    def move(streamlines, transform):
+        for streamline in streamlines:
+            yield numpy.dot(streamline, transform[:3, :3].T) + transform[:3, 3]
+
+    rotation, scale = numpy.linalg.qr(affine)
+    streamlines = move(streamlines, rotation)
+    scale[0:3, 0:3] = numpy.dot(scale[0:3, 0:3], numpy.diag(1. / trkHeader['voxel_size']))
+    scale[0:3, 3] = abs(scale[0:3, 3])
+    streamlines = move(streamlines, scale)
+    nibabel.trackvis.write(target, ((streamline, None, None) for streamline in streamlines), trkHeader)
+    return target
+
+
+def rotateGradientsPerVolume(gradients, angles):
+    """The rotation as it was done before every volume were rotated at once, one matrix inversion per volume
+
+    """
+    corrected = []
+    for gradient, (rx, ry, rz) in zip(gradients, angles):
+        x = numpy.matrix([[1, 0, 0],
+                          [0, numpy.cos(rx), numpy.sin(rx)],
+                          [0, -numpy.sin(rx), numpy.cos(rx)]])
+        y = numpy.matrix([[numpy.cos(ry), 0, numpy.sin(ry)],
+                          [0, 1, 0],
+                          [-numpy.sin(ry), 0, numpy.cos(ry)]])
+        z = numpy.matrix([[numpy.cos(rz), numpy.sin(rz), 0],
+                          [-numpy.sin(rz), numpy.cos(rz), 0],
+                          [0, 0, 1]])
+        corrected.append(numpy.asarray((z * y * x).I * numpy.matrix(gradient).T).ravel())
+    return numpy.array(corrected)
+
+
+def fillSurfacePerPoint(vertices, polys, affine, shape):
+    """The rasterization as it was done before vertices and triangles were handed to vtk as whole arrays
+
+    """
+    voxverts = nibabel.affines.apply_affine(numpy.linalg.inv(affine), vertices)
+    points = vtk.vtkPoints()
+    points.SetNumberOfPoints(len(voxverts))
+    for i, pt in enumerate(voxverts):
+        points.InsertPoint(i, pt)
+    tris = vtk.vtkCellArray()
+    for vert in polys:
+        tris.InsertNextCell(len(vert))
+        for v in vert:
+            tris.InsertCellPoint(v)
+    pd = vtk.vtkPolyData()
+    pd.SetPoints(points)
+    pd.SetPolys(tris)
+
+    whiteimg = vtk.vtkImageData()
+    whiteimg.SetDimensions(shape)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        whiteimg.SetScalarType(vtk.VTK_UNSIGNED_CHAR)
+    else:
+        info = vtk.vtkInformation()
+        whiteimg.SetPointDataActiveScalarInfo(info, vtk.VTK_UNSIGNED_CHAR, 1)
+    ones = numpy.ones(numpy.prod(shape), dtype=numpy.uint8)
+    whiteimg.GetPointData().SetScalars(numpy_support.numpy_to_vtk(ones))
+
+    pdtis = vtk.vtkPolyDataToImageStencil()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        pdtis.SetInput(pd)
+    else:
+        pdtis.SetInputData(pd)
+    pdtis.SetOutputWholeExtent(whiteimg.GetExtent())
+    pdtis.Update()
+
+    imgstenc = vtk.vtkImageStencil()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        imgstenc.SetInput(whiteimg)
+        imgstenc.SetStencil(pdtis.GetOutput())
+    else:
+        imgstenc.SetInputData(whiteimg)
+        imgstenc.SetStencilConnection(pdtis.GetOutputPort())
+    imgstenc.SetBackgroundValue(0)
+    imgstenc.Update()
+    return numpy_support.vtk_to_numpy(
+        imgstenc.GetOutput().GetPointData().GetScalars()).reshape(shape).transpose(2, 1, 0).copy()
+
+
+def blockAveragePerVoxel(data, factor):
+    """The partial volume as it was computed before the block average, one strided slice per sub voxel
+
+    """
+    pve = reduce(
+        lambda x, y: x + data[y[0]::factor, y[1]::factor, y[2]::factor],
+        numpy.mgrid[:factor, :factor, :factor].reshape(3, -1).T, 0).astype(numpy.float32)
+    pve /= float(factor**3)
+    return pve
+
+
+@unittest.skipIf(numpy is None, "numpy and nibabel are required")
+class MriutilTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.random = numpy.random.RandomState(0)
+
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def testTck2trk(self):
+        affine = numpy.array([[-1.1, 0.05, 0, 90], [0.02, 1.0, 0.1, -120], [0, -0.1, 1.2, -100], [0, 0, 0, 1]])
+        anatomical = os.path.join(self.directory, "anat.nii.gz")
+        nibabel.save(nibabel.Nifti1Image(numpy.zeros((10, 12, 14), numpy.float32), affine), anatomical)
+
+        #streamlines of a single point and streamlines that span several chunks of points
+        streamlines = [self.random.rand(self.random.randint(1, 40), 3) * 100 - 50 for index in range(25)]
+        source = os.path.join(self.directory, "tracks.tck")
+        writeTck(source, streamlines)
+
+        expected, expectedHeader = nibabel.trackvis.read(
+            tck2trkPerStreamline(source, anatomical, os.path.join(self.directory, "expected.trk")))
+
+        chunkSize = mriutil.TckFile.CHUNK_SIZE
+        mriutil.TckFile.CHUNK_SIZE = 16
+        try:
+            for nbTracks in [1, 7, 100]:
+                target = os.path.join(self.directory, "tracks{}.trk".format(nbTracks))
+                tracks, header = nibabel.trackvis.read(mriutil.tck2trk(source, anatomical, target, nbTracks))
+                #nibabel write a n_count of 0, unknown, when streamlines are given by a generator
+                for name in set(expectedHeader.dtype.names) - set(['n_count']):
+                    self.assertTrue(numpy.array_equal(header[name], expectedHeader[name]), name)
+                self.assertEqual(header['n_count'], len(streamlines))
+                self.assertEqual(len(tracks), len(streamlines))
+                for track, expectedTrack in zip(tracks, expected):
+                    numpy.testing.assert_allclose(track[0], expectedTrack[0], rtol=1e-5, atol=1e-4)
+        finally:
+            mriutil.TckFile.CHUNK_SIZE = chunkSize
+
+
+    def testTckFile(self):
+        streamlines = [self.random.rand(self.random.randint(1, 40), 3).astype(numpy.float32) for index in range(25)]
+        source = os.path.join(self.directory, "tracks.tck")
+        writeTck(source, streamlines)
+
+        chunkSize = mriutil.TckFile.CHUNK_SIZE
+        mriutil.TckFile.CHUNK_SIZE = 16
+        try:
+            tck = mriutil.TckFile(source)
+        finally:
+            mriutil.TckFile.CHUNK_SIZE = chunkSize
+
+        self.assertEqual(len(tck), len(streamlines))
+        self.assertEqual(tck.getOffsets()[-1], sum(len(streamline) + 1 for streamline in streamlines))
+        for index in range(-len(streamlines), len(streamlines)):
+            self.assertTrue(numpy.array_equal(tck[index], streamlines[index]), index)
+        for index in [len(streamlines), -len(streamlines) - 1]:
+            self.assertRaises(IndexError, tck.__getitem__, index)
+        for indices in [slice(None), slice(3, 9), slice(-5, None), slice(None, None, -3), slice(30, 40)]:
+            tracks = tck[indices]
+            self.assertEqual(len(tracks), len(streamlines[indices]))
+            for track, streamline in zip(tracks, streamlines[indices]):
+                self.assertTrue(numpy.array_equal(track, streamline))
+        self.assertEqual(len(list(tck)), len(streamlines))
+        self.assertFalse(tck[0].flags.writeable)
+
+
+    def testTckFileNotTerminated(self):
+        streamlines = [self.random.rand(self.random.randint(1, 10), 3).astype(numpy.float32) for index in range(8)]
+        source = os.path.join(self.directory, "tracks.tck")
+
+        writeTck(source, streamlines, terminated=False)
+        tck = mriutil.TckFile(source)
+        self.assertEqual(len(tck), len(streamlines))
+        self.assertTrue(numpy.array_equal(tck[-1], streamlines[-1]))
+
+        #a file still being written: the header count is not updated and the last streamline is incomplete
+        writeTck(source, streamlines, count=0, terminated=False)
+        with open(source, 'ab') as f:
+            numpy.ones((4, 3), dtype='<f4').tofile(f)
+        tck = mriutil.TckFile(source)
+        self.assertEqual(len(tck), len(streamlines))
+        self.assertTrue(numpy.array_equal(tck[-1], streamlines[-1]))
+
+        #streamlines beyond the header count are ignored
+        writeTck(source, streamlines, count=5, terminated=False)
+        tck = mriutil.TckFile(source)
+        self.assertEqual(len(tck), 5)
+        self.assertTrue(numpy.array_equal(tck[-1], streamlines[4]))
+
+        writeTck(source, [], terminated=False)
+        self.assertEqual(len(mriutil.TckFile(source)), 0)
+
+
+    def testTckFileIndex(self):
+        streamlines = [self.random.rand(self.random.randint(1, 10), 3).astype(numpy.float32) for index in range(8)]
+        source = os.path.join(self.directory, "tracks.tck")
+        indexFile = os.path.join(self.directory, "tracks.npy")
+        writeTck(source, streamlines)
+        os.utime(source, (1000000000, 1000000000))
+
+        offsets = mriutil.TckFile(source, indexFile=indexFile).getOffsets()
+        self.assertTrue(numpy.array_equal(numpy.load(indexFile), offsets))
+
+        #a saved index more recent than the tractography is used as is
+        numpy.save(indexFile, offsets[:4])
+        self.assertEqual(len(mriutil.TckFile(source, indexFile=indexFile)), 3)
+
+        #the index is rebuilt once the tractography is modified
+        os.remove(source)
+        writeTck(source, streamlines[:6])
+        os.utime(source, (os.path.getmtime(indexFile) + 10,) * 2)
+        tck = mriutil.TckFile(source, indexFile=indexFile)
+        self.assertEqual(len(tck), 6)
+        self.assertTrue(numpy.array_equal(tck[5], streamlines[5]))
+        self.assertTrue(numpy.array_equal(numpy.load(indexFile), tck.getOffsets()))
+
+
+    def testIterChunks(self):
+        streamlines = [self.random.rand(self.random.randint(1, 10), 3).astype(numpy.float32) for index in range(10)]
+        source = os.path.join(self.directory, "tracks.tck")
+        writeTck(source, streamlines)
+        tck = mriutil.TckFile(source)
+        for nbTracks in [1, 3, 10, 100]:
+            tracks = []
+            for points, offsets in tck.iterChunks(nbTracks):
+                self.assertLessEqual(len(offsets) - 1, nbTracks)
+                self.assertEqual(offsets[0], 0)
+                self.assertEqual(offsets[-1], len(points))
+                self.assertTrue(numpy.isnan(points[offsets[1:] - 1]).all())
+                tracks.extend(points[start:end - 1] for start, end in zip(offsets[:-1], offsets[1:]))
+            self.assertEqual(len(tracks), len(streamlines), nbTracks)
+            for track, streamline in zip(tracks, streamlines):
+                self.assertTrue(numpy.array_equal(track, streamline))
+
+
+    def testRotateGradients(self):
+        angles = self.random.uniform(-numpy.pi, numpy.pi, (65, 3))
+        gradients = self.random.randn(65, 3)
+        gradients[0] = 0
+        numpy.testing.assert_allclose(mriutil.rotateGradients(gradients, angles),
+                                      rotateGradientsPerVolume(gradients, angles), atol=1e-12)
+
+
+    def testApplyGradientCorrection(self):
+        #eddy parameters: 3 translations, 3 rotations then the eddy currents coefficients
+        parameters = self.random.randn(30, 16) * 0.05
+        eddyFilename = os.path.join(self.directory, "eddy_parameters")
+        numpy.savetxt(eddyFilename, parameters, fmt="%.6f", delimiter="  ")
+
+        gradients = self.random.randn(30, 3)
+        gradients /= numpy.linalg.norm(gradients, axis=1)[:, None]
+        gradients[0] = 0
+        bValues = [0] + [1000] * 29
+        bFilename = os.path.join(self.directory, "dwi.b")
+        with open(bFilename, 'w') as f:
+            for (x, y, z), bValue in zip(gradients, bValues):
+                f.write("{:.6f}\t{:.6f}\t{:.6f}\t{}\n".format(x, y, z, bValue))
+
+        target = mriutil.applyGradientCorrection(bFilename, eddyFilename, os.path.join(self.directory, "corrected.b"))
+        encoding = numpy.loadtxt(target, ndmin=2)
+        expected = rotateGradientsPerVolume(numpy.loadtxt(bFilename)[:, 0:3], numpy.loadtxt(eddyFilename)[:, 3:6])
+        numpy.testing.assert_allclose(encoding[:, 0:3], expected, atol=1e-12)
+        self.assertEqual(encoding[:, 3].tolist(), bValues)
+
+
+    def testLabelMasks(self):
+        groups = [[8, 47, 17], [2, 41, 1000000000], [-7], [], [17, 2]]
+        labels = self.random.choice([0, 2, 8, 17, 41, 47, 60, -7], (20, 18, 16))
+        sparse = labels.astype(numpy.float64)
+        sparse[0, 0, :4] = [1000000000, -500000000, 3.5, 1e300]
+        nans = labels.astype(numpy.float32)
+        nans[1, :, 0] = [numpy.nan, numpy.inf, -numpy.inf, 8.25] * 4 + [numpy.nan, 2]
+        for data in [labels.astype(numpy.int16), labels.astype(numpy.int64), sparse, nans,
+                     (labels % 64).astype(numpy.uint8), numpy.full((3, 3), numpy.nan)]:
+            masks = mriutil.labelMasks(data, groups)
+            self.assertEqual(len(masks), len(groups))
+            for mask, values in zip(masks, groups):
+                expected = numpy.zeros(data.shape, dtype=bool)
+                for value in values:
+                    expected |= data == value
+                numpy.testing.assert_array_equal(mask, expected)
+
+
+    def testBlockAverage(self):
+        #5 planes by slabs of 2 planes, the last slab is a single plane
+        for factor in [2, 4, 7]:
+            data = (self.random.rand(5 * factor, 3 * factor, 4 * factor) > 0.5).astype(numpy.uint8)
+            expected = blockAveragePerVoxel(data, factor)
+            for slabSize in [1, 2, 5, 8]:
+                for volume in [data, data.astype(numpy.bool)]:
+                    pve = mriutil.blockAverage(volume, factor, slabSize)
+                    self.assertEqual(pve.dtype, numpy.float32)
+                    numpy.testing.assert_array_equal(pve, expected)
+
+
+    def testBlockAverageNotBinary(self):
+        #values that would overflow the integers used to sum a binary volume
+        for dtype in [numpy.uint8, numpy.int16, numpy.float32]:
+            data = (self.random.rand(3 * 7, 2 * 7, 2 * 7) * 250).astype(dtype)
+            expected = data.astype(numpy.float64).reshape(3, 7, 2, 7, 2, 7).mean(axis=(1, 3, 5))
+            numpy.testing.assert_allclose(mriutil.blockAverage(data, 7, 2), expected, rtol=1e-6)
+
+
+    @unittest.skipIf(vtk is None, "vtk is required")
+    def testFillSurface(self):
+        #this test was never run where it was written since vtk was not installed, neither the
+        #vtkImageStencilToImage path of vtk >= 5.10 nor the legacy cells layout given to SetCells are verified yet
+        #an octahedron centered into the volume
+        vertices = numpy.array([[1, 0, 0], [-1, 0, 0], [0, 1, 0], [0, -1, 0], [0, 0, 1], [0, 0, -1]]) * 9.5 + 12.3
+        polys = numpy.array([[0, 2, 4], [2, 1, 4], [1, 3, 4], [3, 0, 4],
+                             [2, 0, 5], [1, 2, 5], [3, 1, 5], [0, 3, 5]])
+        affine = numpy.diag([0.5, 0.5, 0.5, 1])
+        affine[:3, 3] = [1, 2, 3]
+        shape = numpy.array([40, 44, 48])
+        fill = mriutil.fillSurface(vertices, polys, affine, shape)
+        expected = fillSurfacePerPoint(vertices, polys, affine, shape)
+        self.assertTrue(expected.any())
+        numpy.testing.assert_array_equal(fill, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
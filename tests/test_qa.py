@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import ConfigParser
+import unittest
+import tempfile
+import shutil
+import time
+import os
+
+from core.toad.qa import Qa
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class FakeTask(Qa):
+
+    def __init__(self, directory, background):
+        self.workingDir = directory
+        self.config = ConfigParser.ConfigParser()
+        self.config.add_section('qa')
+        self.config.set('qa', 'background_rendering', str(background))
+        self.config.add_section('general')
+        self.config.set('general', 'tokens_file', os.path.join(directory, 'tokens'))
+
+
+    def getName(self):
+        return "fake"
+
+
+    def warning(self, message):
+        pass
+
+
+    def qaSupplier(self):
+        time.sleep(0.5)
+        return []
+
+
+    def createQaReport(self, images):
+        with open(os.path.join(self.workingDir, "fake.png"), 'w') as f:
+            f.write("image")
+
+
+def record(directory):
+    """Write a manifest that tells if the qa image existed when it was written
+    """
+    with open(os.path.join(directory, "fake.manifest"), 'w') as f:
+        f.write(str(os.path.exists(os.path.join(directory, "fake.png"))))
+
+
+class QaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+
+    def tearDown(self):
+        Qa.waitQaReports()
+        shutil.rmtree(self.directory)
+
+
+    def __readManifest(self):
+        with open(os.path.join(self.directory, "fake.manifest")) as f:
+            return f.read()
+
+
+    def testBackgroundRenderDoNotBlock(self):
+        task = FakeTask(self.directory, True)
+        start = time.time()
+        task.submitQaReport(lambda: record(self.directory))
+        self.assertLess(time.time() - start, 0.4)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "fake.manifest")))
+
+        task.waitQaReport()
+        self.assertEqual(Qa.renders, [])
+        self.assertEqual(self.__readManifest(), "True")
+
+
+    def testForegroundRender(self):
+        FakeTask(self.directory, False).submitQaReport(lambda: record(self.directory))
+        self.assertEqual(Qa.renders, [])
+        self.assertEqual(self.__readManifest(), "True")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+import ConfigParser
+import unittest
+import fcntl
+import tempfile
+import shutil
+import stat
+import os
+
+from core.toad import subjectmanager
+from core.toad.subjectmanager import SubjectManager
+from core.toad.logger import Logger
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+#record the command line and the standard input of every call then print a new job identifier
+FAKE_QSUB = """#!/bin/sh
+read input
+count=$(($(cat {0} 2>/dev/null | wc -l) + 1))
+echo "$input|$*" >> {0}
+echo "$count.fake"
+"""
+
+
+class FakeTask(object):
+
+    def __init__(self, name, dependencies, dirty=False):
+        self.name = name
+        self.dependencies = dependencies
+        self.dirty = dirty
+        self.released = False
+
+
+    def getName(self):
+        return self.name
+
+
+    def getModuleName(self):
+        return self.name
+
+
+    def getDependencies(self):
+        return self.dependencies
+
+
+    def getGridResources(self):
+        return {'threads': 2, 'memory': '4G', 'walltime': '01:00:00'}
+
+
+    def run(self):
+        self.lockedDuringRun = self.isLockHeld()
+
+
+    def isLockHeld(self):
+        """Determine if the lock of this task is held by another open file
+        """
+        with open(os.path.join(self.logDir, "subject.{}.lock".format(self.name)), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+
+    def releaseNTreads(self):
+        self.released = True
+
+
+    def isTaskDirty(self):
+        return self.dirty
+
+
+class FakeTasksManager(object):
+
+    tasks = []
+    evaluated = []
+
+    def __init__(self, subject, taskName=None):
+        self.taskName = taskName
+
+
+    def getRunnableTasks(self):
+        if self.taskName is None:
+            return FakeTasksManager.tasks
+        FakeTasksManager.evaluated.append(self.taskName)
+        return [task for task in FakeTasksManager.tasks if task.getName() == self.taskName and task.isTaskDirty()]
+
+
+    def getNumberOfRunnableTasks(self):
+        return len(FakeTasksManager.tasks)
+
+
+class FakeSubject(object):
+
+    def __init__(self, config, directory):
+        self.config = config
+        self.directory = directory
+        self.locked = False
+
+
+    def getConfig(self):
+        return self.config
+
+
+    def getName(self):
+        return "subject"
+
+
+    def getDir(self):
+        return self.directory
+
+
+    def getLogDir(self):
+        return os.path.join(self.directory, "log")
+
+
+    def createXmlSoftwareVersionConfig(self, softwareVersions):
+        pass
+
+
+    def isLock(self):
+        return self.locked
+
+
+    def getLock(self):
+        return os.path.join(self.getLogDir(), "subject.lock")
+
+
+class SubjectManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.record = os.path.join(self.directory, "qsub.log")
+        qsub = os.path.join(self.directory, "qsub")
+        with open(qsub, 'w') as f:
+            f.write(FAKE_QSUB.format(self.record))
+        os.chmod(qsub, os.stat(qsub).st_mode | stat.S_IXUSR)
+
+        self.config = ConfigParser.ConfigParser()
+        for section in ['general', 'arguments']:
+            self.config.add_section(section)
+        for option, value in {'qsub': qsub, 'sge_queue': 'all.q', 'server': 'unknown',
+                              'sge_parallel_environment': 'smp', 'grid_submission': 'task'}.iteritems():
+            self.config.set('general', option, value)
+        self.config.set('arguments', 'toad_dir', "/opt/toad")
+        self.config.set('arguments', 'tractography', 'True')
+
+        #the manager is not initialised, it would parse the command line arguments
+        self.manager = SubjectManager.__new__(SubjectManager)
+        self.manager.config = self.config
+        self.manager.softwareVersions = None
+        Logger.__init__(self.manager)
+        self.subject = FakeSubject(self.config, self.directory)
+        os.mkdir(self.subject.getLogDir())
+
+        self.tasksManager = subjectmanager.TasksManager
+        subjectmanager.TasksManager = FakeTasksManager
+        FakeTasksManager.tasks = [FakeTask("preparation", []),
+                                  FakeTask("denoising", ["preparation"]),
+                                  FakeTask("upsampling", ["denoising"]),
+                                  FakeTask("registration", ["preparation", "upsampling"])]
+        FakeTasksManager.evaluated = []
+        for task in FakeTasksManager.tasks:
+            task.logDir = self.subject.getLogDir()
+
+
+    def tearDown(self):
+        subjectmanager.TasksManager = self.tasksManager
+        shutil.rmtree(self.directory)
+
+
+    def __submit(self, engine):
+        self.config.set('general', 'grid_engine', engine)
+        self.manager._SubjectManager__submitGridEngineTasks(self.subject)
+        with open(self.record) as f:
+            return [line.rstrip("\n").split("|") for line in f.readlines()]
+
+
+    def __getFlag(self, flags, name):
+        tokens = flags.split()
+        if name not in tokens:
+            return None
+        return tokens[tokens.index(name) + 1]
+
+
+    def testSubmitSunGridEngineTasks(self):
+        calls = self.__submit('sge')
+        self.assertEqual(len(calls), 4)
+        for (toad, flags), task in zip(calls, FakeTasksManager.tasks):
+            self.assertIn("/opt/toad/bin/toad {}".format(self.directory), toad)
+            self.assertIn("--onlyTask {}".format(task.getName()), toad)
+            self.assertIn("-N subject_{}".format(task.getName()), flags)
+            self.assertIn("-pe smp 2 -l h_vmem=2048M -l h_rt=01:00:00", flags)
+            self.assertIn("-terse", flags)
+
+        self.assertEqual([self.__getFlag(flags, "-hold_jid") for toad, flags in calls],
+                         [None, "1.fake", "2.fake", "1.fake,3.fake"])
+
+
+    def testSubmitTorqueTasks(self):
+        calls = self.__submit('torque')
+        self.assertEqual(len(calls), 4)
+        for toad, flags in calls:
+            self.assertIn("-l nodes=1:ppn=2,mem=4gb,walltime=01:00:00", flags)
+            self.assertNotIn("-terse", flags)
+
+        self.assertEqual([self.__getFlag(flags, "-W") for toad, flags in calls],
+                         [None, "depend=afterok:1.fake", "depend=afterok:2.fake", "depend=afterok:1.fake:3.fake"])
+
+
+    def testStopBeforeTask(self):
+        self.config.set('arguments', 'stop_before_task', 'upsampling')
+        calls = self.__submit('sge')
+        self.assertEqual([toad.split("--onlyTask ")[1].split()[0] for toad, flags in calls], ["preparation", "denoising"])
+
+
+    def testOnlyTaskExitStatus(self):
+        task = FakeTasksManager.tasks[0]
+        task.dirty = True
+        with self.assertRaises(SystemExit) as context:
+            self.manager._SubjectManager__submitLocalTask(self.subject, task.getName())
+        self.assertEqual(context.exception.code, 100)
+        self.assertTrue(task.released)
+
+        task.dirty = False
+        task.released = False
+        self.manager._SubjectManager__submitLocalTask(self.subject, task.getName())
+        self.assertFalse(task.released)
+
+
+    def testOnlyTaskLock(self):
+        task = FakeTasksManager.tasks[1]
+        task.dirty = True
+        with self.assertRaises(SystemExit):
+            self.manager._SubjectManager__submitLocalTask(self.subject, task.getName())
+        self.assertTrue(task.lockedDuringRun)
+        self.assertFalse(task.isLockHeld())
+        #only the task of the job is evaluated
+        self.assertEqual(FakeTasksManager.evaluated, [task.getName()])
+
+
+    def testOnlyTaskSubjectLocked(self):
+        task = FakeTasksManager.tasks[0]
+        task.dirty = True
+        self.subject.locked = True
+        with self.assertRaises(SystemExit) as context:
+            self.manager._SubjectManager__submitLocalTask(self.subject, task.getName())
+        self.assertEqual(context.exception.code, 100)
+        self.assertEqual(FakeTasksManager.evaluated, [])
+        self.assertFalse(task.released)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+from core.toad import workflow
+
+__author__ = "Mathieu Desrosiers"
+__copyright__ = "Copyright (C) 2014, TOAD"
+__credits__ = ["Mathieu Desrosiers"]
+
+
+class FakeTask(object):
+
+    def __init__(self, name, order, dependencies, status="completed"):
+        self.name = name
+        self.order = order
+        self.dependencies = dependencies
+        self.status = status
+
+
+    def __repr__(self):
+        return self.name
+
+
+    def getName(self):
+        return self.name
+
+
+    def getOrder(self):
+        return self.order
+
+
+    def getDependencies(self):
+        return self.dependencies
+
+
+class WorkflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tasks = [FakeTask("outputs", 18, ["tensorfsl", "snr"]),
+                      FakeTask("snr", 17, ["correction"]),
+                      FakeTask("tensorfsl", 10, ["correction", "qa"]),
+                      FakeTask("correction", 5, ["preparation", "qa"]),
+                      FakeTask("custom", None, ["preparation"]),
+                      FakeTask("preparation", 1, ["backup", "qa"]),
+                      FakeTask("backup", 0, [])]
+
+
+    def __getStatuses(self, statuses):
+        for task in self.tasks:
+            task.status = statuses.get(task.getName(), "completed")
+        return dict((task.getName(), status) for task, status, reason in
+                    workflow.getWorkflow(workflow.sortTasks(self.tasks), lambda task: (task.status, "")))
+
+
+    def testSortTasks(self):
+        names = [task.getName() for task in workflow.sortTasks(self.tasks)]
+        self.assertEqual(names, ["backup", "preparation", "correction", "custom", "tensorfsl", "snr", "outputs"])
+
+
+    def testSortTasksCycle(self):
+        self.tasks.append(FakeTask("registration", 7, ["upsampling"]))
+        self.tasks.append(FakeTask("upsampling", 6, ["registration"]))
+        self.assertRaises(ValueError, workflow.sortTasks, self.tasks)
+
+
+    def testImpacts(self):
+        statuses = self.__getStatuses({"correction": "dirty"})
+        self.assertEqual(statuses, {"backup": "completed", "preparation": "completed", "custom": "completed",
+                                    "correction": "dirty", "tensorfsl": "impacted", "snr": "impacted",
+                                    "outputs": "impacted"})
+
+
+    def testIgnoredTasksDoNotImpact(self):
+        statuses = self.__getStatuses({"snr": "ignored", "backup": "ignored"})
+        self.assertEqual(statuses["snr"], "ignored")
+        self.assertEqual(statuses["outputs"], "completed")
+        self.assertEqual(statuses["preparation"], "completed")
+
+
+    def testUnknown(self):
+        statuses = self.__getStatuses({"snr": "unknown", "tensorfsl": "dirty"})
+        self.assertEqual(statuses["snr"], "unknown")
+        self.assertEqual(statuses["outputs"], "impacted")
+
+        statuses = self.__getStatuses({"snr": "unknown"})
+        self.assertEqual(statuses["outputs"], "unknown")
+        self.assertEqual(statuses["tensorfsl"], "completed")
+
+
+if __name__ == '__main__':
+    unittest.main()